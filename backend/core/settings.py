@@ -172,4 +172,175 @@ to optimize performance and data freshness across the application.
 """
 CACHE_TIMEOUT_SHORT = 300 
 CACHE_TIMEOUT_MEDIUM = 1800 
-CACHE_TIMEOUT_LONG = 7200
\ No newline at end of file
+CACHE_TIMEOUT_LONG = 7200
+"""
+Similarity graph retention.
+
+Both similarity builders (content-based and collaborative) keep at most
+SIMILARITY_TOP_K neighbors per product in ProductSimilarity, so storage
+grows linearly with the catalog. User-based collaborative filtering keeps
+USER_NEIGHBORS_TOP_K neighbors per user. The minimum scores are optional
+(None = keep the top K regardless of score).
+"""
+SIMILARITY_TOP_K = 20
+CONTENT_SIMILARITY_MIN_SCORE = 0.0
+COLLABORATIVE_SIMILARITY_MIN_SCORE = 0.0
+USER_NEIGHBORS_TOP_K = 30
+
+"""
+Incremental co-occurrence updates.
+
+An order folds the buyer's purchases into the co-occurrence accumulators
+at a cost quadratic in the number of distinct products the buyer owns, on
+the background worker pool. Buyers with more products are left to the
+full collaborative rebuild. A rebuild marker older than
+COOCCURRENCE_REBUILD_MAX_SECONDS is taken for a crashed rebuild and no
+longer holds back the folds.
+"""
+COLLABORATIVE_INCREMENTAL_MAX_PRODUCTS = 200
+COOCCURRENCE_REBUILD_MAX_SECONDS = 7200
+
+"""
+Similarity build parallelism.
+
+Number of worker processes used to score row blocks of the similarity
+builds (1 = single process). Set to the core count on batch servers.
+"""
+SIMILARITY_WORKERS = env.int("SIMILARITY_WORKERS", default=1)
+
+"""
+Similarity build memory budget.
+
+Memory (MB) one process may spend on a block product of the similarity
+builds. Row and column blocks are sized to fit it; unbounded results
+beyond it spill to temporary memory-mapped files. Implicit ALS cuts its
+solve batches so their k × k outer products fit it as well. Keep it well below
+the worker's memory limit (e.g. 512 for a 2 GB worker).
+"""
+SIMILARITY_MEMORY_BUDGET_MB = env.int("SIMILARITY_MEMORY_BUDGET_MB", default=512)
+
+"""
+Trained recommendation models.
+
+Directory where model-based recommenders persist their parameters
+(e.g. implicit ALS factors, implicit_als.npz). Must be shared by all
+web workers.
+"""
+RECOMMENDATION_MODEL_DIR = env("RECOMMENDATION_MODEL_DIR", default=os.path.join(BASE_DIR, "recommendation_models"))
+
+"""
+Implicit feedback weighting.
+
+Weight of every UserInteraction type in the interaction matrix
+(CustomInteractionMatrixBuilder) and the half-life, in days, of the
+exponential time decay applied to event timestamps (None = no decay).
+Incremental builds re-read the last INTERACTION_EVENT_ID_OVERLAP event ids
+below their high-water mark, so events committed out of id order are
+still folded in.
+"""
+INTERACTION_WEIGHTS = {
+    "view": 0.1,
+    "click": 0.25,
+    "add_to_cart": 0.5,
+    "purchase": 1.0,
+    "favorite": 0.5,
+}
+INTERACTION_HALF_LIFE_DAYS = env.int("INTERACTION_HALF_LIFE_DAYS", default=90)
+INTERACTION_EVENT_ID_OVERLAP = 1000
+
+"""
+Recommendations computed on read.
+
+A user's stored recommendations are recomputed when the user requests them
+once their inputs changed: the user's orders or cart, or the version of the
+similarity index (or user-neighbor store) they were scored on. At most
+RECOMMENDATION_ON_READ_MAX_SOURCES order lines (newest first) are aggregated
+on the request; the background write-back uses all of them. While the new
+index is not loaded in the process, the stored set is served and the
+recompute runs in the background.
+"""
+RECOMMENDATION_ON_READ_MAX_SOURCES = 200
+
+"""
+Age, in seconds, after which stored recommendations are recomputed on
+read even if their inputs did not change.
+"""
+RECOMMENDATION_MAX_AGE = 7200
+
+"""
+Process-local neighbor indexes.
+
+Shortest time, in seconds, between two reloads of a process's similarity
+graph / content vector index; version bumps inside the window are picked
+up by the next reload after it.
+"""
+NEIGHBOR_INDEX_MIN_RELOAD_SECONDS = 30
+
+"""
+Background recommendation work inside web processes.
+
+Worker threads per process for work taken off the request (index builds,
+recommendation write-backs) and the most tasks that may wait or run at
+once; further tasks are dropped until the queue drains.
+"""
+RECOMMENDATION_BACKGROUND_WORKERS = 2
+RECOMMENDATION_BACKGROUND_MAX_PENDING = 100
+
+"""
+Hybrid recommender.
+
+Blend weight of every source of the hybrid algorithm (0 disables a source)
+and the time, in milliseconds, each source may take before it is dropped
+from the response. A source that timed out keeps running in the shared
+pool; while HYBRID_SOURCE_MAX_IN_FLIGHT of its tasks are still running,
+new requests skip it.
+"""
+HYBRID_WEIGHTS = {
+    "collaborative": 0.35,
+    "content_based": 0.25,
+    "association": 0.2,
+    "markov": 0.1,
+    "fuzzy": 0.1,
+}
+HYBRID_SOURCE_BUDGET_MS = {
+    "collaborative": 150,
+    "content_based": 150,
+    "association": 100,
+    "markov": 200,
+    "fuzzy": 250,
+}
+HYBRID_SOURCE_MAX_IN_FLIGHT = 2
+
+"""
+Recommendation diversity.
+
+Weight λ of maximal marginal relevance re-ranking of recommendation lists
+(0 = plain score order, 1 = diversity only). The re-ranker picks the final
+list from RECOMMENDATION_DIVERSITY_POOL times as many scored candidates.
+"""
+RECOMMENDATION_DIVERSITY = 0.3
+RECOMMENDATION_DIVERSITY_POOL = 4
+
+"""
+Two-stage recommendation serving.
+
+Products scored per request by the fuzzy recommendation views: candidates
+come from the neighbor, association rule and popularity indexes, and only
+they are ranked by the weighted fuzzy inference, Naive Bayes purchase
+probability and sentiment models.
+"""
+RECOMMENDATION_CANDIDATES = 300
+RECOMMENDATION_RANKING_WEIGHTS = {
+    "fuzzy": 0.6,
+    "purchase_probability": 0.25,
+    "sentiment": 0.15,
+}
+
+"""
+Fuzzy product search.
+
+FUZZY_SEARCH_CANDIDATES: products per query that share the most trigrams
+with it (trigram inverted index); only they are scored by the fuzzy
+string matchers.
+"""
+FUZZY_SEARCH_CANDIDATES = 200
@@ -9,6 +9,8 @@ from .serializers import ProductSerializer
 from django.db.models import Prefetch, Count
 from rest_framework.permissions import IsAuthenticated
 from .custom_recommendation_engine import CustomAssociationRules
+from .product_exclusions import ProductBitset, get_user_exclusions
+from .recommendation_serving import bump_neighbor_index_version
 
 
 class FrequentlyBoughtTogetherAPI(APIView):
@@ -16,7 +18,9 @@ class FrequentlyBoughtTogetherAPI(APIView):
     API endpoint for 'Frequently Bought Together' product recommendations.
     
     Returns products commonly purchased with items in user's cart based on
-    association rules computed using Apriori algorithm.
+    association rules computed using Apriori algorithm. Products in the
+    request's cart and, for an authenticated user, products already bought
+    or in the stored cart are excluded (exclusion bitset mask).
     
     Algorithm: Association Rules (Market Basket Analysis)
     Ranking: Sorted by Lift then Confidence
@@ -42,28 +46,32 @@ class FrequentlyBoughtTogetherAPI(APIView):
 
         print(f"Received cart product IDs: {cart_product_ids}")
 
-        recommendations = []
-        seen_product_ids = set()
-
+        product_ids = []
         for product_id in cart_product_ids:
             try:
-                product_id_int = int(product_id)
+                product_ids.append(int(product_id))
             except ValueError:
                 continue
 
-            associations = (
-                ProductAssociation.objects.filter(product_1_id=product_id_int)
+        exclusions = ProductBitset.from_ids(product_ids)
+        if request.user.is_authenticated:
+            exclusions = exclusions.union(get_user_exclusions(request.user.id))
+
+        recommendations = []
+        seen_product_ids = set()
+
+        for product_id in product_ids:
+            associations = list(
+                ProductAssociation.objects.filter(product_1_id=product_id)
                 .select_related("product_2")
                 .order_by("-lift", "-confidence")[:5]
             )
 
-            print(f"Found {associations.count()} associations for product {product_id}")
+            print(f"Found {len(associations)} associations for product {product_id}")
 
-            for assoc in associations:
-                if (
-                    str(assoc.product_2_id) not in cart_product_ids
-                    and assoc.product_2_id not in seen_product_ids
-                ):
+            keep = exclusions.mask([assoc.product_2_id for assoc in associations])
+            for assoc, kept in zip(associations, keep):
+                if kept and assoc.product_2_id not in seen_product_ids:
                     try:
                         product_data = ProductSerializer(assoc.product_2).data
                         recommendations.append(
@@ -235,6 +243,7 @@ class UpdateAssociationRulesAPI(APIView):
                     print(f"💡 Try lowering thresholds or checking if transactions have enough product pairs")
                 
                 cache.delete("association_rules_list")
+                bump_neighbor_index_version("association")
                 
                 return Response(
                     {
@@ -1,10 +1,31 @@
 import re
+import json
+import hashlib
 from collections import defaultdict, Counter
+from datetime import timedelta
 from decimal import Decimal
-from django.db.models import Count, Sum, Avg
+from django.db import transaction
+from django.db.models import Count, Sum, Avg, Max, Min, Q, F
+from django.db.models.functions import Greatest
 from django.core.cache import cache
 from django.conf import settings
+from django.utils import timezone
 import math
+import os
+from array import array
+import numpy as np
+from scipy import sparse
+from .edit_distance import levenshtein_distance
+from .similarity_blocks import score_candidate_pairs, score_blocks, select_top_k_per_row
+from .recommendation_serving import (
+    bump_neighbor_index_version,
+    current_neighbor_index_version,
+    get_product_vector_index,
+    index_change_log_head,
+    read_index_changes,
+    record_index_changes,
+    submit_background_task,
+)
 
 try:
     from .models import Product, ProductSimilarity
@@ -13,6 +34,208 @@ except ImportError as e:
     Product = None
     ProductSimilarity = None
 
+
+# Default of optional arguments whose None is meaningful: read the setting instead
+FROM_SETTINGS = object()
+
+
+def sync_product_similarities(similarity_type, product1_ids, edges, score_epsilon=0.001, bump_version=True):
+    """
+    Replace the stored neighbors of a set of products, writing only the delta.
+    
+    The new edge set of product1_ids is diffed against ProductSimilarity:
+    missing edges are inserted, edges whose score moved by more than
+    score_epsilon are updated, edges no longer present are deleted and
+    everything else is left untouched. All writes of one call happen in a
+    single transaction, so readers never see a product without neighbors.
+    Any write invalidates the process-local neighbor indexes of the type,
+    unless bump_version is False: a full rebuild syncs block by block and
+    bumps the version once after its last block, so readers never reload a
+    half-written graph.
+    
+    Args:
+        similarity_type (str): 'content_based' or 'collaborative'
+        product1_ids (list): Products whose stored neighbor lists are replaced
+        edges (iterable): (product1_id, product2_id, score) for product1_ids
+        score_epsilon (float): Score change below which the stored edge is kept
+            (one unit of the stored 3-decimal score, which also absorbs the
+            rounding of the previously stored value)
+        bump_version (bool): Bump the neighbor index version after a write
+    
+    Returns:
+        Counter: {"created": n, "updated": n, "deleted": n, "unchanged": n}
+    """
+    product1_ids = list(product1_ids)
+    stats = Counter(created=0, updated=0, deleted=0, unchanged=0)
+
+    stored_edges = {}
+    for start in range(0, len(product1_ids), 1000):
+        for similarity_id, product1_id, product2_id, score in ProductSimilarity.objects.filter(
+            similarity_type=similarity_type, product1_id__in=product1_ids[start:start + 1000]
+        ).values_list("id", "product1_id", "product2_id", "similarity_score"):
+            stored_edges[(product1_id, product2_id)] = (similarity_id, float(score))
+
+    similarities_to_create = []
+    similarities_to_update = []
+    now = timezone.now()
+
+    for product1_id, product2_id, score in edges:
+        stored = stored_edges.pop((product1_id, product2_id), None)
+        if stored is None:
+            similarities_to_create.append(
+                ProductSimilarity(
+                    product1_id=product1_id,
+                    product2_id=product2_id,
+                    similarity_type=similarity_type,
+                    similarity_score=score,
+                )
+            )
+        elif abs(stored[1] - score) > score_epsilon:
+            similarities_to_update.append(
+                ProductSimilarity(id=stored[0], similarity_score=score, updated_at=now)
+            )
+        else:
+            stats["unchanged"] += 1
+
+    stale_ids = [similarity_id for similarity_id, _ in stored_edges.values()]
+
+    with transaction.atomic():
+        for start in range(0, len(stale_ids), 1000):
+            ProductSimilarity.objects.filter(id__in=stale_ids[start:start + 1000]).delete()
+        ProductSimilarity.objects.bulk_update(
+            similarities_to_update, ["similarity_score", "updated_at"], batch_size=1000
+        )
+        ProductSimilarity.objects.bulk_create(similarities_to_create, batch_size=1000)
+
+    stats["created"] += len(similarities_to_create)
+    stats["updated"] += len(similarities_to_update)
+    stats["deleted"] += len(stale_ids)
+
+    if bump_version and (similarities_to_create or similarities_to_update or stale_ids):
+        transaction.on_commit(lambda: bump_neighbor_index_version(similarity_type))
+    return stats
+
+
+def replace_recommendations(recommendation_type, scores_by_user, version=""):
+    """
+    Replace the stored recommendations of one type for a set of users.
+    
+    The whole set is written with batched INSERT ... ON CONFLICT
+    (user, product, recommendation_type) DO UPDATE SET score, and rows of
+    products no longer recommended are deleted, in one transaction: a
+    few round trips per batch of users instead of two queries per product.
+    
+    Args:
+        recommendation_type (str): Algorithm the recommendations come from
+        scores_by_user (dict): {user_id: {product_id: score}}
+        version (str|dict): recommendation_version() the scores were computed
+            at, or {user_id: version} when every user has their own
+    
+    Returns:
+        Counter: {"written": n, "deleted": n}
+    """
+    from home.models import UserProductRecommendation
+
+    versions = version if isinstance(version, dict) else defaultdict(lambda: version)
+
+    # score is DecimalField(max_digits=5, decimal_places=3)
+    recommendations = [
+        UserProductRecommendation(
+            user_id=user_id,
+            product_id=product_id,
+            recommendation_type=recommendation_type,
+            score=min(max(score, -99.999), 99.999),
+            version=versions[user_id],
+        )
+        for user_id, scores in scores_by_user.items()
+        for product_id, score in scores.items()
+    ]
+
+    with transaction.atomic():
+        stored = UserProductRecommendation.objects.filter(
+            user_id__in=list(scores_by_user), recommendation_type=recommendation_type
+        ).values_list("id", "user_id", "product_id")
+        stale_ids = [
+            recommendation_id
+            for recommendation_id, user_id, product_id in stored
+            if product_id not in scores_by_user[user_id]
+        ]
+        deleted = 0
+        for start in range(0, len(stale_ids), 1000):
+            deleted += UserProductRecommendation.objects.filter(
+                id__in=stale_ids[start:start + 1000]
+            ).delete()[0]
+
+        UserProductRecommendation.objects.bulk_create(
+            recommendations,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=["user", "product", "recommendation_type"],
+            update_fields=["score", "version"],
+        )
+
+    return Counter(written=len(recommendations), deleted=deleted)
+
+
+def replace_user_recommendations(user_id, recommendation_type, scores, version=""):
+    """
+    Replace a user's stored recommendations of one type with a new set.
+    
+    Args:
+        user_id (int): User whose recommendations are replaced
+        recommendation_type (str): Algorithm the recommendations come from
+        scores (dict): {product_id: score}
+        version (str): recommendation_version() the scores were computed at
+    
+    Returns:
+        Counter: {"written": n, "deleted": n}
+    """
+    return replace_recommendations(recommendation_type, {user_id: scores}, version)
+
+
+def load_npz_model(path):
+    """
+    Load a persisted .npz model, cached per process until the file changes.
+    
+    Returns:
+        dict|None: {array name: ndarray}, None if the file does not exist
+    """
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    cached = _npz_model_cache.get(path)
+    if cached is not None and cached[0] == modified:
+        return cached[1]
+
+    with np.load(path) as archive:
+        model = {name: archive[name] for name in archive.files}
+    _npz_model_cache[path] = (modified, model)
+    return model
+
+
+def cooccurrence_rebuild_running():
+    """True while a co-occurrence rebuild marker younger than COOCCURRENCE_REBUILD_MAX_SECONDS exists"""
+    from home.models import CooccurrenceRebuild
+
+    max_age = getattr(settings, "COOCCURRENCE_REBUILD_MAX_SECONDS", 7200)
+    return CooccurrenceRebuild.objects.filter(
+        started_at__gte=timezone.now() - timedelta(seconds=max_age)
+    ).exists()
+
+
+def npz_model_loaded(path):
+    """True if load_npz_model(path) is served without reading the file (cached or missing)"""
+    try:
+        modified = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+    cached = _npz_model_cache.get(path)
+    return cached is not None and cached[0] == modified
+
+
 class CustomContentBasedFilter:
     """
     Content-Based Filtering recommendation engine using weighted feature vectors and Cosine Similarity.
@@ -27,233 +250,2475 @@ class CustomContentBasedFilter:
         - Keywords: 10% (TF-IDF from description)
     
     Optimizations:
-        - Batch processing with bulk database operations
-        - Result caching (2 hours)
-        - Similarity threshold pruning (> 0.2)
-        - Limited comparisons per product (max 50)
+        - Sparse CSR feature matrix encoded once per run
+        - Inverted index feature → products: only pairs sharing a feature are scored
+        - Batch processing with bulk database operations
+        - Result caching (2 hours)
+        - Bounded retention: top-K neighbors per product (settings.SIMILARITY_TOP_K),
+          optional minimum score (settings.CONTENT_SIMILARITY_MIN_SCORE)
+    """
+    
+    def __init__(self):
+        self.similarity_threshold = getattr(settings, 'CONTENT_SIMILARITY_MIN_SCORE', 0.0)
+        self.top_k_neighbors = getattr(settings, 'SIMILARITY_TOP_K', 20)
+        self.block_size = 1000
+        self.workers = getattr(settings, 'SIMILARITY_WORKERS', 1)
+        self.memory_budget_mb = getattr(settings, 'SIMILARITY_MEMORY_BUDGET_MB', None)
+        self.last_write_stats = None
+        self.max_feature_postings = None
+        self.use_lsh = False
+        self.lsh_num_bands = 32
+        self.lsh_rows_per_band = 2
+        self.max_keywords = 5
+        self.max_keyword_document_ratio = 0.5
+        self.feature_store_version = 2
+        self._idf = None
+        
+        self.feature_weights = {
+            'category': 0.40,    
+            'tag': 0.30,        
+            'price': 0.20,      
+            'keywords': 0.10    
+        }
+        
+        self.stop_words = {
+            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
+            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 
+            'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
+            'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 
+            'they', 'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its',
+            'our', 'their', 'jako', 'że', 'na', 'w', 'z', 'do', 'od', 'po', 'przez'
+        }
+
+    def calculate_product_similarity(self, product1, product2):
+        """
+        Calculate weighted cosine similarity between two products.
+        
+        Args:
+            product1: First product object
+            product2: Second product object
+        
+        Returns:
+            float: Similarity score [0.0, 1.0]
+        
+        Formula: cos(θ) = Σ(f1[i] × f2[i]) / √(Σf1[i]² × Σf2[i]²)
+        """
+        features1 = self._extract_weighted_features(product1)
+        features2 = self._extract_weighted_features(product2)
+        
+        dot_product = 0.0
+        norm1 = 0.0
+        norm2 = 0.0
+        
+        all_features = set(features1.keys()) | set(features2.keys())
+        
+        for feature in all_features:
+            val1 = features1.get(feature, 0.0)
+            val2 = features2.get(feature, 0.0)
+            
+            dot_product += val1 * val2
+            norm1 += val1 * val1
+            norm2 += val2 * val2
+            
+        if norm1 == 0 or norm2 == 0:
+            return 0.0
+            
+        return dot_product / (math.sqrt(norm1) * math.sqrt(norm2))
+
+    def _extract_weighted_features(self, product):
+        """
+        Extract weighted feature vector from product attributes.
+        
+        Features:
+            - category_*: 40% weight
+            - tag_*: 30% weight
+            - price_*: 20% weight (low/medium/high/premium)
+            - keyword_*: 10% weight (split among top 5 TF-IDF keywords)
+        
+        Args:
+            product: Product object with categories, tags, description
+        
+        Returns:
+            dict: {"feature_name": weight}
+        """
+        categorical_features, term_counts = self._extract_feature_components(product)
+        return self._combine_features(
+            categorical_features, term_counts, self._get_inverse_document_frequencies()
+        )
+
+    def _extract_feature_components(self, product):
+        """
+        Extract the raw components of a product feature vector.
+        
+        Returns:
+            tuple: ({"category_*"/"tag_*"/"price_*": weight}, {"term": count})
+        """
+        categorical_features = {}
+        
+        for category in product.categories.all():
+            feature_name = f"category_{category.name.lower()}"
+            categorical_features[feature_name] = self.feature_weights['category']
+        
+        for tag in product.tags.all():
+            feature_name = f"tag_{tag.name.lower()}"
+            categorical_features[feature_name] = self.feature_weights['tag']
+        
+        price_category = self._get_price_category(product.price)
+        categorical_features[f"price_{price_category}"] = self.feature_weights['price']
+        
+        term_counts = self._extract_term_counts(product.description)
+        
+        return categorical_features, term_counts
+
+    def _combine_features(self, categorical_features, term_counts, idf):
+        """
+        Combine stored feature components into the weighted feature vector.
+        
+        The 10% keyword weight is split among the top 5 TF-IDF keywords
+        proportionally to their TF-IDF scores.
+        """
+        features = dict(categorical_features)
+        
+        top_keywords = self._rank_keywords(term_counts, idf)[:self.max_keywords]
+        total_score = sum(score for _, score in top_keywords)
+        for keyword, score in top_keywords:
+            feature_name = f"keyword_{keyword}"
+            features[feature_name] = self.feature_weights['keywords'] * score / total_score
+        
+        return features
+
+    def _rank_keywords(self, term_counts, idf):
+        """
+        Rank description terms by TF-IDF.
+        
+        Formula: tfidf(t) = tf(t) × idf(t)
+        Terms too common in the corpus (idf = 0) are dropped.
+        
+        Args:
+            term_counts (dict): {"term": count} for one description
+            idf (tuple): (idf_by_term, default_idf) from _get_inverse_document_frequencies
+        
+        Returns:
+            list: [(term, score)] sorted by score descending
+        """
+        idf_by_term, default_idf = idf
+        total_terms = sum(term_counts.values())
+        if total_terms == 0:
+            return []
+        
+        scored = []
+        for term, count in term_counts.items():
+            score = (count / total_terms) * idf_by_term.get(term, default_idf)
+            if score > 0:
+                scored.append((term, score))
+        
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored
+
+    def _content_hash(self, product):
+        """
+        Hash every input of feature extraction for a product.
+        
+        Inputs: description, price, category names, tag names, the feature
+        weights and the store format version (changing either invalidates
+        the store).
+        
+        Returns:
+            str: SHA-256 hex digest
+        """
+        payload = json.dumps([
+            self.feature_store_version,
+            sorted(self.feature_weights.items()),
+            product.description or "",
+            str(Decimal(str(product.price)).quantize(Decimal("0.01"))),
+            sorted(category.name for category in product.categories.all()),
+            sorted(tag.name for tag in product.tags.all()),
+        ])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_feature_vectors(self, products):
+        """
+        Get weighted feature vectors from the persisted feature store.
+        
+        Stored vectors are reused while their content hash matches the
+        product; missing or stale vectors are re-extracted and upserted
+        into ProductFeatureVector in bulk.
+        
+        Args:
+            products: Iterable of products (categories and tags prefetched)
+        
+        Returns:
+            dict: {product_id: {"feature_name": weight}}
+        """
+        components = self._refresh_feature_store(products)
+        idf = self._get_inverse_document_frequencies()
+        return {
+            product_id: self._combine_features(categorical_features, term_counts, idf)
+            for product_id, (categorical_features, term_counts) in components.items()
+        }
+
+    def _refresh_feature_store(self, products, track_document_frequency=True):
+        """
+        Re-extract stale or missing feature store rows.
+        
+        Args:
+            products: Iterable of products (categories and tags prefetched)
+            track_document_frequency (bool): Apply term set changes of
+                re-extracted products to KeywordDocumentFrequency
+        
+        Returns:
+            dict: {product_id: (categorical_features, term_counts)}
+        """
+        from home.models import ProductFeatureVector
+
+        products = list(products)
+        stored_vectors = {}
+        product_ids = [product.id for product in products]
+        for start in range(0, len(product_ids), 1000):
+            for stored in ProductFeatureVector.objects.filter(
+                product_id__in=product_ids[start:start + 1000]
+            ):
+                stored_vectors[stored.product_id] = stored
+
+        components = {}
+        vectors_to_upsert = []
+        document_frequency_deltas = Counter()
+
+        for product in products:
+            content_hash = self._content_hash(product)
+            stored = stored_vectors.get(product.id)
+
+            if stored is not None and stored.content_hash == content_hash:
+                categorical_features, term_counts = stored.categorical_features, stored.term_counts
+            else:
+                categorical_features, term_counts = self._extract_feature_components(product)
+                vectors_to_upsert.append(
+                    ProductFeatureVector(
+                        product_id=product.id,
+                        categorical_features=categorical_features,
+                        term_counts=term_counts,
+                        content_hash=content_hash,
+                    )
+                )
+                previous_terms = set(stored.term_counts) if stored is not None else set()
+                for term in set(term_counts) - previous_terms:
+                    document_frequency_deltas[term] += 1
+                for term in previous_terms - set(term_counts):
+                    document_frequency_deltas[term] -= 1
+
+            components[product.id] = (categorical_features, term_counts)
+
+        if vectors_to_upsert:
+            with transaction.atomic():
+                ProductFeatureVector.objects.bulk_create(
+                    vectors_to_upsert,
+                    batch_size=1000,
+                    update_conflicts=True,
+                    unique_fields=["product"],
+                    update_fields=["categorical_features", "term_counts", "content_hash", "updated_at"],
+                )
+                if track_document_frequency:
+                    self.apply_document_frequency_deltas(document_frequency_deltas)
+                # Process-local vector indexes re-read these rows only
+                upserted_ids = [vector.product_id for vector in vectors_to_upsert]
+                transaction.on_commit(lambda: record_index_changes("content_features", upserted_ids))
+            print(f"Feature store: re-extracted {len(vectors_to_upsert)} of {len(products)} product vectors")
+
+        return components
+
+    def _load_feature_store(self, refresh_product_ids=()):
+        """
+        Read feature vectors of the whole catalog from the feature store.
+        
+        Only the products in refresh_product_ids (hash-checked) and products
+        not yet present in the store are extracted; every other vector is
+        read as stored, without touching categories, tags or descriptions.
+        
+        Returns:
+            dict: {product_id: {"feature_name": weight}}
+        """
+        self._refresh_products(refresh_product_ids, include_missing=True)
+        return self._read_feature_store()
+
+    def _refresh_products(self, product_ids, include_missing=False):
+        """Hash-check and re-extract the vectors of some products (and of every product without one)"""
+        from home.models import Product, KeywordDocumentFrequency
+
+        bootstrap_document_frequencies = not KeywordDocumentFrequency.objects.exists()
+        if bootstrap_document_frequencies:
+            self.rebuild_document_frequencies()
+
+        selection = Q(id__in=list(product_ids))
+        if include_missing:
+            selection |= Q(feature_vector__isnull=True)
+        self._refresh_feature_store(
+            Product.objects.filter(selection).prefetch_related("categories", "tags"),
+            track_document_frequency=not bootstrap_document_frequencies,
+        )
+
+    def _read_feature_store(self, product_ids=None):
+        """
+        Feature vectors as stored (nothing extracted or written).
+        
+        Args:
+            product_ids (iterable|None): Products to read (None = whole store)
+        
+        Returns:
+            dict: {product_id: {"feature_name": weight}}
+        """
+        from home.models import ProductFeatureVector
+
+        stored = ProductFeatureVector.objects.all()
+        if product_ids is not None:
+            stored = stored.filter(product_id__in=list(product_ids))
+
+        idf = self._get_inverse_document_frequencies()
+        return {
+            product_id: self._combine_features(categorical_features, term_counts, idf)
+            for product_id, categorical_features, term_counts in stored.values_list(
+                "product_id", "categorical_features", "term_counts"
+            ).iterator(chunk_size=2000)
+        }
+
+    def rebuild_document_frequencies(self):
+        """
+        Rebuild the corpus document frequency table from scratch.
+        
+        One streaming pass over all product descriptions; only the
+        description column is read.
+        
+        Returns:
+            int: Number of documents (products) counted
+        """
+        from home.models import Product, KeywordDocumentFrequency
+
+        document_frequencies = Counter()
+        document_count = 0
+        for description in Product.objects.values_list("description", flat=True).iterator(chunk_size=2000):
+            document_frequencies.update(self._extract_term_counts(description).keys())
+            document_count += 1
+
+        with transaction.atomic():
+            KeywordDocumentFrequency.objects.all().delete()
+            KeywordDocumentFrequency.objects.bulk_create(
+                [
+                    KeywordDocumentFrequency(term=term, document_frequency=frequency)
+                    for term, frequency in document_frequencies.items()
+                ],
+                batch_size=1000,
+            )
+
+        self._idf = None
+        print(f"Rebuilt document frequencies: {len(document_frequencies)} terms over {document_count} products")
+        return document_count
+
+    def apply_document_frequency_deltas(self, deltas):
+        """
+        Incrementally update KeywordDocumentFrequency.
+        
+        Args:
+            deltas (dict): {"term": change in number of documents containing it}
+        """
+        from home.models import KeywordDocumentFrequency
+
+        terms_by_delta = defaultdict(list)
+        for term, delta in deltas.items():
+            if delta:
+                terms_by_delta[delta].append(term)
+        if not terms_by_delta:
+            return
+
+        new_terms = [term for delta, terms in terms_by_delta.items() if delta > 0 for term in terms]
+        KeywordDocumentFrequency.objects.bulk_create(
+            [KeywordDocumentFrequency(term=term, document_frequency=0) for term in new_terms],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        for delta, terms in terms_by_delta.items():
+            for start in range(0, len(terms), 1000):
+                KeywordDocumentFrequency.objects.filter(term__in=terms[start:start + 1000]).update(
+                    document_frequency=Greatest(F("document_frequency") + delta, 0)
+                )
+        KeywordDocumentFrequency.objects.filter(document_frequency=0).delete()
+
+        self._idf = None
+
+    def _get_inverse_document_frequencies(self):
+        """
+        Load inverse document frequencies from KeywordDocumentFrequency.
+        
+        Formula: idf(t) = ln((1 + N) / (1 + df(t))) + 1
+        Terms found in more than max_keyword_document_ratio of all products
+        get idf = 0 (too common to describe a product).
+        
+        Returns:
+            tuple: ({"term": idf}, default idf for terms not in the table)
+        """
+        from home.models import Product, KeywordDocumentFrequency
+
+        if self._idf is None:
+            document_count = Product.objects.count()
+            max_document_frequency = self.max_keyword_document_ratio * document_count
+            idf_by_term = {}
+            for term, frequency in KeywordDocumentFrequency.objects.values_list(
+                "term", "document_frequency"
+            ).iterator(chunk_size=5000):
+                if frequency > max_document_frequency:
+                    idf_by_term[term] = 0.0
+                else:
+                    idf_by_term[term] = math.log((1 + document_count) / (1 + frequency)) + 1
+            default_idf = math.log(1 + document_count) + 1
+            self._idf = (idf_by_term, default_idf)
+
+        return self._idf
+
+    def _get_price_category(self, price):
+        """
+        Categorize product price into discrete ranges.
+        
+        Ranges:
+            - "low": < $100
+            - "medium": $100 - $500
+            - "high": $500 - $1500
+            - "premium": >= $1500
+        """
+        if price < 100:
+            return "low"
+        elif price < 500:
+            return "medium"
+        elif price < 1500:
+            return "high"
+        else:
+            return "premium"
+
+    def _extract_term_counts(self, text):
+        """
+        Tokenize a product description into term counts.
+        
+        Algorithm:
+            1. Remove punctuation, lowercase
+            2. Filter stop words and short words (< 4 chars)
+            3. Count term occurrences
+        
+        Returns:
+            dict: {"term": count}
+        """
+        if not text:
+            return {}
+        
+        text = re.sub(r'[^\w\s]', ' ', text.lower())
+        words = text.split()
+        
+        filtered_words = [
+            word for word in words 
+            if 3 < len(word) <= 100 and word not in self.stop_words
+        ]
+        
+        return dict(Counter(filtered_words))
+
+    def _extract_keywords(self, text):
+        """
+        Extract keywords from product description using TF-IDF.
+        
+        Returns:
+            list: Top 10 keywords
+        """
+        ranked = self._rank_keywords(
+            self._extract_term_counts(text), self._get_inverse_document_frequencies()
+        )
+        return [term for term, _ in ranked[:10]]
+
+    def _build_feature_matrix(self, feature_vectors):
+        """
+        Encode weighted product features into a sparse CSR matrix.
+        
+        Each row is one product (ordered by product id), each column one
+        feature name (category_*, tag_*, price_*, keyword_*).
+        
+        Args:
+            feature_vectors (dict): {product_id: {"feature_name": weight}}
+        
+        Returns:
+            tuple: (csr_matrix [n_products × n_features], product_ids array, {"feature_name": column})
+        """
+        feature_index = {}
+        product_ids = sorted(feature_vectors)
+        indptr = [0]
+        indices = []
+        data = []
+
+        for product_id in product_ids:
+            for feature_name, weight in feature_vectors[product_id].items():
+                column = feature_index.setdefault(feature_name, len(feature_index))
+                indices.append(column)
+                data.append(weight)
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix(
+            (
+                np.asarray(data, dtype=np.float64),
+                np.asarray(indices, dtype=np.int32),
+                np.asarray(indptr, dtype=np.int64),
+            ),
+            shape=(len(product_ids), len(feature_index)),
+        )
+        return matrix, np.asarray(product_ids, dtype=np.int64), feature_index
+
+    def _normalize_rows(self, matrix):
+        """
+        Scale every row of a sparse matrix to unit L2 norm.
+        
+        After normalization the plain dot product of two rows equals their
+        cosine similarity, so X · Xᵀ yields all pairwise cosines at once.
+        Empty rows are left as zeros.
+        """
+        squared_norms = np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel()
+        norms = np.sqrt(squared_norms)
+        inverse_norms = np.divide(
+            1.0, norms, out=np.zeros_like(norms), where=norms > 0
+        )
+        return sparse.diags(inverse_norms).dot(matrix).tocsr()
+
+    def _build_inverted_index(self, normalized_matrix):
+        """
+        Build an inverted index feature → product ids for candidate generation.
+        
+        Features whose posting list is longer than max_feature_postings
+        (e.g. a price bucket shared by a quarter of the catalog) are left out
+        of the index, so sharing only such features does not make two
+        products candidates. Their weights are kept in a small dense matrix
+        and still added to the score of every candidate pair.
+        
+        Returns:
+            tuple: (indexed CSR [n_products × n_indexed_features],
+                    postings CSR [n_indexed_features × n_products],
+                    dense weights of capped features [n_products × n_capped_features])
+        """
+        posting_lengths = np.diff(normalized_matrix.tocsc().indptr)
+        if self.max_feature_postings is None:
+            capped = np.zeros(len(posting_lengths), dtype=bool)
+        else:
+            capped = posting_lengths > self.max_feature_postings
+
+        indexed_matrix = normalized_matrix[:, np.flatnonzero(~capped)].tocsr()
+        postings = indexed_matrix.T.tocsr()
+        capped_weights = normalized_matrix[:, np.flatnonzero(capped)].toarray()
+
+        if capped.any():
+            print(f"Inverted index: {int(capped.sum())} features above {self.max_feature_postings} postings skipped")
+
+        return indexed_matrix, postings, capped_weights
+
+    def _similarity_pairs_for_rows(self, inverted_index, row_indices, retain_top_k=True):
+        """
+        Compute top-K cosine neighbors of the given rows among their candidates.
+        
+        Candidates are the products sharing at least one indexed feature with
+        a row (a walk over the posting lists, done as one sparse product);
+        products sharing nothing are never scored.
+        
+        Args:
+            inverted_index: Output of _build_inverted_index
+            row_indices: Matrix rows to score
+            retain_top_k (bool): Apply top_k_neighbors (False = every candidate)
+        
+        Returns:
+            tuple: (row indices, column indices, scores), at most top_k_neighbors
+                   per row, scores above similarity_threshold, self-pairs excluded
+        """
+        top_k = self.top_k_neighbors if retain_top_k else None
+        return score_candidate_pairs(inverted_index, row_indices, self.similarity_threshold, top_k)
+
+    def generate_similarities_for_all_products(self):
+        """
+        Generate content-based similarities for all products in catalog.
+        
+        Algorithm:
+            1. Rebuild corpus document frequencies (keyword IDF) in one pass
+            2. Encode features of the whole catalog once into a sparse CSR matrix X
+            3. L2-normalize rows of X, build inverted index feature → products
+            4. For each block of rows: score only candidate pairs sharing an indexed feature
+            5. Keep the top_k_neighbors pairs per product with score > similarity_threshold
+        
+        Optimizations:
+            - Caching: Results cached for 2 hours
+            - Delta writes: Only inserts, score updates (> 0.001) and deletes
+              against the stored edges, one transaction per row block
+            - Top-K retention: Stored rows grow linearly with catalog size
+            - Row blocks: Memory bounded by block_size × n_products
+            - Parallel mode: workers > 1 scores row blocks in a process pool
+              sharing the memory-mapped index (settings.SIMILARITY_WORKERS)
+            - Memory budget: Row/column blocks sized to settings.SIMILARITY_MEMORY_BUDGET_MB
+            - Feature store: Only products whose content hash changed are re-extracted
+        
+        Performance:
+            - Work proportional to feature overlaps, not n_products²
+            - Optional max_feature_postings cap skips very common features
+              (price buckets, ubiquitous tags) during candidate generation
+            - No per-pair Python work, whole catalog processed
+            - use_lsh: approximate top_k_neighbors per product from a
+              MinHash LSH index instead (sub-linear per product, very large catalogs)
+        
+        Returns:
+            int: Number of similarity records stored (write counts in last_write_stats)
+        """
+        from home.models import Product
+
+        cache_key = "content_based_similarity_matrix"
+        cached_result = cache.get(cache_key)
+        
+        if cached_result:
+            print("Using cached content-based filtering results")
+            return cached_result
+
+        self.rebuild_document_frequencies()
+        products = Product.objects.prefetch_related("categories", "tags")
+        components = self._refresh_feature_store(products, track_document_frequency=False)
+        idf = self._get_inverse_document_frequencies()
+        feature_vectors = {
+            product_id: self._combine_features(categorical_features, term_counts, idf)
+            for product_id, (categorical_features, term_counts) in components.items()
+        }
+        feature_matrix, product_ids, feature_index = self._build_feature_matrix(feature_vectors)
+        
+        if len(product_ids) < 2:
+            return 0
+
+        print(
+            f"Processing {len(product_ids)} products with {len(feature_index)} features "
+            f"for enhanced content-based similarity"
+        )
+
+        if self.use_lsh:
+            lsh_index = CustomMinHashLSH(
+                num_bands=self.lsh_num_bands, rows_per_band=self.lsh_rows_per_band
+            ).fit(feature_matrix, product_ids)
+            scored_blocks = (
+                (start, stop, lsh_index.neighbor_pairs(
+                    start, stop, self.top_k_neighbors, self.similarity_threshold
+                ))
+                for start, stop in (
+                    (start, min(start + self.block_size, len(product_ids)))
+                    for start in range(0, len(product_ids), self.block_size)
+                )
+            )
+        else:
+            inverted_index = self._build_inverted_index(self._normalize_rows(feature_matrix))
+            if self.workers > 1:
+                print(f"Scoring row blocks in {self.workers} worker processes")
+            scored_blocks = score_blocks(
+                inverted_index, self.block_size, self.similarity_threshold,
+                self.top_k_neighbors, workers=self.workers,
+                memory_budget_mb=self.memory_budget_mb,
+            )
+
+        write_stats = Counter()
+        similarities_created = 0
+
+        for start, stop, (rows, columns, scores) in scored_blocks:
+            print(f"Processed {start}/{len(product_ids)} products")
+
+            write_stats.update(
+                sync_product_similarities(
+                    "content_based",
+                    product_ids[start:stop].tolist(),
+                    zip(product_ids[rows].tolist(), product_ids[columns].tolist(), scores.tolist()),
+                    bump_version=False,
+                )
+            )
+            similarities_created += len(rows)
+
+        if write_stats["created"] or write_stats["updated"] or write_stats["deleted"]:
+            # Once, after the last block: readers reload the finished graph only
+            bump_neighbor_index_version("content_based")
+
+        self.last_write_stats = dict(write_stats)
+        print(
+            f"Stored {similarities_created} enhanced content-based similarities "
+            f"(created {write_stats['created']}, updated {write_stats['updated']}, "
+            f"deleted {write_stats['deleted']}, unchanged {write_stats['unchanged']})"
+        )
+        
+        cache.set(cache_key, similarities_created, timeout=getattr(settings, 'CACHE_TIMEOUT_LONG', 7200))
+        
+        return similarities_created
+
+    def get_lsh_index(self, build=True):
+        """
+        Get the MinHash LSH index of the current feature store.
+        
+        The index is kept per process and checked against the content_based
+        version token (one cache read); after a bump it is refitted only if
+        the feature store changed (row count or latest update).
+        
+        Args:
+            build (bool): Build or refresh a missing / stale index in this call.
+                False serves the process's last index (None before the first
+                build) and refreshes it on the background worker pool from the
+                stored vectors only, so the caller never extracts or writes.
+        
+        Returns:
+            CustomMinHashLSH|None: Fitted index
+        """
+        cached = _lsh_index_cache.get("content_based")
+        if cached is not None and cached[0] == current_neighbor_index_version("content_based"):
+            return cached[2]
+
+        if build:
+            return self._refresh_lsh_index(extract_missing=True)
+
+        submit_background_task("lsh_index_content_based", self._refresh_lsh_index, False)
+        return cached[2] if cached is not None else None
+
+    def _refresh_lsh_index(self, extract_missing):
+        """Refit the process's LSH index if the feature store changed since it was built"""
+        from home.models import ProductFeatureVector
+
+        version = current_neighbor_index_version("content_based")
+        state = ProductFeatureVector.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+        fingerprint = (state["count"], state["updated"], self.lsh_num_bands, self.lsh_rows_per_band)
+
+        cached = _lsh_index_cache.get("content_based")
+        if cached is not None and cached[1] == fingerprint:
+            lsh_index = cached[2]
+        else:
+            feature_vectors = self._load_feature_store() if extract_missing else self._read_feature_store()
+            feature_matrix, product_ids, _ = self._build_feature_matrix(feature_vectors)
+            lsh_index = CustomMinHashLSH(
+                num_bands=self.lsh_num_bands, rows_per_band=self.lsh_rows_per_band
+            ).fit(feature_matrix, product_ids)
+
+        _lsh_index_cache["content_based"] = (version, fingerprint, lsh_index)
+        return lsh_index
+
+    def get_similar_products(self, product_id, top_k=10, build=True):
+        """
+        "Similar to product X" lookup from the LSH index (does not read ProductSimilarity).
+        
+        Args:
+            build (bool): See get_lsh_index
+        
+        Returns:
+            list|None: [(product_id, cosine_score)] best first; None when
+                build is False and the process has no index yet
+        """
+        lsh_index = self.get_lsh_index(build=build)
+        if lsh_index is None:
+            return None
+        return lsh_index.get_similar_products(product_id, top_k)
+
+    def update_similarities_for_product(self, product_id):
+        """Incrementally refresh content-based similarities around a single product"""
+        return self.update_similarities_for_products([product_id])
+
+    def update_similarities_for_products(self, product_ids):
+        """
+        Incrementally refresh content-based similarities around changed products.
+        
+        Only rows of the similarity graph whose top-K can change are
+        recomputed (one sparse block × matrix product against the catalog)
+        and replaced; all other products keep their neighbors untouched.
+        
+        Algorithm:
+            1. Re-extract the changed products' vectors (only theirs), take all
+               other rows from the process-local ProductVectorIndex
+            2. s = X[changed] · Xᵀ on the normalized CSR matrix X (candidates)
+            3. Affected rows: the changed products, products one of them now
+               enters the top-K of (score at least their stored K-th neighbor
+               score, which is rounded to 3 decimals), products that list one
+            4. Recompute the top-K of affected rows and write only the delta
+               against their stored neighbors
+        
+        Keyword document frequencies are updated incrementally from the
+        products' term set changes; pairs not involving them keep the
+        scores computed with the IDF of their last refresh.
+        
+        Args:
+            product_ids (iterable): Products whose metadata changed (or that were deleted)
+        
+        Returns:
+            int: Number of similarity records written (created + updated + deleted)
+        """
+        from home.models import ProductSimilarity
+
+        changed_ids = sorted(set(product_ids))
+        if not changed_ids:
+            return 0
+
+        self._refresh_products(changed_ids)
+        # Patch a private copy: the change log entry of this refresh is only
+        # written once the surrounding transaction commits
+        index = get_product_vector_index()
+        index = index.patched(changed_ids, index.log_position)
+        product_ids = index.product_ids
+        inverted_index = self._build_inverted_index(index.vectors)
+
+        content_similarities = ProductSimilarity.objects.filter(similarity_type="content_based")
+        affected_ids = set(changed_ids)
+        for start in range(0, len(changed_ids), 1000):
+            affected_ids.update(
+                content_similarities.filter(
+                    product2_id__in=changed_ids[start:start + 1000]
+                ).values_list("product1_id", flat=True)
+            )
+
+        positions = np.searchsorted(product_ids, changed_ids)
+        positions = positions[positions < len(product_ids)]
+        positions = positions[np.isin(product_ids[positions], changed_ids)]
+        if len(positions):
+            top_k = self.top_k_neighbors
+            _, columns, scores = self._similarity_pairs_for_rows(
+                inverted_index, positions, retain_top_k=False
+            )
+
+            candidate_scores = {}
+            for neighbor_id, score in zip(product_ids[columns].tolist(), scores.tolist()):
+                if neighbor_id not in affected_ids:
+                    candidate_scores[neighbor_id] = max(score, candidate_scores.get(neighbor_id, score))
+
+            candidate_ids = sorted(candidate_scores)
+            stored_neighbors = {}
+            for start in range(0, len(candidate_ids), 1000):
+                stored_neighbors.update(
+                    (row["product1_id"], row)
+                    for row in content_similarities.filter(product1_id__in=candidate_ids[start:start + 1000])
+                    .values("product1_id")
+                    .annotate(count=Count("id"), kth_score=Min("similarity_score"))
+                )
+            for neighbor_id, score in candidate_scores.items():
+                stored = stored_neighbors.get(neighbor_id)
+                if (
+                    stored is None
+                    or top_k is None
+                    or stored["count"] < top_k
+                    or score >= float(stored["kth_score"]) - 0.0005
+                ):
+                    affected_ids.add(neighbor_id)
+
+        affected_positions = np.searchsorted(product_ids, sorted(affected_ids))
+        affected_positions = affected_positions[affected_positions < len(product_ids)]
+        affected_positions = affected_positions[
+            np.isin(product_ids[affected_positions], list(affected_ids))
+        ]
+
+        edges = []
+        if len(affected_positions):
+            rows, columns, scores = self._similarity_pairs_for_rows(inverted_index, affected_positions)
+            edges = zip(product_ids[rows].tolist(), product_ids[columns].tolist(), scores.tolist())
+
+        write_stats = sync_product_similarities("content_based", sorted(affected_ids), edges)
+        self.last_write_stats = dict(write_stats)
+
+        print(
+            f"Refreshed content-based similarities of {len(affected_ids)} products around "
+            f"{len(changed_ids)} changed products (created {write_stats['created']}, "
+            f"updated {write_stats['updated']}, deleted {write_stats['deleted']}, "
+            f"unchanged {write_stats['unchanged']})"
+        )
+        return write_stats["created"] + write_stats["updated"] + write_stats["deleted"]
+
+
+class CustomMinHashLSH:
+    """
+    Approximate nearest-neighbor index over product feature sets (MinHash + LSH).
+    
+    Algorithm: MinHash signatures + banded Locality-Sensitive Hashing
+    Formula: P(candidate | Jaccard J) = 1 - (1 - J^rows_per_band)^num_bands
+    
+    Each product is reduced to num_bands × rows_per_band MinHash values of
+    its feature set (category_*, tag_*, price_*, keyword_*). Products whose
+    signatures agree on a whole band land in the same bucket and become
+    candidates; candidates are re-ranked with the exact weighted cosine.
+    
+    Recall/speed trade-off:
+        - More bands / fewer rows per band: higher recall, more candidates
+        - Fewer bands / more rows per band: fewer, more similar candidates
+        - max_bucket_size: caps members read from one bucket per band
+    
+    Lookups touch only the buckets of one product, so "similar to product X"
+    runs in time independent of catalog size and never reads ProductSimilarity.
+    """
+
+    def __init__(self, num_bands=32, rows_per_band=2, max_bucket_size=500, seed=42):
+        self.num_bands = num_bands
+        self.rows_per_band = rows_per_band
+        self.num_hashes = num_bands * rows_per_band
+        self.max_bucket_size = max_bucket_size
+        self.prime = 2147483647
+        self.signature_chunk_rows = 2048
+
+        random_state = np.random.RandomState(seed)
+        self.hash_a = random_state.randint(1, self.prime, size=self.num_hashes).astype(np.int64)
+        self.hash_b = random_state.randint(0, self.prime, size=self.num_hashes).astype(np.int64)
+        self.band_multipliers = random_state.randint(
+            1, np.iinfo(np.int64).max, size=rows_per_band, dtype=np.int64
+        ).astype(np.uint64)
+
+        self.product_ids = None
+        self.normalized_matrix = None
+        self.bucket_of_row = None
+        self.bucket_members = []
+        self.bucket_offsets = []
+
+    def _compute_signatures(self, matrix):
+        """
+        MinHash signature of every row: min over the row's feature columns of
+        h_k(c) = (a_k × c + b_k) mod prime, for k = 1..num_hashes.
+        
+        Returns:
+            np.ndarray: [n_products × num_hashes], prime for empty rows
+        """
+        signatures = np.full((matrix.shape[0], self.num_hashes), self.prime, dtype=np.int64)
+
+        for start in range(0, matrix.shape[0], self.signature_chunk_rows):
+            chunk = matrix[start:start + self.signature_chunk_rows]
+            non_empty = np.flatnonzero(np.diff(chunk.indptr) > 0)
+            if len(non_empty) == 0:
+                continue
+
+            columns = chunk.indices.astype(np.int64)
+            hashed = (columns[:, None] * self.hash_a[None, :] + self.hash_b[None, :]) % self.prime
+            signatures[start + non_empty] = np.minimum.reduceat(
+                hashed, chunk.indptr[:-1][non_empty], axis=0
+            )
+
+        return signatures
+
+    def fit(self, feature_matrix, product_ids):
+        """
+        Build the index.
+        
+        Args:
+            feature_matrix: CSR [n_products × n_features] weighted feature matrix
+            product_ids: Product id of every row (ascending)
+        
+        Returns:
+            CustomMinHashLSH: self
+        """
+        feature_matrix = feature_matrix.tocsr()
+        self.product_ids = np.asarray(product_ids, dtype=np.int64)
+
+        squared_norms = np.asarray(feature_matrix.multiply(feature_matrix).sum(axis=1)).ravel()
+        norms = np.sqrt(squared_norms)
+        inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        self.normalized_matrix = sparse.diags(inverse_norms).dot(feature_matrix).tocsr()
+
+        signatures = self._compute_signatures(feature_matrix)
+        indexed_rows = np.flatnonzero(np.diff(feature_matrix.indptr) > 0)
+
+        self.bucket_of_row = np.full((self.num_bands, feature_matrix.shape[0]), -1, dtype=np.int64)
+        self.bucket_members = []
+        self.bucket_offsets = []
+
+        for band in range(self.num_bands):
+            band_signatures = signatures[
+                indexed_rows, band * self.rows_per_band:(band + 1) * self.rows_per_band
+            ].astype(np.uint64)
+            band_keys = (band_signatures * self.band_multipliers[None, :]).sum(axis=1)
+
+            _, bucket_ids = np.unique(band_keys, return_inverse=True)
+            order = np.argsort(bucket_ids, kind="stable")
+
+            self.bucket_of_row[band, indexed_rows] = bucket_ids
+            self.bucket_members.append(indexed_rows[order])
+            self.bucket_offsets.append(
+                np.concatenate(([0], np.cumsum(np.bincount(bucket_ids))))
+            )
+
+        return self
+
+    def _candidate_rows(self, row):
+        """Rows sharing at least one band bucket with row (row itself excluded)"""
+        candidates = []
+        for band in range(self.num_bands):
+            bucket = self.bucket_of_row[band, row]
+            if bucket < 0:
+                continue
+            offset = self.bucket_offsets[band][bucket]
+            end = min(self.bucket_offsets[band][bucket + 1], offset + self.max_bucket_size)
+            candidates.append(self.bucket_members[band][offset:end])
+
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+
+        candidates = np.unique(np.concatenate(candidates))
+        return candidates[candidates != row]
+
+    def _rerank(self, row, candidates, top_k, threshold=None):
+        """Exact cosine re-rank of candidate rows; returns (rows, scores) best first"""
+        if len(candidates) == 0:
+            return candidates, np.empty(0)
+
+        scores = np.asarray(
+            self.normalized_matrix[candidates].dot(self.normalized_matrix[row].T).todense()
+        ).ravel()
+
+        if threshold is not None:
+            keep = scores > threshold
+            candidates, scores = candidates[keep], scores[keep]
+
+        if len(candidates) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates, scores = candidates[best], scores[best]
+
+        order = np.lexsort((candidates, -scores))
+        return candidates[order], scores[order]
+
+    def get_similar_products(self, product_id, top_k=10):
+        """
+        Approximate top-K most similar products to one product.
+        
+        Returns:
+            list: [(product_id, cosine_score)] best first, [] if product not indexed
+        """
+        row = int(np.searchsorted(self.product_ids, product_id))
+        if row >= len(self.product_ids) or self.product_ids[row] != product_id:
+            return []
+
+        rows, scores = self._rerank(row, self._candidate_rows(row), top_k)
+        return list(zip(self.product_ids[rows].tolist(), scores.tolist()))
+
+    def neighbor_pairs(self, start, stop, top_k, threshold=None):
+        """
+        Approximate top-K neighbors of rows [start, stop).
+        
+        Returns:
+            tuple: (row indices, column indices, scores) with scores > threshold
+        """
+        rows, columns, scores = [], [], []
+        for row in range(start, stop):
+            neighbor_rows, neighbor_scores = self._rerank(
+                row, self._candidate_rows(row), top_k, threshold
+            )
+            rows.append(np.full(len(neighbor_rows), row, dtype=np.int64))
+            columns.append(neighbor_rows)
+            scores.append(neighbor_scores)
+
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(rows), np.concatenate(columns), np.concatenate(scores)
+
+
+class CustomCollaborativeFilter:
+    """
+    Item-item Collaborative Filtering on a sparse user × product matrix.
+    
+    Algorithm: Adjusted Cosine Similarity (Sarwar et al., 2001)
+    Formula: sim(i,j) = Σ_u (R_u,i - R̄_u)(R_u,j - R̄_u) /
+                        √[Σ_u (R_u,i - R̄_u)² × Σ_u (R_u,j - R̄_u)²]
+    
+    Where:
+        - R_u,i: Quantity of product i purchased by user u (summed over orders)
+        - R̄_u: Mean quantity over the products user u purchased
+    
+    Optimizations:
+        - Purchases streamed with values_list().iterator() into a CSR matrix
+          (memory proportional to purchases, never users × products)
+        - Mean-centering vectorized over the nonzeros only
+        - Block-wise sparse item × item products with vectorized top-K
+          (settings.SIMILARITY_TOP_K) and optional minimum score
+        - Delta writes to ProductSimilarity, optional process pool
+        - Result caching (2 hours)
+        - Incremental updates on new orders from co-occurrence accumulators
+          (ProductCooccurrence, ProductInteractionNorm), no full rebuild
+    """
+
+    def __init__(self):
+        self.similarity_threshold = getattr(settings, 'COLLABORATIVE_SIMILARITY_MIN_SCORE', 0.0)
+        self.top_k_neighbors = getattr(settings, 'SIMILARITY_TOP_K', 20)
+        self.block_size = 1000
+        self.workers = getattr(settings, 'SIMILARITY_WORKERS', 1)
+        self.memory_budget_mb = getattr(settings, 'SIMILARITY_MEMORY_BUDGET_MB', None)
+        self.stream_chunk_size = 5000
+        self.accumulator_epsilon = 1e-9
+        self.last_write_stats = None
+
+    def build_interaction_matrix(self):
+        """
+        Stream purchases into a user × product CSR matrix.
+        
+        Returns:
+            tuple: (csr_matrix [n_users × n_products] of summed quantities,
+                    user_ids array, product_ids array)
+        """
+        from home.models import Product, OrderProduct
+
+        product_ids = np.fromiter(
+            Product.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=self.stream_chunk_size),
+            dtype=np.int64,
+        )
+
+        purchase_users, purchase_products, purchase_quantities = array("q"), array("q"), array("d")
+        for user_id, product_id, quantity in OrderProduct.objects.values_list(
+            "order__user_id", "product_id", "quantity"
+        ).iterator(chunk_size=self.stream_chunk_size):
+            purchase_users.append(user_id)
+            purchase_products.append(product_id)
+            purchase_quantities.append(quantity)
+
+        purchase_users = np.frombuffer(purchase_users, dtype=np.int64)
+        purchase_quantities = np.frombuffer(purchase_quantities, dtype=np.float64)
+        columns = np.searchsorted(product_ids, np.frombuffer(purchase_products, dtype=np.int64))
+
+        user_ids, rows = np.unique(purchase_users, return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (purchase_quantities, (rows, columns)),
+            shape=(len(user_ids), len(product_ids)),
+        )
+        matrix.sum_duplicates()
+
+        return matrix, user_ids, product_ids
+
+    def _mean_center(self, matrix):
+        """
+        Subtract every user's mean purchased quantity from their nonzeros.
+        
+        Only purchased cells (quantity > 0) take part, both in the mean and
+        in the result; unpurchased cells stay implicit zeros.
+        """
+        matrix = matrix.copy()
+        matrix.data[matrix.data < 0] = 0
+        matrix.eliminate_zeros()
+
+        purchases_per_user = np.diff(matrix.indptr)
+        totals = np.asarray(matrix.sum(axis=1)).ravel()
+        means = np.divide(
+            totals, purchases_per_user, out=np.zeros_like(totals), where=purchases_per_user > 0
+        )
+
+        matrix.data = matrix.data - np.repeat(means, purchases_per_user)
+        matrix.eliminate_zeros()
+        return matrix
+
+    def _build_item_index(self, centered_matrix):
+        """L2-normalized item × user matrix as (index, postings, no capped features)"""
+        item_matrix = centered_matrix.T.tocsr()
+        squared_norms = np.asarray(item_matrix.multiply(item_matrix).sum(axis=1)).ravel()
+        norms = np.sqrt(squared_norms)
+        inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        item_matrix = sparse.diags(inverse_norms).dot(item_matrix).tocsr()
+        return item_matrix, item_matrix.T.tocsr(), np.zeros((item_matrix.shape[0], 0))
+
+    def _center_quantities(self, quantities):
+        """Mean-center one user's purchase totals ({product_id: quantity}) over purchased products"""
+        purchased = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+        if not purchased:
+            return {}
+
+        mean = sum(purchased.values()) / len(purchased)
+        return {
+            product_id: quantity - mean
+            for product_id, quantity in purchased.items()
+            if quantity != mean
+        }
+
+    def rebuild_cooccurrence(self, interactions=None):
+        """
+        Rebuild the co-occurrence accumulators from the full purchase history.
+        
+        Stores ||c_i||² per product (ProductInteractionNorm), c_i · c_j per
+        co-purchased pair (ProductCooccurrence) and every buyer's purchase
+        totals (UserCooccurrenceState), where c_i is product i's mean-centered
+        purchase column. Pair dot products are computed block by block.
+        
+        The tables are rewritten in committed chunks, never in one long
+        transaction. A CooccurrenceRebuild marker row is committed first;
+        the buyer snapshots are deleted next and written last, in the
+        transaction that deletes the marker. Folds skip while the marker
+        exists (see apply_user_purchases), and an order the rebuild did not
+        read is folded by the buyer's next order, which diffs against the
+        snapshot. If the process dies, the snapshots stay missing, so the
+        next batch run rebuilds again; the stale marker stops counting after
+        COOCCURRENCE_REBUILD_MAX_SECONDS.
+        
+        Args:
+            interactions (tuple|None): Output of build_interaction_matrix (None = build it)
+        """
+        from home.models import (
+            CooccurrenceRebuild,
+            ProductCooccurrence,
+            ProductInteractionNorm,
+            UserCooccurrenceState,
+        )
+
+        marker = CooccurrenceRebuild.objects.create()
+        try:
+            UserCooccurrenceState.objects.all().delete()
+
+            matrix, user_ids, product_ids = interactions or self.build_interaction_matrix()
+            item_matrix = self._mean_center(matrix).T.tocsr()
+            squared_norms = np.asarray(item_matrix.multiply(item_matrix).sum(axis=1)).ravel()
+            user_matrix = item_matrix.T.tocsr()
+
+            for model in (ProductCooccurrence, ProductInteractionNorm):
+                while True:
+                    chunk = list(model.objects.order_by("id").values_list("id", flat=True)[:self.stream_chunk_size])
+                    if not chunk:
+                        break
+                    model.objects.filter(id__in=chunk).delete()
+
+            ProductInteractionNorm.objects.bulk_create(
+                [
+                    ProductInteractionNorm(product_id=product_id, squared_norm=squared_norm)
+                    for product_id, squared_norm in zip(
+                        product_ids[squared_norms > 0].tolist(), squared_norms[squared_norms > 0].tolist()
+                    )
+                ],
+                batch_size=1000,
+            )
+
+            for start in range(0, len(product_ids), self.block_size):
+                block = item_matrix[start:start + self.block_size].dot(user_matrix).tocoo()
+                rows = block.row.astype(np.int64) + start
+                keep = (block.col > rows) & (block.data != 0)
+                with transaction.atomic():
+                    ProductCooccurrence.objects.bulk_create(
+                        [
+                            ProductCooccurrence(product1_id=product1_id, product2_id=product2_id, dot_product=dot_product)
+                            for product1_id, product2_id, dot_product in zip(
+                                product_ids[rows[keep]].tolist(),
+                                product_ids[block.col[keep]].tolist(),
+                                block.data[keep].tolist(),
+                            )
+                        ],
+                        batch_size=1000,
+                    )
+
+            with transaction.atomic():
+                CooccurrenceRebuild.objects.filter(id=marker.id).delete()
+                UserCooccurrenceState.objects.bulk_create(
+                    [
+                        UserCooccurrenceState(
+                            user_id=user_id,
+                            quantities={
+                                str(product_id): int(quantity)
+                                for product_id, quantity in zip(
+                                    product_ids[matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]].tolist(),
+                                    matrix.data[matrix.indptr[row]:matrix.indptr[row + 1]].tolist(),
+                                )
+                            },
+                        )
+                        for row, user_id in enumerate(user_ids.tolist())
+                    ],
+                    batch_size=1000,
+                )
+        finally:
+            CooccurrenceRebuild.objects.filter(id=marker.id).delete()
+
+    def apply_user_purchases(self, user_id):
+        """
+        Fold a user's purchase changes into the co-occurrence accumulators.
+        
+        The user's current totals are diffed against the snapshot last
+        folded in (UserCooccurrenceState); with old and new centered vectors
+        o and n, every pair of the user's products moves by n_i·n_j - o_i·o_j
+        and every norm by n_i² - o_i². Applying the same orders twice is a
+        no-op.
+        
+        A new purchase shifts the user's mean, so every product of the user
+        changes: one fold rewrites P(P - 1)/2 pair rows and P norm rows,
+        where P is the number of distinct products the user ever bought.
+        Users with more than COLLABORATIVE_INCREMENTAL_MAX_PRODUCTS products
+        are not folded on the order path (at most ~20k pair rows at the
+        default of 200); their snapshot is left as it is, so the
+        accumulators stay consistent and the next full rebuild (or a later
+        fold after the cap is raised) includes their orders.
+        
+        The snapshot row is locked (or created) before the rebuild marker
+        is checked: a rebuild commits its marker before deleting snapshots,
+        so a fold either sees the marker and rolls back, or holds the row
+        lock and finishes before the rebuild deletes its snapshot.
+        
+        Args:
+            user_id (int): Buyer whose orders changed
+        
+        Returns:
+            set: Product IDs whose centered purchase column changed
+        """
+        from home.models import OrderProduct, UserCooccurrenceState
+
+        max_products = getattr(settings, "COLLABORATIVE_INCREMENTAL_MAX_PRODUCTS", 200)
+
+        with transaction.atomic():
+            state, _ = UserCooccurrenceState.objects.select_for_update().get_or_create(user_id=user_id)
+            if cooccurrence_rebuild_running():
+                # Not even the snapshot row: the rebuild writes them all
+                transaction.set_rollback(True)
+                return set()
+
+            current_quantities = {
+                product_id: total
+                for product_id, total in OrderProduct.objects.filter(order__user_id=user_id)
+                .values("product_id")
+                .annotate(total=Sum("quantity"))
+                .values_list("product_id", "total")
+                if total
+            }
+            previous_quantities = {int(product_id): quantity for product_id, quantity in state.quantities.items()}
+            if current_quantities == previous_quantities:
+                return set()
+            if max_products is not None and len(set(current_quantities) | set(previous_quantities)) > max_products:
+                print(
+                    f"Skipping co-occurrence fold of user {user_id}: more than {max_products} products "
+                    "(folded by the next full rebuild)"
+                )
+                return set()
+
+            old_centered = self._center_quantities(previous_quantities)
+            new_centered = self._center_quantities(current_quantities)
+            involved_ids = sorted(set(old_centered) | set(new_centered))
+            changed_ids = {
+                product_id for product_id in involved_ids
+                if old_centered.get(product_id, 0.0) != new_centered.get(product_id, 0.0)
+            }
+
+            norm_deltas = {
+                product_id: new_centered.get(product_id, 0.0) ** 2 - old_centered.get(product_id, 0.0) ** 2
+                for product_id in changed_ids
+            }
+            dot_deltas = {}
+            for position, product1_id in enumerate(involved_ids):
+                for product2_id in involved_ids[position + 1:]:
+                    if product1_id not in changed_ids and product2_id not in changed_ids:
+                        continue
+                    delta = (
+                        new_centered.get(product1_id, 0.0) * new_centered.get(product2_id, 0.0)
+                        - old_centered.get(product1_id, 0.0) * old_centered.get(product2_id, 0.0)
+                    )
+                    if delta:
+                        dot_deltas[(product1_id, product2_id)] = delta
+
+            self._apply_norm_deltas(norm_deltas)
+            self._apply_dot_deltas(dot_deltas)
+
+            state.quantities = {str(product_id): quantity for product_id, quantity in current_quantities.items()}
+            state.save()
+
+        return changed_ids
+
+    def _apply_norm_deltas(self, deltas):
+        """Add {product_id: delta} to ProductInteractionNorm (rows locked; vanishing norms deleted)"""
+        from home.models import ProductInteractionNorm
+
+        if not deltas:
+            return
+
+        ProductInteractionNorm.objects.bulk_create(
+            [ProductInteractionNorm(product_id=product_id) for product_id in deltas],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        norms = list(
+            ProductInteractionNorm.objects.select_for_update()
+            .filter(product_id__in=list(deltas))
+            .order_by("id")
+        )
+        for norm in norms:
+            norm.squared_norm += deltas[norm.product_id]
+
+        ProductInteractionNorm.objects.bulk_update(
+            [norm for norm in norms if norm.squared_norm > self.accumulator_epsilon],
+            ["squared_norm"],
+            batch_size=1000,
+        )
+        ProductInteractionNorm.objects.filter(
+            id__in=[norm.id for norm in norms if norm.squared_norm <= self.accumulator_epsilon]
+        ).delete()
+
+    def _apply_dot_deltas(self, deltas):
+        """Add {(product1_id, product2_id): delta} to ProductCooccurrence (rows locked; vanishing pairs deleted)"""
+        from home.models import ProductCooccurrence
+
+        if not deltas:
+            return
+
+        ProductCooccurrence.objects.bulk_create(
+            [ProductCooccurrence(product1_id=product1_id, product2_id=product2_id) for product1_id, product2_id in deltas],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+        product_ids = sorted({product_id for pair in deltas for product_id in pair})
+        pairs = [
+            pair
+            for pair in ProductCooccurrence.objects.select_for_update()
+            .filter(product1_id__in=product_ids, product2_id__in=product_ids)
+            .order_by("id")
+            if (pair.product1_id, pair.product2_id) in deltas
+        ]
+        for pair in pairs:
+            pair.dot_product += deltas[(pair.product1_id, pair.product2_id)]
+
+        ProductCooccurrence.objects.bulk_update(
+            [pair for pair in pairs if abs(pair.dot_product) > self.accumulator_epsilon],
+            ["dot_product"],
+            batch_size=1000,
+        )
+        ProductCooccurrence.objects.filter(
+            id__in=[pair.id for pair in pairs if abs(pair.dot_product) <= self.accumulator_epsilon]
+        ).delete()
+
+    def _load_cooccurrence_scores(self, product_ids):
+        """
+        Adjusted cosine scores of products against all their co-purchased products.
+        
+        Formula: sim(i,j) = (c_i · c_j) / (||c_i|| × ||c_j||), read from the accumulators
+        
+        Returns:
+            dict: {product_id: {neighbor_id: score}}
+        """
+        from home.models import ProductCooccurrence, ProductInteractionNorm
+
+        product_ids = sorted(product_ids)
+        dot_products = {}
+        for start in range(0, len(product_ids), 1000):
+            chunk = product_ids[start:start + 1000]
+            for product1_id, product2_id, dot_product in ProductCooccurrence.objects.filter(
+                Q(product1_id__in=chunk) | Q(product2_id__in=chunk)
+            ).values_list("product1_id", "product2_id", "dot_product"):
+                dot_products[(product1_id, product2_id)] = dot_product
+
+        norm_ids = sorted({product_id for pair in dot_products for product_id in pair})
+        norms = {}
+        for start in range(0, len(norm_ids), 1000):
+            norms.update(
+                (product_id, math.sqrt(squared_norm))
+                for product_id, squared_norm in ProductInteractionNorm.objects.filter(
+                    product_id__in=norm_ids[start:start + 1000]
+                ).values_list("product_id", "squared_norm")
+            )
+
+        wanted_ids = set(product_ids)
+        scores = defaultdict(dict)
+        for (product1_id, product2_id), dot_product in dot_products.items():
+            norm1, norm2 = norms.get(product1_id, 0.0), norms.get(product2_id, 0.0)
+            if norm1 <= 0 or norm2 <= 0:
+                continue
+            score = dot_product / (norm1 * norm2)
+            if product1_id in wanted_ids:
+                scores[product1_id][product2_id] = score
+            if product2_id in wanted_ids:
+                scores[product2_id][product1_id] = score
+        return scores
+
+    def generate_similarities_for_all_products(self, rebuild_cooccurrence=False):
+        """
+        Generate collaborative similarities for all products.
+        
+        Algorithm:
+            1. Stream purchases into sparse user × product matrix R
+            2. Mean-center every user's nonzeros
+            3. L2-normalize item columns; per block of items S_block = I_block · Iᵀ
+            4. Keep the top_k_neighbors pairs per product with score > similarity_threshold
+            5. Sync each block with ProductSimilarity (delta writes)
+        
+        The co-occurrence accumulators of the incremental path are kept up
+        to date by every order; they are rebuilt from the same matrix (see
+        rebuild_cooccurrence) only when they are empty or when asked to.
+        
+        Args:
+            rebuild_cooccurrence (bool): Rewrite the accumulators even if they exist
+        
+        Returns:
+            int: Number of similarity records stored (write counts in last_write_stats)
+        """
+        from home.models import UserCooccurrenceState
+
+        cache_key = "collaborative_similarity_matrix"
+        cached_result = cache.get(cache_key)
+
+        if cached_result and not rebuild_cooccurrence:
+            print("Using cached collaborative filtering results")
+            return cached_result
+
+        matrix, user_ids, product_ids = self.build_interaction_matrix()
+        print(
+            f"Processing collaborative filtering for {len(user_ids)} users and {len(product_ids)} products "
+            f"({matrix.nnz} purchased cells)"
+        )
+        if rebuild_cooccurrence or not UserCooccurrenceState.objects.exists():
+            self.rebuild_cooccurrence((matrix, user_ids, product_ids))
+
+        if len(user_ids) < 2 or len(product_ids) < 2:
+            print("Insufficient data for collaborative filtering")
+            return 0
+
+        print("Applying mean-centering (Adjusted Cosine Similarity - Sarwar et al. 2001)")
+        item_index = self._build_item_index(self._mean_center(matrix))
+
+        write_stats = Counter()
+        similarity_count = 0
+
+        for start, stop, (rows, columns, scores) in score_blocks(
+            item_index, self.block_size, self.similarity_threshold,
+            self.top_k_neighbors, workers=self.workers,
+            memory_budget_mb=self.memory_budget_mb,
+        ):
+            write_stats.update(
+                sync_product_similarities(
+                    "collaborative",
+                    product_ids[start:stop].tolist(),
+                    zip(product_ids[rows].tolist(), product_ids[columns].tolist(), scores.tolist()),
+                    bump_version=False,
+                )
+            )
+            similarity_count += len(rows)
+
+        if write_stats["created"] or write_stats["updated"] or write_stats["deleted"]:
+            # Once, after the last block: readers reload the finished graph only
+            bump_neighbor_index_version("collaborative")
+
+        self.last_write_stats = dict(write_stats)
+        print(
+            f"Stored {similarity_count} collaborative similarities using Adjusted Cosine Similarity "
+            f"(Sarwar et al. 2001) with top-{self.top_k_neighbors} neighbors and threshold {self.similarity_threshold} "
+            f"(created {write_stats['created']}, updated {write_stats['updated']}, "
+            f"deleted {write_stats['deleted']}, unchanged {write_stats['unchanged']})"
+        )
+
+        cache.set(cache_key, similarity_count, timeout=getattr(settings, 'CACHE_TIMEOUT_LONG', 7200))
+
+        return similarity_count
+
+    def update_similarities_for_products(self, product_ids):
+        """
+        Refresh collaborative similarities around products whose purchase column changed.
+        
+        Scores come from the co-occurrence accumulators, so the work is
+        proportional to the changed products' co-purchase neighborhoods,
+        never to the full purchase history.
+        
+        Algorithm:
+            1. Scores of the changed products against all co-purchased products
+            2. Affected rows: the changed products, products that list one of them,
+               products one of them now enters the top-K of (score at least
+               their stored K-th neighbor score, which is rounded to 3 decimals)
+            3. Recompute the top-K of affected rows and write only the delta
+        
+        Args:
+            product_ids (iterable): Products returned by apply_user_purchases
+        
+        Returns:
+            int: Number of similarity records written (created + updated + deleted)
+        """
+        from home.models import ProductSimilarity
+
+        changed_ids = set(product_ids)
+        if not changed_ids:
+            return 0
+
+        top_k = self.top_k_neighbors
+        threshold = self.similarity_threshold
+        collaborative_similarities = ProductSimilarity.objects.filter(similarity_type="collaborative")
+
+        affected_ids = set(changed_ids)
+        changed_list = sorted(changed_ids)
+        for start in range(0, len(changed_list), 1000):
+            affected_ids.update(
+                collaborative_similarities.filter(
+                    product2_id__in=changed_list[start:start + 1000]
+                ).values_list("product1_id", flat=True)
+            )
+
+        candidate_scores = {}
+        for neighbors in self._load_cooccurrence_scores(changed_ids).values():
+            for neighbor_id, score in neighbors.items():
+                if neighbor_id in affected_ids or (threshold is not None and score <= threshold):
+                    continue
+                candidate_scores[neighbor_id] = max(score, candidate_scores.get(neighbor_id, score))
+
+        candidate_ids = sorted(candidate_scores)
+        stored_neighbors = {}
+        for start in range(0, len(candidate_ids), 1000):
+            stored_neighbors.update(
+                (row["product1_id"], row)
+                for row in collaborative_similarities.filter(product1_id__in=candidate_ids[start:start + 1000])
+                .values("product1_id")
+                .annotate(count=Count("id"), kth_score=Min("similarity_score"))
+            )
+        for neighbor_id, score in candidate_scores.items():
+            stored = stored_neighbors.get(neighbor_id)
+            if (
+                stored is None
+                or top_k is None
+                or stored["count"] < top_k
+                or score >= float(stored["kth_score"]) - 0.0005
+            ):
+                affected_ids.add(neighbor_id)
+
+        affected_scores = self._load_cooccurrence_scores(affected_ids)
+        edges = []
+        for product_id in sorted(affected_ids):
+            neighbors = sorted(
+                (-score, neighbor_id)
+                for neighbor_id, score in affected_scores.get(product_id, {}).items()
+                if threshold is None or score > threshold
+            )
+            if top_k is not None:
+                neighbors = neighbors[:top_k]
+            edges.extend((product_id, neighbor_id, -negative_score) for negative_score, neighbor_id in neighbors)
+
+        write_stats = sync_product_similarities("collaborative", sorted(affected_ids), edges)
+        self.last_write_stats = dict(write_stats)
+
+        print(
+            f"Refreshed collaborative similarities of {len(affected_ids)} products around "
+            f"{len(changed_ids)} changed products (created {write_stats['created']}, "
+            f"updated {write_stats['updated']}, deleted {write_stats['deleted']}, "
+            f"unchanged {write_stats['unchanged']})"
+        )
+        return write_stats["created"] + write_stats["updated"] + write_stats["deleted"]
+
+    def update_similarities_for_user(self, user_id):
+        """
+        Incrementally refresh collaborative similarities after a user's order.
+        
+        Folds the user's purchases into the co-occurrence accumulators and
+        refreshes the affected rows. Nothing is done while the accumulators
+        are empty or being rebuilt: building them is the batch job's work
+        (generate_similarities_for_all_products), never the order path's,
+        and the user's orders are folded by the rebuild or the next order.
+        Runs on the background worker pool (see
+        update_collaborative_similarity_for_user in signals).
+        
+        Args:
+            user_id (int): Buyer whose order was committed
+        
+        Returns:
+            int: Number of similarity records written
+        """
+        from home.models import UserCooccurrenceState
+
+        if cooccurrence_rebuild_running() or not UserCooccurrenceState.objects.exists():
+            print(
+                f"Skipping collaborative update for user {user_id}: co-occurrence accumulators "
+                "not built (run the collaborative similarity job)"
+            )
+            return 0
+
+        return self.update_similarities_for_products(self.apply_user_purchases(user_id))
+
+
+class CustomUserBasedFilter:
+    """
+    User-neighborhood Collaborative Filtering with precomputed top-K neighbors.
+    
+    Algorithm: User-based k-Nearest Neighbors (Herlocker et al., 1999)
+    Formula: sim(u,v) = (R_u · R_v) / (||R_u|| × ||R_v||)
+             score(u,i) = Σ_v∈N(u) sim(u,v) × [v bought i] / Σ_v∈N(u) sim(u,v)
+    
+    Where:
+        - R_u: Purchased quantities of user u (sparse row of the user × product matrix)
+        - N(u): The top_k_neighbors most similar users of u
+    
+    Optimizations:
+        - Neighbors computed block-wise on the sparse purchase matrix
+          (score_blocks: inverted index, top-K per row, memory budget, workers)
+        - Compact store (.npz): neighbor lists as CSR arrays (int32 / float32)
+          plus the purchase matrix, loaded once per process
+        - Recommendations of a batch of users are one sparse gather
+          W · P over their neighbors' purchase rows, so the cost is bounded by
+          top_k_neighbors × neighbor purchases regardless of the user's history
+        - Users missing from the store get their neighbors scored on the fly
+          against the store's user postings, built once per loaded store
+    """
+
+    def __init__(self):
+        self.top_k_neighbors = getattr(settings, 'USER_NEIGHBORS_TOP_K', 30)
+        self.similarity_threshold = 0.0
+        self.block_size = 1000
+        self.workers = getattr(settings, 'SIMILARITY_WORKERS', 1)
+        self.memory_budget_mb = getattr(settings, 'SIMILARITY_MEMORY_BUDGET_MB', None)
+        self.model_path = os.path.join(
+            getattr(settings, 'RECOMMENDATION_MODEL_DIR', os.path.join(settings.BASE_DIR, "recommendation_models")),
+            "user_neighbors.npz",
+        )
+
+    def _user_index(self, purchases):
+        """L2-normalized user × product matrix as (index, postings, no capped features)"""
+        squared_norms = np.asarray(purchases.multiply(purchases).sum(axis=1)).ravel()
+        norms = np.sqrt(squared_norms)
+        inverse_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        user_matrix = sparse.diags(inverse_norms).dot(purchases).tocsr()
+        return user_matrix, user_matrix.T.tocsr(), np.zeros((user_matrix.shape[0], 0))
+
+    def build_neighbors(self):
+        """
+        Compute every user's top-K neighbors and persist the store.
+        
+        Returns:
+            dict: {"users": n, "neighbor_pairs": n, "top_k": k}
+        """
+        purchases, user_ids, product_ids = CustomCollaborativeFilter().build_interaction_matrix()
+        print(
+            f"Computing top-{self.top_k_neighbors} user neighbors for {len(user_ids)} users "
+            f"({purchases.nnz} purchased cells)"
+        )
+
+        neighbor_rows, neighbor_columns, neighbor_scores = [], [], []
+        for _, _, (rows, columns, scores) in score_blocks(
+            self._user_index(purchases), self.block_size, self.similarity_threshold,
+            self.top_k_neighbors, workers=self.workers, memory_budget_mb=self.memory_budget_mb,
+        ):
+            neighbor_rows.append(rows)
+            neighbor_columns.append(columns)
+            neighbor_scores.append(scores)
+
+        rows = np.concatenate(neighbor_rows) if neighbor_rows else np.empty(0, dtype=np.int64)
+        self.save_store(
+            user_ids=user_ids,
+            product_ids=product_ids,
+            neighbor_indptr=np.r_[0, np.cumsum(np.bincount(rows, minlength=len(user_ids)))],
+            neighbor_indices=(np.concatenate(neighbor_columns) if neighbor_columns else rows).astype(np.int32),
+            neighbor_scores=(np.concatenate(neighbor_scores) if neighbor_scores else np.empty(0)).astype(np.float32),
+            purchase_indptr=purchases.indptr,
+            purchase_indices=purchases.indices.astype(np.int32),
+            purchase_data=purchases.data.astype(np.float32),
+        )
+        print(f"Stored {len(rows)} user neighbor pairs in {self.model_path}")
+
+        return {"users": len(user_ids), "neighbor_pairs": len(rows), "top_k": self.top_k_neighbors}
+
+    def save_store(self, **arrays):
+        """Write the neighbor store atomically to model_path (.npz)"""
+        directory = os.path.dirname(self.model_path)
+        os.makedirs(directory, exist_ok=True)
+
+        temporary_path = os.path.join(directory, f".user_neighbors_{os.getpid()}.npz")
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, self.model_path)
+        # Stored collaborative_user recommendations are versioned by the store
+        bump_neighbor_index_version("collaborative_user")
+
+    def _purchase_matrix(self, store):
+        return sparse.csr_matrix(
+            (store["purchase_data"], store["purchase_indices"], store["purchase_indptr"]),
+            shape=(len(store["user_ids"]), len(store["product_ids"])),
+        )
+
+    def _store_postings(self, store):
+        """
+        Product × user postings of the store's normalized purchase matrix.
+        
+        Built on first use and kept in the store dict, which load_npz_model
+        caches per process and replaces when the file changes, so the
+        postings live exactly as long as the store they come from.
+        """
+        postings = store.get("user_postings")
+        if postings is None:
+            _, postings, _ = self._user_index(self._purchase_matrix(store))
+            store["user_postings"] = postings
+        return postings
+
+    def _neighbors_on_the_fly(self, store, purchased_columns, quantities):
+        """Top-K neighbors of a user outside the store: one sparse row × postings product"""
+        postings = self._store_postings(store)
+
+        user_vector = sparse.csr_matrix(
+            (quantities, (np.zeros(len(purchased_columns), dtype=np.int64), purchased_columns)),
+            shape=(1, postings.shape[0]),
+        )
+        user_vector.sum_duplicates()
+        norm = np.sqrt(user_vector.multiply(user_vector).sum())
+        if norm == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        scores = (user_vector / norm).dot(postings).tocoo()
+        _, neighbors, neighbor_scores = select_top_k_per_row(
+            np.zeros(scores.nnz, dtype=np.int64), scores.col.astype(np.int64), scores.data, self.top_k_neighbors
+        )
+        keep = neighbor_scores > self.similarity_threshold
+        return neighbors[keep], neighbor_scores[keep]
+
+    def recommend_for_users(self, user_ids, n=10):
+        """
+        Top-n products for a batch of users from their neighbors' purchases.
+        
+        Products the user already bought (stored or since) are excluded.
+        
+        Args:
+            user_ids (iterable): Users to recommend for
+            n (int): Products per user
+        
+        Returns:
+            dict: {user_id: [(product_id, score in [0, 1]), ...]} best first ({} if no store)
+        """
+        from home.models import OrderProduct
+
+        store = load_npz_model(self.model_path)
+        if store is None:
+            return {}
+
+        user_ids = list(user_ids)
+        stored_user_ids = store["user_ids"]
+        product_ids = store["product_ids"]
+        neighbor_indptr = store["neighbor_indptr"]
+
+        current_purchases = defaultdict(lambda: ([], []))
+        for user_id, product_id, quantity in OrderProduct.objects.filter(
+            order__user_id__in=user_ids
+        ).values_list("order__user_id", "product_id", "quantity"):
+            column = int(np.searchsorted(product_ids, product_id))
+            if column < len(product_ids) and product_ids[column] == product_id:
+                current_purchases[user_id][0].append(column)
+                current_purchases[user_id][1].append(float(quantity))
+
+        weight_rows, weight_columns, weight_values = [], [], []
+        for position, user_id in enumerate(user_ids):
+            row = int(np.searchsorted(stored_user_ids, user_id))
+            if row < len(stored_user_ids) and stored_user_ids[row] == user_id:
+                neighbors = store["neighbor_indices"][neighbor_indptr[row]:neighbor_indptr[row + 1]]
+                scores = store["neighbor_scores"][neighbor_indptr[row]:neighbor_indptr[row + 1]].astype(np.float64)
+            else:
+                neighbors, scores = self._neighbors_on_the_fly(store, *current_purchases[user_id])
+
+            if len(scores) and scores.sum() > 0:
+                weight_rows.append(np.full(len(neighbors), position, dtype=np.int64))
+                weight_columns.append(np.asarray(neighbors, dtype=np.int64))
+                weight_values.append(scores / scores.sum())
+
+        weights = sparse.csr_matrix(
+            (
+                np.concatenate(weight_values) if weight_values else np.empty(0),
+                (
+                    np.concatenate(weight_rows) if weight_rows else np.empty(0, dtype=np.int64),
+                    np.concatenate(weight_columns) if weight_columns else np.empty(0, dtype=np.int64),
+                ),
+            ),
+            shape=(len(user_ids), len(stored_user_ids)),
+        )
+        bought = self._purchase_matrix(store)
+        bought.data = np.ones_like(bought.data)
+        scores = weights.dot(bought).tocsr()
+
+        recommendations = {}
+        for position, user_id in enumerate(user_ids):
+            columns = scores.indices[scores.indptr[position]:scores.indptr[position + 1]]
+            values = scores.data[scores.indptr[position]:scores.indptr[position + 1]]
+
+            row = int(np.searchsorted(stored_user_ids, user_id))
+            seen = set(current_purchases[user_id][0])
+            if row < len(stored_user_ids) and stored_user_ids[row] == user_id:
+                seen.update(store["purchase_indices"][store["purchase_indptr"][row]:store["purchase_indptr"][row + 1]].tolist())
+            keep = ~np.isin(columns, list(seen))
+            columns, values = columns[keep], values[keep]
+
+            # Candidates are bounded by the neighbors' purchases: a full sort is cheap
+            order = np.lexsort((product_ids[columns], -values))[:n]
+            recommendations[user_id] = [
+                (int(product_ids[column]), float(value))
+                for column, value in zip(columns[order], values[order])
+            ]
+        return recommendations
+
+    def recommend(self, user_id, n=10):
+        """Top-n (product_id, score) for one user ([] if no store or no neighbors)"""
+        return self.recommend_for_users([user_id], n).get(user_id, [])
+
+
+class CustomInteractionMatrixBuilder:
+    """
+    Weighted, time-decayed user × product matrix from UserInteraction events.
+    
+    Formula: r_ui = Σ_events w(type) × 2^(-(now - t) / half_life)
+    
+    Where:
+        - w(type): Weight of the interaction type (settings.INTERACTION_WEIGHTS)
+        - t: Event timestamp
+        - half_life: settings.INTERACTION_HALF_LIFE_DAYS (None = no decay)
+    
+    Optimizations:
+        - Events streamed in id order with values_list().iterator()
+        - Decay anchored at a fixed time: an event contributes
+          w × 2^((t - anchor) / half_life) once, and the whole matrix is scaled
+          by 2^(-(now - anchor) / half_life) when it is read, so stored values
+          never have to be recomputed as time passes
+        - Aggregated (user, product, value) state persisted to .npz with a
+          high-water mark on UserInteraction.id: build() only streams events
+          appended since the last call
+    
+    Event ids are allocated at insert, not at commit, so a transaction can
+    commit an event below ids already folded in. Every update re-reads the
+    last INTERACTION_EVENT_ID_OVERLAP ids below the high-water mark and
+    folds the ones not seen yet (the folded ids of that window are kept in
+    the state); only events committed later than that many newer ids are
+    missed until the next rebuild().
+    
+    Events deleted after they were folded in are dropped by rebuild();
+    users and products deleted since are filtered out on every build().
+    The output matches CustomCollaborativeFilter.build_interaction_matrix:
+    (csr_matrix [n_users × n_products], user_ids, product_ids).
+    """
+
+    def __init__(self, interaction_weights=None, half_life_days=FROM_SETTINGS):
+        if interaction_weights is None:
+            interaction_weights = getattr(settings, 'INTERACTION_WEIGHTS', {
+                "view": 0.1,
+                "click": 0.25,
+                "add_to_cart": 0.5,
+                "purchase": 1.0,
+                "favorite": 0.5,
+            })
+        if half_life_days is FROM_SETTINGS:
+            half_life_days = getattr(settings, 'INTERACTION_HALF_LIFE_DAYS', None)
+
+        self.interaction_weights = {
+            interaction_type: float(weight)
+            for interaction_type, weight in interaction_weights.items()
+            if weight
+        }
+        self.half_life_days = half_life_days
+        self.stream_chunk_size = 5000
+        self.event_id_overlap = getattr(settings, 'INTERACTION_EVENT_ID_OVERLAP', 1000)
+        self.max_anchor_exponent = 32.0
+        self.last_appended_events = 0
+
+        fingerprint = self._fingerprint()
+        self.state_path = os.path.join(
+            getattr(settings, 'RECOMMENDATION_MODEL_DIR', os.path.join(settings.BASE_DIR, "recommendation_models")),
+            f"interaction_matrix_{hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:12]}.npz",
+        )
+
+    def _fingerprint(self):
+        return json.dumps(
+            {"weights": sorted(self.interaction_weights.items()), "half_life_days": self.half_life_days},
+            sort_keys=True,
+        )
+
+    def _decay_exponents(self, timestamps, anchor):
+        """(t - anchor) / half_life for an array of POSIX timestamps (0 without decay)"""
+        if not self.half_life_days:
+            return np.zeros(len(timestamps))
+        return (np.asarray(timestamps, dtype=np.float64) - anchor) / (self.half_life_days * 86400.0)
+
+    def _aggregate(self, user_ids, product_ids, values):
+        """Sum values of duplicate (user, product) pairs; returns arrays sorted by user, product"""
+        if len(user_ids) == 0:
+            return user_ids, product_ids, values
+
+        order = np.lexsort((product_ids, user_ids))
+        user_ids, product_ids, values = user_ids[order], product_ids[order], values[order]
+        starts = np.flatnonzero(
+            np.r_[True, (user_ids[1:] != user_ids[:-1]) | (product_ids[1:] != product_ids[:-1])]
+        )
+        return user_ids[starts], product_ids[starts], np.add.reduceat(values, starts)
+
+    def _stream_events(self, after_id=0, user_id=None):
+        """
+        Stream weighted events into arrays.
+        
+        Returns:
+            tuple: (event ids, user_ids, product_ids, weights, POSIX timestamps)
+        """
+        from home.models import UserInteraction
+
+        events = UserInteraction.objects.filter(
+            id__gt=after_id, interaction_type__in=list(self.interaction_weights)
+        )
+        if user_id is not None:
+            events = events.filter(user_id=user_id)
+
+        event_ids, users, products, weights, timestamps = array("q"), array("q"), array("q"), array("d"), array("d")
+        for event_id, event_user_id, product_id, interaction_type, timestamp in events.order_by("id").values_list(
+            "id", "user_id", "product_id", "interaction_type", "timestamp"
+        ).iterator(chunk_size=self.stream_chunk_size):
+            event_ids.append(event_id)
+            users.append(event_user_id)
+            products.append(product_id)
+            weights.append(self.interaction_weights[interaction_type])
+            timestamps.append(timestamp.timestamp())
+
+        return (
+            np.frombuffer(event_ids, dtype=np.int64),
+            np.frombuffer(users, dtype=np.int64),
+            np.frombuffer(products, dtype=np.int64),
+            np.frombuffer(weights, dtype=np.float64),
+            np.frombuffer(timestamps, dtype=np.float64),
+        )
+
+    def load_state(self):
+        """Persisted aggregated state, None if missing or built with other weights/half-life"""
+        try:
+            with np.load(self.state_path) as archive:
+                state = {name: archive[name] for name in archive.files}
+        except FileNotFoundError:
+            return None
+
+        if str(state["fingerprint"]) != self._fingerprint():
+            return None
+        return state
+
+    def save_state(self, state):
+        """Write the state atomically to state_path (.npz)"""
+        directory = os.path.dirname(self.state_path)
+        os.makedirs(directory, exist_ok=True)
+
+        temporary_path = os.path.join(directory, f".interaction_matrix_{os.getpid()}.npz")
+        np.savez(temporary_path, **state)
+        os.replace(temporary_path, self.state_path)
+
+    def update(self, now=None):
+        """
+        Fold events appended since the high-water mark into the persisted state.
+        
+        Args:
+            now (datetime|None): Reference time (default timezone.now())
+        
+        Returns:
+            dict: State arrays (user_ids, product_ids, values anchored at anchor,
+                  anchor, high_water_mark, recent_event_ids, fingerprint)
+        """
+        now_timestamp = (now or timezone.now()).timestamp()
+        state = self.load_state()
+        changed = state is None
+        if state is None:
+            state = {
+                "user_ids": np.empty(0, dtype=np.int64),
+                "product_ids": np.empty(0, dtype=np.int64),
+                "values": np.empty(0),
+                "anchor": np.float64(now_timestamp),
+                "high_water_mark": np.int64(0),
+                "recent_event_ids": np.empty(0, dtype=np.int64),
+                "fingerprint": np.array(self._fingerprint()),
+            }
+        high_water_mark = int(state["high_water_mark"])
+        if "recent_event_ids" in state:
+            scan_from = max(0, high_water_mark - self.event_id_overlap)
+        else:
+            # State saved before the overlap window: its folded ids are unknown
+            scan_from = high_water_mark
+            state["recent_event_ids"] = np.empty(0, dtype=np.int64)
+
+        anchor = float(state["anchor"])
+        anchor_shift = self._decay_exponents([now_timestamp], anchor)[0]
+        if anchor_shift > self.max_anchor_exponent:
+            state["values"] = state["values"] * np.exp2(-anchor_shift)
+            anchor = now_timestamp
+            state["anchor"] = np.float64(anchor)
+            changed = True
+
+        event_ids, users, products, weights, timestamps = self._stream_events(scan_from)
+        unseen = ~np.isin(event_ids, state["recent_event_ids"])
+        event_ids, users, products, weights, timestamps = (
+            values[unseen] for values in (event_ids, users, products, weights, timestamps)
+        )
+        self.last_appended_events = len(event_ids)
+        if len(event_ids):
+            high_water_mark = max(high_water_mark, int(event_ids[-1]))
+            recent_event_ids = np.union1d(state["recent_event_ids"], event_ids)
+            user_ids, product_ids, values = self._aggregate(
+                np.concatenate([state["user_ids"], users]),
+                np.concatenate([state["product_ids"], products]),
+                np.concatenate([state["values"], weights * np.exp2(self._decay_exponents(timestamps, anchor))]),
+            )
+            state.update(
+                user_ids=user_ids,
+                product_ids=product_ids,
+                values=values,
+                high_water_mark=np.int64(high_water_mark),
+                recent_event_ids=recent_event_ids[recent_event_ids > high_water_mark - self.event_id_overlap],
+            )
+            changed = True
+
+        if changed:
+            self.save_state(state)
+        return state
+
+    def rebuild(self, now=None):
+        """Discard the persisted state and rescan all events"""
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
+        return self.update(now)
+
+    def build(self, product_ids=None, now=None):
+        """
+        Current decayed user × product matrix (appends new events first).
+        
+        Args:
+            product_ids (ndarray|None): Sorted column order (default all products by id)
+            now (datetime|None): Reference time of the decay (default timezone.now())
+        
+        Returns:
+            tuple: (csr_matrix [n_users × n_products], user_ids array, product_ids array)
+        """
+        from home.models import Product, User
+
+        now = now or timezone.now()
+        state = self.update(now)
+
+        if product_ids is None:
+            product_ids = np.fromiter(
+                Product.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=self.stream_chunk_size),
+                dtype=np.int64,
+            )
+        existing_user_ids = np.fromiter(
+            User.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=self.stream_chunk_size),
+            dtype=np.int64,
+        )
+
+        columns = np.searchsorted(product_ids, state["product_ids"])
+        keep = columns < len(product_ids)
+        keep[keep] = product_ids[columns[keep]] == state["product_ids"][keep]
+        keep &= np.isin(state["user_ids"], existing_user_ids)
+
+        user_ids, rows = np.unique(state["user_ids"][keep], return_inverse=True)
+        scale = np.exp2(-self._decay_exponents([now.timestamp()], float(state["anchor"]))[0])
+        matrix = sparse.csr_matrix(
+            (state["values"][keep] * scale, (rows, columns[keep])),
+            shape=(len(user_ids), len(product_ids)),
+        )
+
+        return matrix, user_ids, product_ids
+
+    def user_row(self, user_id, product_ids, now=None):
+        """One user's decayed row over product_ids, read directly from UserInteraction (1 × n CSR)"""
+        now = now or timezone.now()
+        _, _, products, weights, timestamps = self._stream_events(user_id=user_id)
+
+        columns = np.searchsorted(product_ids, products)
+        keep = columns < len(product_ids)
+        keep[keep] = product_ids[columns[keep]] == products[keep]
+
+        values = weights * np.exp2(self._decay_exponents(timestamps, now.timestamp()))
+        row = sparse.csr_matrix(
+            (values[keep], (np.zeros(int(keep.sum()), dtype=np.int64), columns[keep])),
+            shape=(1, len(product_ids)),
+        )
+        row.sum_duplicates()
+        return row
+
+
+class CustomImplicitALS:
+    """
+    Implicit-feedback Matrix Factorization (Hu, Koren & Volinsky, 2008).
+    
+    Algorithm: Weighted Alternating Least Squares
+    Objective: min Σ_u,i c_ui (p_ui - x_uᵀ y_i)² + λ (Σ_u ||x_u||² + Σ_i ||y_i||²)
+    
+    Where:
+        - r_ui: Feedback strength (purchased quantity + weighted, time-decayed
+          interaction events from CustomInteractionMatrixBuilder)
+        - p_ui: Preference, 1 if r_ui > 0 else 0
+        - c_ui: Confidence, 1 + α × r_ui
+        - x_u, y_i: User and item factors of rank k
+    
+    Optimizations:
+        - Purchases streamed with values_list().iterator() into a CSR matrix,
+          interaction events appended incrementally by CustomInteractionMatrixBuilder
+        - Each half-step solves a batch of users (items) at once:
+          Yᵀ C_u Y = YᵀY + Yᵀ(C_u - I)Y, the second term from one
+          sparse × dense product over the batch's nonzeros, then np.linalg.solve;
+          batches are cut by cumulative nonzeros so the nnz × k² outer
+          products stay within SIMILARITY_MEMORY_BUDGET_MB
+        - Factors persisted to .npz (settings.RECOMMENDATION_MODEL_DIR); top-N
+          of a user is one matrix-vector product + np.argpartition, a batch
+          of users is scored with one matmul
+        - Users missing from the trained model are folded in from their
+          current feedback (one k × k solve)
     """
-    
+
     def __init__(self):
-        self.similarity_threshold = 0.2
-        self.max_products_for_similarity = 500
-        self.batch_size = 100
-        self.max_comparisons_per_product = 50
-        
-        self.feature_weights = {
-            'category': 0.40,    
-            'tag': 0.30,        
-            'price': 0.20,      
-            'keywords': 0.10    
-        }
-        
-        self.stop_words = {
-            'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 
-            'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 
-            'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should',
-            'this', 'that', 'these', 'those', 'i', 'you', 'he', 'she', 'it', 'we', 
-            'they', 'me', 'him', 'her', 'us', 'them', 'my', 'your', 'his', 'its',
-            'our', 'their', 'jako', 'że', 'na', 'w', 'z', 'do', 'od', 'po', 'przez'
-        }
+        self.factors = 32
+        self.regularization = 0.1
+        self.alpha = 40.0
+        self.iterations = 15
+        self.solve_batch_size = 512
+        self.memory_budget_mb = getattr(settings, 'SIMILARITY_MEMORY_BUDGET_MB', None)
+        self.stream_chunk_size = 5000
+        self.seed = 42
+        self.purchase_weight = 1.0
+        # 'purchase' events duplicate OrderProduct rows and are not counted twice
+        self.interaction_builder = CustomInteractionMatrixBuilder(
+            interaction_weights={
+                interaction_type: weight
+                for interaction_type, weight in CustomInteractionMatrixBuilder().interaction_weights.items()
+                if interaction_type != "purchase"
+            }
+        )
+        self.model_path = os.path.join(
+            getattr(settings, 'RECOMMENDATION_MODEL_DIR', os.path.join(settings.BASE_DIR, "recommendation_models")),
+            "implicit_als.npz",
+        )
 
-    def calculate_product_similarity(self, product1, product2):
+    def _purchase_rows(self, user_id=None):
+        """Yield (user_id, product_id, strength) of purchased quantities"""
+        from home.models import OrderProduct
+
+        purchases = OrderProduct.objects.all()
+        if user_id is not None:
+            purchases = purchases.filter(order__user_id=user_id)
+
+        for buyer_id, product_id, quantity in purchases.values_list(
+            "order__user_id", "product_id", "quantity"
+        ).iterator(chunk_size=self.stream_chunk_size):
+            yield buyer_id, product_id, quantity * self.purchase_weight
+
+    def build_feedback_matrix(self):
         """
-        Calculate weighted cosine similarity between two products.
-        
-        Args:
-            product1: First product object
-            product2: Second product object
+        User × product CSR matrix of r_ui: purchased quantities plus the
+        weighted, time-decayed interaction events of CustomInteractionMatrixBuilder.
         
         Returns:
-            float: Similarity score [0.0, 1.0]
-        
-        Formula: cos(θ) = Σ(f1[i] × f2[i]) / √(Σf1[i]² × Σf2[i]²)
+            tuple: (csr_matrix [n_users × n_products], user_ids array, product_ids array)
         """
-        features1 = self._extract_weighted_features(product1)
-        features2 = self._extract_weighted_features(product2)
-        
-        dot_product = 0.0
-        norm1 = 0.0
-        norm2 = 0.0
-        
-        all_features = set(features1.keys()) | set(features2.keys())
-        
-        for feature in all_features:
-            val1 = features1.get(feature, 0.0)
-            val2 = features2.get(feature, 0.0)
-            
-            dot_product += val1 * val2
-            norm1 += val1 * val1
-            norm2 += val2 * val2
-            
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-            
-        return dot_product / (math.sqrt(norm1) * math.sqrt(norm2))
+        from home.models import Product
 
-    def _extract_weighted_features(self, product):
+        product_ids = np.fromiter(
+            Product.objects.order_by("id").values_list("id", flat=True).iterator(chunk_size=self.stream_chunk_size),
+            dtype=np.int64,
+        )
+
+        purchase_users, purchase_products, purchase_strengths = array("q"), array("q"), array("d")
+        for user_id, product_id, strength in self._purchase_rows():
+            purchase_users.append(user_id)
+            purchase_products.append(product_id)
+            purchase_strengths.append(strength)
+        purchase_users = np.frombuffer(purchase_users, dtype=np.int64)
+
+        interactions, interaction_user_ids, _ = self.interaction_builder.build(product_ids)
+        interactions = interactions.tocoo()
+
+        user_ids = np.union1d(np.unique(purchase_users), interaction_user_ids)
+        matrix = sparse.csr_matrix(
+            (
+                np.concatenate([np.frombuffer(purchase_strengths, dtype=np.float64), interactions.data]),
+                (
+                    np.concatenate([
+                        np.searchsorted(user_ids, purchase_users),
+                        np.searchsorted(user_ids, interaction_user_ids[interactions.row]),
+                    ]),
+                    np.concatenate([
+                        np.searchsorted(product_ids, np.frombuffer(purchase_products, dtype=np.int64)),
+                        interactions.col,
+                    ]),
+                ),
+            ),
+            shape=(len(user_ids), len(product_ids)),
+        )
+        matrix.sum_duplicates()
+
+        return matrix, user_ids, product_ids
+
+    def _solve_factors(self, feedback, fixed_factors, gram=None):
         """
-        Extract weighted feature vector from product attributes.
+        One ALS half-step: solve every row of feedback against the fixed factors.
         
-        Features:
-            - category_*: 40% weight
-            - tag_*: 30% weight
-            - price_*: 20% weight (low/medium/high/premium)
-            - keyword_*: 10% weight (split among top 5 keywords)
+        Formula: x_u = (YᵀY + Yᵀ(C_u - I)Y + λI)⁻¹ Yᵀ C_u p_u
         
         Args:
-            product: Product object with categories, tags, description
+            feedback (csr_matrix): Rows to solve × columns of fixed_factors, values r_ui
+            fixed_factors (ndarray): Factors of the other side [n_columns × k]
+            gram (ndarray|None): Precomputed YᵀY + λI
         
         Returns:
-            dict: {"feature_name": weight}
+            ndarray: Solved factors [n_rows × k]
         """
-        features = {}
-        
-        for category in product.categories.all():
-            feature_name = f"category_{category.name.lower()}"
-            features[feature_name] = self.feature_weights['category']
-        
-        for tag in product.tags.all():
-            feature_name = f"tag_{tag.name.lower()}"
-            features[feature_name] = self.feature_weights['tag']
-        
-        price_category = self._get_price_category(product.price)
-        features[f"price_{price_category}"] = self.feature_weights['price']
-        
-        if product.description:
-            keywords = self._extract_keywords(product.description)
-            for keyword in keywords[:5]:
-                feature_name = f"keyword_{keyword}"
-                features[feature_name] = self.feature_weights['keywords'] / len(keywords[:5])
-        
-        return features
+        rank = fixed_factors.shape[1]
+        if gram is None:
+            gram = fixed_factors.T.dot(fixed_factors) + self.regularization * np.eye(rank)
 
-    def _get_price_category(self, price):
+        solved = np.zeros((feedback.shape[0], rank))
+        for start, stop in self._solve_blocks(feedback.indptr, rank):
+            block = feedback[start:stop]
+            confidence_excess = self.alpha * block.data
+            selector = sparse.csr_matrix(
+                (confidence_excess, np.arange(block.nnz), block.indptr),
+                shape=(block.shape[0], block.nnz),
+            )
+
+            # Σ_i (c_ui - 1) y_i y_iᵀ, at most outer_product_cells nonzeros at a time
+            lhs = np.repeat(gram[None], block.shape[0], axis=0).reshape(block.shape[0], rank * rank)
+            cells = self._outer_product_cells(rank)
+            for offset in range(0, block.nnz, cells):
+                vectors = fixed_factors[block.indices[offset:offset + cells]]
+                outer_products = (vectors[:, :, None] * vectors[:, None, :]).reshape(len(vectors), rank * rank)
+                lhs += selector[:, offset:offset + cells].dot(outer_products)
+
+            rhs = sparse.csr_matrix(
+                (1.0 + confidence_excess, block.indices, block.indptr), shape=block.shape
+            ).dot(fixed_factors)
+            solved[start:stop] = np.linalg.solve(
+                lhs.reshape(block.shape[0], rank, rank), rhs[:, :, None]
+            )[:, :, 0]
+
+        return solved
+
+    def _outer_product_cells(self, rank):
+        """Nonzeros whose k × k outer products (float64) fit the memory budget"""
+        if self.memory_budget_mb is None:
+            return np.iinfo(np.int64).max
+        return max(1, int(self.memory_budget_mb * 1024 * 1024) // (rank * rank * 8))
+
+    def _solve_blocks(self, indptr, rank):
         """
-        Categorize product price into discrete ranges.
+        Row ranges of one half-step: at most solve_batch_size rows and, as
+        far as rows allow, at most _outer_product_cells nonzeros each (a
+        single heavier row is a block of its own).
         
-        Ranges:
-            - "low": < $100
-            - "medium": $100 - $500
-            - "high": $500 - $1500
-            - "premium": >= $1500
+        Returns:
+            list: [(start, stop)] covering every row
         """
-        if price < 100:
-            return "low"
-        elif price < 500:
-            return "medium"
-        elif price < 1500:
-            return "high"
-        else:
-            return "premium"
+        n_rows = len(indptr) - 1
+        cells = self._outer_product_cells(rank)
+        bounds = []
+        start = 0
+        while start < n_rows:
+            # Clamped in Python ints: an unbounded budget overflows int32 indptr
+            budget_end = min(int(indptr[start]) + cells, int(indptr[-1]))
+            stop = int(np.searchsorted(indptr, budget_end, side="right")) - 1
+            stop = min(max(stop, start + 1), start + self.solve_batch_size, n_rows)
+            bounds.append((start, stop))
+            start = stop
+        return bounds
 
-    def _extract_keywords(self, text):
+    def train(self):
         """
-        Extract keywords from product description using term frequency.
-        
-        Algorithm:
-            1. Remove punctuation, lowercase
-            2. Filter stop words and short words (< 4 chars)
-            3. Calculate term frequency
-            4. Return top 10 most frequent terms
+        Train user and item factors on all feedback and persist them.
         
         Returns:
-            list: Top 10 keywords
+            dict: {"users": n, "products": n, "feedback_cells": n, "factors": k}
         """
-        if not text:
-            return []
-        
-        text = re.sub(r'[^\w\s]', ' ', text.lower())
-        words = text.split()
-        
-        filtered_words = [
-            word for word in words 
-            if len(word) > 3 and word not in self.stop_words
-        ]
-        
-        word_freq = Counter(filtered_words)
-        return [word for word, freq in word_freq.most_common(10)]
+        matrix, user_ids, product_ids = self.build_feedback_matrix()
+        print(
+            f"Training implicit ALS (k={self.factors}, λ={self.regularization}, α={self.alpha}) on "
+            f"{len(user_ids)} users × {len(product_ids)} products ({matrix.nnz} feedback cells)"
+        )
 
-    def generate_similarities_for_all_products(self):
+        random_state = np.random.RandomState(self.seed)
+        item_factors = random_state.normal(scale=0.01, size=(len(product_ids), self.factors))
+        user_factors = np.zeros((len(user_ids), self.factors))
+        item_matrix = matrix.T.tocsr()
+
+        for iteration in range(self.iterations):
+            user_factors = self._solve_factors(matrix, item_factors)
+            item_factors = self._solve_factors(item_matrix, user_factors)
+
+        self.save_model(user_factors, item_factors, user_ids, product_ids, matrix)
+        print(f"Saved implicit ALS factors to {self.model_path}")
+
+        return {
+            "users": len(user_ids),
+            "products": len(product_ids),
+            "feedback_cells": int(matrix.nnz),
+            "factors": self.factors,
+        }
+
+    def save_model(self, user_factors, item_factors, user_ids, product_ids, matrix):
+        """Write the factors atomically to model_path (.npz)"""
+        directory = os.path.dirname(self.model_path)
+        os.makedirs(directory, exist_ok=True)
+
+        temporary_path = os.path.join(directory, f".implicit_als_{os.getpid()}.npz")
+        np.savez(
+            temporary_path,
+            user_factors=user_factors,
+            item_factors=item_factors,
+            item_gram=item_factors.T.dot(item_factors) + self.regularization * np.eye(item_factors.shape[1]),
+            user_ids=user_ids,
+            product_ids=product_ids,
+            seen_indptr=matrix.indptr,
+            seen_indices=matrix.indices,
+        )
+        os.replace(temporary_path, self.model_path)
+
+    def load_model(self):
         """
-        Generate content-based similarities for all products in catalog.
-        
-        Optimizations:
-            - Caching: Results cached for 2 hours
-            - Batch processing: Bulk inserts (1000 records/batch)
-            - Threshold: Only store similarities > 0.2
-            - Limited comparisons: Max 50 neighbors per product
-            - Prefetching: Eager load categories, tags, specs
-        
-        Performance:
-            - 500 products: ~2-3 minutes
-            - O(n × min(n, max_comparisons)) complexity
+        Load persisted factors (cached per process until the file changes).
         
         Returns:
-            int: Number of similarity records created
+            dict|None: Arrays saved by save_model, None if no model was trained
         """
-        from home.models import Product, ProductSimilarity
+        return load_npz_model(self.model_path)
 
-        cache_key = "content_based_similarity_matrix"
-        cached_result = cache.get(cache_key)
-        
-        if cached_result:
-            print("Using cached content-based filtering results")
-            return cached_result
+    def _fold_in_user(self, model, user_id):
+        """Solve one user's factors from their current feedback, item factors fixed"""
+        product_ids = model["product_ids"]
+        columns, strengths = [], []
+        for _, product_id, strength in self._purchase_rows(user_id):
+            position = int(np.searchsorted(product_ids, product_id))
+            if position < len(product_ids) and product_ids[position] == product_id:
+                columns.append(position)
+                strengths.append(strength)
 
-        products = list(
-            Product.objects.prefetch_related(
-                "categories", "tags", "specification_set"
-            ).all()[:self.max_products_for_similarity]
-        )
+        feedback = sparse.csr_matrix(
+            (strengths, ([0] * len(columns), columns)), shape=(1, len(product_ids))
+        ) + self.interaction_builder.user_row(user_id, product_ids)
+        feedback = feedback.tocsr()
+        feedback.sum_duplicates()
+        return self._solve_factors(feedback, model["item_factors"], model["item_gram"])[0], feedback.indices
+
+    def _top_n(self, scores, n):
+        """Top-n columns of every row of scores (np.argpartition, then sort of the n)"""
+        n = min(n, scores.shape[1])
+        if n <= 0:
+            return np.empty((scores.shape[0], 0), dtype=np.int64)
+
+        candidates = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(candidates, order, axis=1)
+
+    def recommend_for_users(self, user_ids, n=10, exclude_seen=True):
+        """
+        Top-n products for a batch of users from the persisted factors.
         
-        if len(products) < 2:
-            return 0
+        Scores of all trained users are one matmul X_batch · Yᵀ; users
+        missing from the model are folded in first.
+        
+        Args:
+            user_ids (iterable): Users to recommend for
+            n (int): Products per user
+            exclude_seen (bool): Skip products the user already gave feedback on
+        
+        Returns:
+            dict: {user_id: [(product_id, score), ...]} best first ({} if no model,
+                  [] for users without any feedback)
+        """
+        model = self.load_model()
+        if model is None:
+            return {}
 
-        print(f"Processing {len(products)} products for enhanced content-based similarity")
+        trained_ids = model["user_ids"]
+        user_ids = list(user_ids)
+        user_vectors = np.zeros((len(user_ids), model["item_factors"].shape[1]))
+        seen_columns = []
+        cold_positions = set()
 
-        ProductSimilarity.objects.filter(similarity_type="content_based").delete()
+        for position, user_id in enumerate(user_ids):
+            row = int(np.searchsorted(trained_ids, user_id))
+            if row < len(trained_ids) and trained_ids[row] == user_id:
+                user_vectors[position] = model["user_factors"][row]
+                seen_columns.append(
+                    model["seen_indices"][model["seen_indptr"][row]:model["seen_indptr"][row + 1]]
+                )
+            else:
+                user_vectors[position], columns = self._fold_in_user(model, user_id)
+                seen_columns.append(columns)
+                if not len(columns):
+                    cold_positions.add(position)
 
-        similarities_to_create = []
-        similarities_created = 0
+        scores = user_vectors.dot(model["item_factors"].T)
+        if exclude_seen:
+            for position, columns in enumerate(seen_columns):
+                scores[position, columns] = -np.inf
 
-        for i, product1 in enumerate(products):
-            if i % 25 == 0:
-                print(f"Processed {i}/{len(products)} products")
-
-            comparison_products = products[i + 1: i + 1 + self.max_comparisons_per_product]
-
-            for product2 in comparison_products:
-                similarity_score = self.calculate_product_similarity(product1, product2)
-
-                if similarity_score > self.similarity_threshold:
-                    similarities_to_create.extend([
-                        ProductSimilarity(
-                            product1=product1,
-                            product2=product2,
-                            similarity_type="content_based",
-                            similarity_score=similarity_score,
-                        ),
-                        ProductSimilarity(
-                            product1=product2,
-                            product2=product1,
-                            similarity_type="content_based",
-                            similarity_score=similarity_score,
-                        )
-                    ])
-                    similarities_created += 2
+        product_ids = model["product_ids"]
+        recommendations = {}
+        for position, columns in enumerate(self._top_n(scores, n)):
+            recommendations[user_ids[position]] = [
+                (int(product_ids[column]), float(scores[position, column]))
+                for column in columns
+                if position not in cold_positions and np.isfinite(scores[position, column])
+            ]
+        return recommendations
 
-                    if len(similarities_to_create) >= 1000:
-                        ProductSimilarity.objects.bulk_create(similarities_to_create)
-                        similarities_to_create = []
+    def recommend(self, user_id, n=10, exclude_seen=True):
+        """Top-n (product_id, score) for one user ([] if no model was trained)"""
+        return self.recommend_for_users([user_id], n, exclude_seen).get(user_id, [])
 
-        if similarities_to_create:
-            ProductSimilarity.objects.bulk_create(similarities_to_create)
 
-        print(f"Created {similarities_created} enhanced content-based similarities")
-        
-        cache.set(cache_key, similarities_created, timeout=getattr(settings, 'CACHE_TIMEOUT_LONG', 7200))
-        
-        return similarities_created
+_lsh_index_cache = {}
+_npz_model_cache = {}
 
 
 class CustomFuzzySearch:
@@ -270,6 +2735,8 @@ class CustomFuzzySearch:
         - Sliding window for long texts
         - Result caching (5 minutes)
         - Multi-field search (name, description, category, specs)
+        - Trigram inverted index: only the candidate_limit products sharing
+          the most trigrams with the query are scored (ProductTrigramIndex)
     
     Algorithms:
         - Levenshtein distance for character similarity
@@ -290,6 +2757,27 @@ class CustomFuzzySearch:
             'category': 0.20,   
             'specification': 0.10 
         }
+        
+        self.candidate_limit = getattr(settings, 'FUZZY_SEARCH_CANDIDATES', 200)
+
+    def candidate_product_ids(self, query, limit=None, price_filter=None):
+        """
+        Products worth scoring for a query, from the trigram inverted index.
+        
+        Args:
+            query (str): Search query
+            limit (int|None): Candidates (default: candidate_limit)
+            price_filter (callable|None): Prices -> keep-mask, applied before the limit
+        
+        Returns:
+            list: Product ids, most trigram overlap first
+        """
+        return get_product_trigram_index().candidates(
+            query,
+            self.candidate_limit if limit is None else limit,
+            {**self.field_weights, 'tag': 0.05},
+            price_filter,
+        )
 
     def calculate_fuzzy_score(self, query, text):
         """
@@ -372,7 +2860,7 @@ class CustomFuzzySearch:
                 best_match = 0.0
                 for t_word in text_words:
                     if len(q_word) > 3 and len(t_word) > 3: 
-                        similarity = self._calculate_character_similarity(q_word, t_word)
+                        similarity = self._calculate_character_similarity(q_word, t_word, 0.7)
                         if similarity > 0.7: 
                             best_match = max(best_match, similarity * 0.7) 
                 if best_match > 0:
@@ -437,19 +2925,28 @@ class CustomFuzzySearch:
         
         best_score = 0.0
         for chunk in chunks:
-            chunk_score = self._calculate_character_similarity(query, chunk)
+            # Only a chunk beating the best so far matters
+            chunk_score = self._calculate_character_similarity(query, chunk, best_score or None)
             best_score = max(best_score, chunk_score)
             
         return best_score
 
-    def _calculate_character_similarity(self, s1, s2):
+    def _calculate_character_similarity(self, s1, s2, min_similarity=None):
         """
         Calculate character-level similarity using Levenshtein distance.
         
-        Algorithm: Dynamic programming Levenshtein distance
+        Algorithm: Levenshtein distance (levenshtein_distance: bit-parallel,
+        banded when min_similarity leaves only a narrow band)
         Formula: similarity = 1 - (distance / max_length)
         
-        Optimization: Early rejection if length difference > 50%
+        Optimization: Early rejection if length difference > 50%; with
+        min_similarity, the distance computation stops once the similarity
+        can no longer reach it
+        
+        Args:
+            s1 (str): First string
+            s2 (str): Second string
+            min_similarity (float|None): Similarities below it may be returned as 0.0
         
         Returns:
             float: Character similarity [0.0, 1.0]
@@ -464,30 +2961,17 @@ class CustomFuzzySearch:
         
         if abs(len1 - len2) > max(len1, len2) * 0.5:
             return 0.0
-        
-        prev_row = list(range(len2 + 1))
-        curr_row = [0] * (len2 + 1)
-
-        for i in range(1, len1 + 1):
-            curr_row[0] = i
-            for j in range(1, len2 + 1):
-                if s1[i - 1] == s2[j - 1]:
-                    cost = 0
-                else:
-                    cost = 1
-
-                curr_row[j] = min(
-                    prev_row[j] + 1,       
-                    curr_row[j - 1] + 1,  
-                    prev_row[j - 1] + cost, 
-                )
-            prev_row, curr_row = curr_row, prev_row
 
         max_len = max(len1, len2)
-        if max_len == 0:
-            return 1.0
+        max_distance = None
+        if min_similarity is not None:
+            # Any larger distance gives a similarity below min_similarity
+            max_distance = math.ceil((1 - min_similarity) * max_len)
+
+        distance = levenshtein_distance(s1, s2, max_distance)
+        if max_distance is not None and distance > max_distance:
+            return 0.0
 
-        distance = prev_row[len2]
         similarity = 1 - (distance / max_len)
 
         return max(0.0, similarity)
@@ -497,7 +2981,11 @@ class CustomFuzzySearch:
         if threshold is None:
             threshold = self.default_threshold
 
-        cache_key = f"fuzzy_search_{hash(query)}_{threshold}_{len(products)}"
+        # Keyed by the products themselves: candidate lists of the same
+        # length (e.g. for different price ranges) must not share results
+        product_ids = ",".join(str(product_id) for product_id in sorted(product.id for product in products))
+        products_digest = hashlib.sha256(product_ids.encode("utf-8")).hexdigest()[:16]
+        cache_key = f"fuzzy_search_{hash(query)}_{threshold}_{products_digest}"
         cached_result = cache.get(cache_key)
         if cached_result:
             return cached_result
@@ -557,6 +3045,255 @@ class CustomFuzzySearch:
         return results
 
 
+class ProductTrigramIndex:
+    """
+    Inverted index from padded trigrams to the search fields of every product.
+
+    Indexes the texts CustomFuzzySearch.search_products scores: name,
+    description, every category, the first 8 specifications (value and
+    parameter name) and every tag, lowercased as calculate_fuzzy_score
+    sees them. Arrays:
+
+        field_products  int64[f]      product of every indexed field
+        field_kinds     int64[f]      position in FIELD_KINDS
+        postings_indptr int64[t + 1]  CSC pointers, one column per trigram
+        postings        int64[nnz]    fields containing the trigram
+        vocabulary      {trigram: column}
+        product_ids     int64[p]      indexed products (sorted)
+        product_prices  float64[p]    their prices (price filters)
+
+    A query only reads the posting lists of its own trigrams, so gathering
+    candidates costs O(Σ posting lengths), not O(catalog). Candidates are
+    ranked by the share of query trigrams each field contains, the best
+    field of every kind weighted like search_products; only the top ones
+    go through the full fuzzy scorers.
+
+    The product, specification, category and tag signals write the ids of
+    changed products to the 'search' change log (record_index_changes);
+    a process patches its index for those products only (patched), and
+    rebuilds it only when the log cannot be replayed.
+    """
+
+    FIELD_KINDS = ("name", "description", "category", "specification", "tag")
+
+    def __init__(self, log_epoch=None, log_position=0):
+        self.log_epoch = log_epoch
+        self.log_position = log_position
+        self.field_products = np.empty(0, dtype=np.int64)
+        self.field_kinds = np.empty(0, dtype=np.int64)
+        self.postings_indptr = np.zeros(1, dtype=np.int64)
+        self.postings = np.empty(0, dtype=np.int64)
+        self.vocabulary = {}
+        self.product_ids = np.empty(0, dtype=np.int64)
+        self.product_prices = np.empty(0, dtype=np.float64)
+
+    def _read(self, product_ids=None):
+        """
+        Searchable fields and prices of the catalog, or of some products (four queries).
+
+        The queries are not one snapshot: category, tag and specification
+        rows of products created after the products query are dropped
+        (their products are indexed from the change log next time), so
+        every field belongs to an indexed product.
+
+        Returns:
+            tuple: ([(product_id, kind, text)], {product_id: price})
+        """
+        from .models import ProductCategory, Specification
+
+        products = Product.objects.all()
+        categories = ProductCategory.objects.all()
+        tags = Product.tags.through.objects.all()
+        specifications = Specification.objects.all()
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+            categories = categories.filter(product_id__in=product_ids)
+            tags = tags.filter(product_id__in=product_ids)
+            specifications = specifications.filter(product_id__in=product_ids)
+
+        fields, prices = [], {}
+        for product_id, name, description, price in products.values_list("id", "name", "description", "price"):
+            prices[product_id] = float(price)
+            fields.append((product_id, "name", name))
+            fields.append((product_id, "description", description))
+        for product_id, name in categories.values_list("product_id", "category__name"):
+            if product_id in prices:
+                fields.append((product_id, "category", name))
+        for product_id, name in tags.values_list("product_id", "tag__name"):
+            if product_id in prices:
+                fields.append((product_id, "tag", name))
+
+        spec_counts = Counter()
+        for product_id, parameter_name, specification in specifications.order_by(
+            "product_id", "id"
+        ).values_list("product_id", "parameter_name", "specification"):
+            if product_id not in prices:
+                continue
+            spec_counts[product_id] += 1
+            if spec_counts[product_id] <= 8:
+                fields.append((product_id, "specification", specification))
+                fields.append((product_id, "specification", parameter_name))
+        return fields, prices
+
+    def _invert(self, fields, first_field):
+        """(field_products, field_kinds, rows, columns) of fields numbered from first_field"""
+        fuzzy_search = CustomFuzzySearch()
+        kinds = {kind: position for position, kind in enumerate(self.FIELD_KINDS)}
+
+        field_products, field_kinds, rows, columns = [], [], [], []
+        for product_id, kind, text in fields:
+            text = (text or "").lower().strip()
+            if not text:
+                continue
+
+            field = first_field + len(field_products)
+            field_products.append(product_id)
+            field_kinds.append(kinds[kind])
+            for trigram in fuzzy_search._generate_trigrams(text):
+                rows.append(field)
+                columns.append(self.vocabulary.setdefault(trigram, len(self.vocabulary)))
+
+        return (
+            np.asarray(field_products, dtype=np.int64),
+            np.asarray(field_kinds, dtype=np.int64),
+            np.asarray(rows, dtype=np.int64),
+            np.asarray(columns, dtype=np.int64),
+        )
+
+    def _set_postings(self, rows, columns):
+        order = np.argsort(columns, kind="stable")
+        self.postings = rows[order]
+        self.postings_indptr = np.r_[
+            0, np.cumsum(np.bincount(columns, minlength=len(self.vocabulary)))
+        ].astype(np.int64)
+
+    def _set_prices(self, prices):
+        self.product_ids = np.fromiter(sorted(prices), dtype=np.int64, count=len(prices))
+        self.product_prices = np.array([prices[product_id] for product_id in self.product_ids.tolist()], dtype=np.float64)
+
+    def build(self):
+        """
+        Read every searchable field (four queries) and invert its trigrams.
+
+        Returns:
+            ProductTrigramIndex: self
+        """
+        fields, prices = self._read()
+        self.field_products, self.field_kinds, rows, columns = self._invert(fields, 0)
+        self._set_postings(rows, columns)
+        self._set_prices(prices)
+        return self
+
+    def patched(self, product_ids, log_position):
+        """
+        Copy of the index with the fields of some products re-read.
+
+        Only the changed products are queried (four queries); their old
+        fields are dropped from the arrays and their current ones appended,
+        so a deleted product simply disappears.
+
+        Args:
+            product_ids (iterable): Products whose searchable data changed
+            log_position (int): Change log position the copy is current at
+
+        Returns:
+            ProductTrigramIndex: New index (self is left untouched for concurrent readers)
+        """
+        product_ids = np.unique(np.asarray(list(product_ids), dtype=np.int64))
+        index = ProductTrigramIndex(self.log_epoch, log_position)
+        index.vocabulary = dict(self.vocabulary)
+
+        kept_fields = ~np.isin(self.field_products, product_ids)
+        renumbered = np.cumsum(kept_fields) - 1
+        columns = np.repeat(np.arange(len(self.postings_indptr) - 1), np.diff(self.postings_indptr))
+        kept_postings = kept_fields[self.postings]
+
+        fields, prices = self._read(product_ids.tolist())
+        new_products, new_kinds, new_rows, new_columns = index._invert(fields, int(kept_fields.sum()))
+
+        index.field_products = np.r_[self.field_products[kept_fields], new_products]
+        index.field_kinds = np.r_[self.field_kinds[kept_fields], new_kinds]
+        index._set_postings(
+            np.r_[renumbered[self.postings[kept_postings]], new_rows],
+            np.r_[columns[kept_postings], new_columns],
+        )
+
+        kept_products = ~np.isin(self.product_ids, product_ids)
+        prices.update(zip(self.product_ids[kept_products].tolist(), self.product_prices[kept_products].tolist()))
+        index._set_prices(prices)
+        return index
+
+    def candidates(self, query, limit, field_weights, price_filter=None):
+        """
+        Products whose fields share the most trigrams with the query.
+
+        Formula: rank(p) = Σ_kind w_kind × max_f∈fields(p, kind) |T(q) ∩ T(f)| / |T(q)|
+
+        Args:
+            query (str): Search query
+            limit (int): Candidates returned
+            field_weights (dict): Weight per FIELD_KINDS entry
+            price_filter (callable|None): float64 prices -> bool keep-mask,
+                applied before the limit
+
+        Returns:
+            list: Product ids, best first (ties by id)
+        """
+        query_trigrams = CustomFuzzySearch()._generate_trigrams(query.lower().strip())
+        columns = np.array(
+            [self.vocabulary[trigram] for trigram in query_trigrams if trigram in self.vocabulary],
+            dtype=np.int64,
+        )
+        if not len(columns):
+            return []
+
+        starts = self.postings_indptr[columns]
+        lengths = self.postings_indptr[columns + 1] - starts
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        fields, overlaps = np.unique(self.postings[np.repeat(starts, lengths) + offsets], return_counts=True)
+
+        weights = np.array([field_weights.get(kind, 0.0) for kind in self.FIELD_KINDS])
+        field_scores = overlaps / len(query_trigrams) * weights[self.field_kinds[fields]]
+
+        # Best field of every (product, kind), then summed per product
+        keys, key_positions = np.unique(
+            self.field_products[fields] * len(self.FIELD_KINDS) + self.field_kinds[fields],
+            return_inverse=True,
+        )
+        best = np.zeros(len(keys))
+        np.maximum.at(best, key_positions, field_scores)
+        product_ids, product_positions = np.unique(keys // len(self.FIELD_KINDS), return_inverse=True)
+        totals = np.bincount(product_positions, weights=best)
+
+        if price_filter is not None:
+            keep = price_filter(self.product_prices[np.searchsorted(self.product_ids, product_ids)])
+            product_ids, totals = product_ids[keep], totals[keep]
+
+        order = np.lexsort((product_ids, -totals))[:limit]
+        return product_ids[order].tolist()
+
+
+def get_product_trigram_index():
+    """
+    Process-local trigram index, patched from the 'search' change log.
+
+    Costs one cache read when nothing changed.
+    """
+    index = _trigram_indexes.get("index")
+    changes = None if index is None else read_index_changes("search", index.log_epoch, index.log_position)
+    if changes is None:
+        epoch, position = index_change_log_head("search")
+        index = ProductTrigramIndex(epoch, position).build()
+        _trigram_indexes["index"] = index
+    elif changes[1]:
+        index = index.patched(changes[1], changes[0])
+        _trigram_indexes["index"] = index
+    return index
+
+
+_trigram_indexes = {}
+
+
 class CustomAssociationRules:
     """
     Custom implementation of Apriori algorithm for Market Basket Analysis.
@@ -0,0 +1,125 @@
+"""
+Edit Distance Kernels for Fuzzy String Matching.
+
+Levenshtein distance (insert, delete, substitute; cost 1 each) without the
+full O(n·m) dynamic programming table:
+
+1. Bit-parallel (Myers 1999, Hyyrö 2001): the DP column of the pattern is
+   encoded as vertical +1/-1 delta bit vectors and advanced one text
+   character at a time with a few integer operations, so a comparison
+   costs O(n) word operations instead of O(n·m) cells. A pattern of at
+   most 64 characters fits one machine word; longer ones use Python's
+   arbitrary-precision integers as the multi-word vector.
+2. Banded (Ukkonen 1985): when the caller only needs distances up to k,
+   only the diagonals |i - j| <= k of the table can hold a value <= k, so
+   O(k·n) cells are computed, and the computation stops as soon as a whole
+   band row exceeds k. Used for long patterns with a narrow band
+   (2k + 1 <= MAX_BAND_WIDTH), where it beats the multi-word vectors.
+
+Both return exactly the distance of the full table when it is within the
+bound; beyond it, any value greater than max_distance.
+
+This module deliberately imports nothing from Django.
+"""
+
+WORD_SIZE = 64
+MAX_BAND_WIDTH = 32
+
+
+def _myers_distance(pattern, text, max_distance=None):
+    """
+    Bit-parallel Levenshtein distance (one word for len(pattern) <= WORD_SIZE).
+
+    Pv / Mv: positions of the current DP column whose vertical delta is +1 / -1
+    Ph / Mh: positions whose horizontal delta is +1 / -1
+    The distance is tracked at the last pattern row.
+    """
+    m = len(pattern)
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+
+    peq = {}
+    for position, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << position)
+
+    pv, mv, score = mask, 0, m
+    remaining = len(text)
+    for char in text:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+
+        # Global alignment: row 0 grows by one per text character
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+
+        remaining -= 1
+        # Each remaining character lowers the distance by at most one
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+    return score
+
+
+def _banded_distance(s1, s2, max_distance):
+    """Levenshtein distance restricted to the diagonals |i - j| <= max_distance"""
+    len1, len2 = len(s1), len(s2)
+    over = max_distance + 1
+
+    prev_row = [j if j <= max_distance else over for j in range(len2 + 1)]
+    for i in range(1, len1 + 1):
+        low, high = max(1, i - max_distance), min(len2, i + max_distance)
+        curr_row = [over] * (len2 + 1)
+        curr_row[0] = i if i <= max_distance else over
+
+        row_min = curr_row[0]
+        char = s1[i - 1]
+        for j in range(low, high + 1):
+            value = prev_row[j - 1] + (char != s2[j - 1])
+            if prev_row[j] + 1 < value:
+                value = prev_row[j] + 1
+            if curr_row[j - 1] + 1 < value:
+                value = curr_row[j - 1] + 1
+            curr_row[j] = value if value <= max_distance else over
+            if curr_row[j] < row_min:
+                row_min = curr_row[j]
+
+        if row_min > max_distance:
+            return over
+        prev_row = curr_row
+
+    return prev_row[len2]
+
+
+def levenshtein_distance(s1, s2, max_distance=None):
+    """
+    Levenshtein distance between two strings.
+
+    Args:
+        s1 (str): First string
+        s2 (str): Second string
+        max_distance (int|None): Largest distance of interest; beyond it the
+            computation may stop early and return any value > max_distance
+
+    Returns:
+        int: Edit distance (exact when <= max_distance or max_distance is None)
+    """
+    if len(s1) < len(s2):
+        s1, s2 = s2, s1
+    if max_distance is not None and len(s1) - len(s2) > max_distance:
+        return max_distance + 1
+    if not s2:
+        return len(s1)
+
+    # The shorter string is the pattern: it fits one machine word more often
+    if len(s2) > WORD_SIZE and max_distance is not None and 2 * max_distance + 1 <= MAX_BAND_WIDTH:
+        return _banded_distance(s1, s2, max_distance)
+    return _myers_distance(s2, s1, max_distance)
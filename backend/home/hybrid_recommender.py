@@ -0,0 +1,357 @@
+"""
+Hybrid Score-Blending Recommender.
+
+Combines every recommendation source of the shop into one ranking:
+
+    collaborative    Σ of the top 5 collaborative neighbor scores of the
+                     user's products (process-local ProductNeighborIndex)
+    content_based    The same on the content-based similarity graph
+    association      Σ confidence of the association rules whose antecedent
+                     the user bought or has in the cart (AssociationRuleIndex)
+    markov           P(next category | category of the last purchase), from
+                     a category transition model cached in the process
+    fuzzy            Fuzzy inference score over the most popular products
+                     (get_popular_products, cached in the process)
+
+Algorithm:
+    1. Every source runs concurrently in a thread pool and returns at most
+       candidates_per_source {product_id: score} candidates
+    2. A source that misses its latency budget (HYBRID_SOURCE_BUDGET_MS) or
+       fails is dropped from this response instead of stalling it; a source
+       with HYBRID_SOURCE_MAX_IN_FLIGHT tasks still running in the shared
+       pool (timed out on earlier requests) is skipped, so a slow source
+       cannot occupy the pool and starve the others
+    3. Scores are max-normalized per source to [0, 1], placed in one
+       sources × candidates array and blended with HYBRID_WEIGHTS:
+           score(p) = Σ_s w_s × ŝ_s(p) / Σ_s w_s   (answered sources only)
+    4. Products the user bought or has in the cart are masked out with the
+       user's exclusion bitset (one bit test over the candidate array)
+    5. Top-n by blended score (ties by product id)
+"""
+
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+
+from home.models import OrderProduct, Product, ProductCategory
+from home.product_exclusions import get_user_exclusions
+from home.recommendation_pipeline import get_popular_products
+from home.recommendation_serving import get_neighbor_index, user_source_products
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_WEIGHTS = {
+    "collaborative": 0.35,
+    "content_based": 0.25,
+    "association": 0.2,
+    "markov": 0.1,
+    "fuzzy": 0.1,
+}
+
+
+class CategoryTransitionModel:
+    """
+    First-order Markov chain over the main categories of consecutive purchases.
+
+    Same states and transitions as CustomMarkovChain trained on category
+    sequences, built with two queries into arrays:
+
+        category_ids          int64[c]      states (sorted)
+        transitions           float64[c, c] P(next | current), rows sum to 1
+        products_by_category  {category_id: int64[...]} most ordered first
+
+    The main category of a product is its first category (lowest id).
+    """
+
+    def __init__(self):
+        self.category_ids = np.empty(0, dtype=np.int64)
+        self.transitions = np.zeros((0, 0))
+        self.products_by_category = {}
+        self.main_categories = {}
+        self.built_at = 0.0
+
+    def build(self):
+        """Read category assignments and every purchase sequence"""
+        for product_id, category_id in ProductCategory.objects.order_by(
+            "product_id", "category_id"
+        ).values_list("product_id", "category_id"):
+            self.main_categories.setdefault(product_id, category_id)
+        self.category_ids = np.unique(np.fromiter(self.main_categories.values(), dtype=np.int64))
+
+        lines = OrderProduct.objects.order_by(
+            "order__user_id", "order__date_order", "order_id", "id"
+        ).values_list("order__user_id", "product_id")
+
+        order_counts = {}
+        transitions = np.zeros((len(self.category_ids), len(self.category_ids)))
+        previous_user, previous_state = None, None
+        for user_id, product_id in lines.iterator(chunk_size=10000):
+            order_counts[product_id] = order_counts.get(product_id, 0) + 1
+            category_id = self.main_categories.get(product_id)
+            if category_id is None:
+                continue
+
+            state = int(np.searchsorted(self.category_ids, category_id))
+            if user_id == previous_user and previous_state is not None:
+                transitions[previous_state, state] += 1
+            previous_user, previous_state = user_id, state
+
+        totals = transitions.sum(axis=1, keepdims=True)
+        self.transitions = np.divide(transitions, totals, out=np.zeros_like(transitions), where=totals > 0)
+
+        members = {}
+        for product_id, category_id in self.main_categories.items():
+            members.setdefault(category_id, []).append(product_id)
+        self.products_by_category = {
+            category_id: np.array(
+                sorted(product_ids, key=lambda product_id: (-order_counts.get(product_id, 0), product_id)),
+                dtype=np.int64,
+            )
+            for category_id, product_ids in members.items()
+        }
+        self.built_at = time.monotonic()
+        return self
+
+    def next_products(self, product_id, top_categories=5, per_category=20):
+        """
+        Products of the likeliest next categories after a purchase.
+
+        Returns:
+            dict: {product_id: P(category of product | category of product_id)}
+        """
+        category_id = self.main_categories.get(product_id)
+        if category_id is None or not len(self.category_ids):
+            return {}
+
+        row = self.transitions[int(np.searchsorted(self.category_ids, category_id))]
+        scores = {}
+        for state in np.argsort(-row, kind="stable")[:top_categories]:
+            if row[state] <= 0:
+                break
+            for candidate in self.products_by_category[int(self.category_ids[state])][:per_category]:
+                scores[int(candidate)] = float(row[state])
+        return scores
+
+
+def get_category_transition_model():
+    """Process-local transition model, rebuilt after CACHE_TIMEOUT_LONG seconds"""
+    model = _transition_models.get("model")
+    max_age = getattr(settings, "CACHE_TIMEOUT_LONG", 7200)
+    if model is None or time.monotonic() - model.built_at > max_age:
+        model = CategoryTransitionModel().build()
+        _transition_models["model"] = model
+    return model
+
+
+class CustomHybridRecommender:
+    """
+    Weighted blend of the collaborative, content-based, association rule,
+    Markov and fuzzy logic recommenders under a per-source latency budget.
+
+    Attributes:
+        weights (dict): Blend weight per source (HYBRID_WEIGHTS)
+        budgets_ms (dict): Latency budget per source (HYBRID_SOURCE_BUDGET_MS)
+        candidates_per_source (int): Candidates kept from each source
+        max_in_flight_per_source (int): Pool tasks a source may have running (HYBRID_SOURCE_MAX_IN_FLIGHT)
+        last_report (dict): {source: "ok" | "empty" | "timeout" | "busy" | "error"} of the last call
+    """
+
+    def __init__(self):
+        self.weights = getattr(settings, "HYBRID_WEIGHTS", DEFAULT_WEIGHTS)
+        self.budgets_ms = getattr(settings, "HYBRID_SOURCE_BUDGET_MS", {})
+        self.default_budget_ms = 200
+        self.candidates_per_source = 100
+        self.max_in_flight_per_source = getattr(settings, "HYBRID_SOURCE_MAX_IN_FLIGHT", 2)
+        self.last_report = {}
+
+    def _top(self, scores):
+        """The candidates_per_source best candidates of a source"""
+        if len(scores) <= self.candidates_per_source:
+            return scores
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return dict(ranked[:self.candidates_per_source])
+
+    def _neighbor_source(self, similarity_type, user, products):
+        return get_neighbor_index(similarity_type).aggregate(products, per_product=5)
+
+    def _collaborative(self, user, products):
+        return self._neighbor_source("collaborative", user, products)
+
+    def _content_based(self, user, products):
+        return self._neighbor_source("content_based", user, products)
+
+    def _association(self, user, products):
+        return get_neighbor_index("association").aggregate(products, per_product=self.candidates_per_source)
+
+    def _markov(self, user, products):
+        last_product_id = OrderProduct.objects.filter(order__user=user).order_by(
+            "-order__date_order", "-order_id", "-id"
+        ).values_list("product_id", flat=True).first()
+        if last_product_id is None:
+            return {}
+        return get_category_transition_model().next_products(last_product_id)
+
+    def _fuzzy(self, user, products):
+        from home.fuzzy_logic_engine import (
+            FuzzyMembershipFunctions,
+            FuzzyUserProfile,
+            SimpleFuzzyInference,
+        )
+        from django.db.models import Avg
+
+        user_profile = FuzzyUserProfile(user=user)
+        fuzzy_engine = SimpleFuzzyInference(FuzzyMembershipFunctions(), user_profile)
+
+        # Only the popular candidates are aggregated, never the whole catalog
+        candidates = Product.objects.filter(
+            id__in=get_popular_products(self.candidates_per_source)
+        ).annotate(
+            avg_rating=Avg("opinion__rating"),
+            order_count=Count("orderproduct", distinct=True),
+        ).prefetch_related("categories")
+
+        scores = {}
+        for product in candidates:
+            category_match = max(
+                [user_profile.fuzzy_category_match(category.name) for category in product.categories.all()]
+                or [0.0]
+            )
+            product_data = {
+                "price": float(product.price),
+                "rating": float(product.avg_rating) if product.avg_rating else 3.0,
+                "view_count": product.order_count,
+            }
+            scores[product.id] = fuzzy_engine.evaluate_product(product_data, category_match)["fuzzy_score"]
+        return scores
+
+    def _run_source(self, source, user, products):
+        """Pool task: one source's candidates (closes the thread's DB connection)"""
+        try:
+            return self._top(getattr(self, f"_{source}")(user, products))
+        finally:
+            connection.close()
+
+    def _submit_source(self, source, user, products):
+        """Start a source in the shared pool (None if it has max_in_flight_per_source tasks running)"""
+        with _in_flight_lock:
+            if _sources_in_flight[source] >= self.max_in_flight_per_source:
+                return None
+            _sources_in_flight[source] += 1
+
+        try:
+            future = _get_source_executor().submit(self._run_source, source, user, products)
+        except Exception:
+            _release_source(source)
+            raise
+        future.add_done_callback(lambda _: _release_source(source))
+        return future
+
+    def gather(self, user):
+        """
+        Candidates of every weighted source that answers within its budget.
+
+        Returns:
+            dict: {source: {product_id: raw score}}
+        """
+        products, _ = user_source_products(
+            user.id, getattr(settings, "RECOMMENDATION_ON_READ_MAX_SOURCES", 200)
+        )
+        sources = [source for source, weight in self.weights.items() if weight > 0]
+
+        started = time.monotonic()
+        futures = {source: self._submit_source(source, user, products) for source in sources}
+
+        self.last_report = {}
+        candidates = {}
+        for source in sorted(sources, key=lambda source: self.budgets_ms.get(source, self.default_budget_ms)):
+            if futures[source] is None:
+                self.last_report[source] = "busy"
+                continue
+
+            deadline = started + self.budgets_ms.get(source, self.default_budget_ms) / 1000.0
+            try:
+                scores = futures[source].result(timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                # Left running in the pool (counted in flight); its result is ignored
+                self.last_report[source] = "timeout"
+                continue
+            except Exception:
+                logger.exception("Hybrid source %s failed", source)
+                self.last_report[source] = "error"
+                continue
+
+            self.last_report[source] = "ok" if scores else "empty"
+            if scores:
+                candidates[source] = scores
+        return candidates
+
+    def blend(self, candidates, n=12, exclusions=None):
+        """
+        Normalize and blend source scores in one pass over the candidate array.
+
+        Args:
+            candidates (dict): {source: {product_id: raw score}}
+            n (int): Products returned
+            exclusions (ProductBitset|None): Products never returned
+
+        Returns:
+            list: [(product_id, blended score in [0, 1]), ...] best first
+        """
+        if not candidates:
+            return []
+
+        sources = list(candidates)
+        ids = [np.fromiter(candidates[source].keys(), dtype=np.int64) for source in sources]
+        candidate_ids = np.unique(np.concatenate(ids))
+
+        scores = np.zeros((len(sources), len(candidate_ids)))
+        for row, source in enumerate(sources):
+            values = np.fromiter(candidates[source].values(), dtype=np.float64)
+            peak = values.max()
+            if peak > 0:
+                scores[row, np.searchsorted(candidate_ids, ids[row])] = np.clip(values / peak, 0.0, None)
+
+        weights = np.array([self.weights[source] for source in sources], dtype=np.float64)
+        blended = weights.dot(scores) / weights.sum()
+        if exclusions is not None:
+            blended[exclusions.contains(candidate_ids)] = 0.0
+
+        order = np.lexsort((candidate_ids, -blended))[:n]
+        return [(int(candidate_ids[i]), float(blended[i])) for i in order if blended[i] > 0]
+
+    def recommend(self, user, n=12):
+        """Top-n (product_id, score) for a user ([] if no source has candidates)"""
+        return self.blend(self.gather(user), n, get_user_exclusions(user.id))
+
+
+def _get_source_executor():
+    """Shared pool: a timed-out source must not block the request on exit"""
+    with _source_executor_lock:
+        if "executor" not in _source_executors:
+            # Every source can have its in-flight limit running at once
+            sources = getattr(settings, "HYBRID_WEIGHTS", DEFAULT_WEIGHTS)
+            _source_executors["executor"] = ThreadPoolExecutor(
+                max_workers=getattr(settings, "HYBRID_SOURCE_MAX_IN_FLIGHT", 2) * len(sources),
+                thread_name_prefix="hybrid_source",
+            )
+        return _source_executors["executor"]
+
+
+def _release_source(source):
+    with _in_flight_lock:
+        _sources_in_flight[source] -= 1
+
+
+_transition_models = {}
+_source_executors = {}
+_source_executor_lock = threading.Lock()
+_sources_in_flight = Counter()
+_in_flight_lock = threading.Lock()
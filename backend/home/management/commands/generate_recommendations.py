@@ -0,0 +1,229 @@
+"""
+Batch generation of UserProductRecommendation for every user.
+
+Recommendations are otherwise refreshed per user, after an order or a manual
+POST, so users who stop ordering keep stale results. This command recomputes
+the stored recommendation set of every user for every stored algorithm:
+
+    collaborative / content_based   Σ of the top 5 neighbor scores of the
+                                    products the user ordered or has in the
+                                    cart (ProductNeighborIndex.aggregate_many)
+    collaborative_user              Neighbors' purchases from the precomputed
+                                    user-neighbor store (one sparse gather
+                                    per chunk)
+
+Products a user ordered or has in the cart are masked out of the user's set
+(ProductBitset of the chunk's interactions, no extra queries).
+
+collaborative_als is scored on read from the persisted factors and stores
+nothing, so it is not part of the job.
+
+Users are processed in id order, in chunks. With --workers > 1 the chunks are
+computed in a process pool; every worker loads the similarity index or the
+neighbor store once and reuses it for all of its chunks. Each chunk is
+written with one bulk replace (replace_recommendations), every user's set
+stamped with their recommendation_version, so it reads as fresh until the
+user's inputs change. The last finished user id of every algorithm is saved
+to a checkpoint file, so an interrupted run continues where it stopped with
+--resume.
+
+Usage:
+    python manage.py generate_recommendations
+    python manage.py generate_recommendations --algorithm content_based --workers 4
+    python manage.py generate_recommendations --resume
+"""
+
+import json
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from home.custom_recommendation_engine import (
+    CustomUserBasedFilter,
+    load_npz_model,
+    replace_recommendations,
+)
+from home.models import CartItem, OrderProduct
+from home.product_exclusions import ProductBitset
+from home.recommendation_serving import get_neighbor_index, recommendation_version
+
+ALGORITHMS = ["collaborative", "content_based", "collaborative_user"]
+
+
+def _interacted_products(user_ids):
+    """{user_id: [product_id, ...]} from orders and carts, two queries per chunk"""
+    products = defaultdict(list)
+    for user_id, product_id in OrderProduct.objects.filter(
+        order__user_id__in=user_ids
+    ).values_list("order__user_id", "product_id"):
+        products[user_id].append(product_id)
+    for user_id, product_id in CartItem.objects.filter(
+        user_id__in=user_ids
+    ).values_list("user_id", "product_id"):
+        products[user_id].append(product_id)
+    return products
+
+
+def generate_chunk(algorithm, user_ids, limit=50):
+    """
+    Compute and store the recommendations of one chunk of users.
+
+    Args:
+        algorithm (str): One of ALGORITHMS
+        user_ids (list): Users of the chunk
+        limit (int): Products per user for collaborative_user
+
+    Returns:
+        Counter: {"users": n, "written": n, "deleted": n}
+    """
+    index = None if algorithm == "collaborative_user" else get_neighbor_index(algorithm)
+    # Read before the inputs, like compute_user_recommendations: a change
+    # made meanwhile leaves the set stale instead of stamped as current
+    versions = {
+        user_id: recommendation_version(user_id, algorithm, index and index.version)
+        for user_id in user_ids
+    }
+    products = _interacted_products(user_ids)
+    if algorithm == "collaborative_user":
+        recommendations = CustomUserBasedFilter().recommend_for_users(user_ids, n=limit)
+        scores_by_user = {
+            user_id: dict(recommendations.get(user_id, [])) for user_id in user_ids
+        }
+    else:
+        scores_by_user = dict(zip(
+            user_ids,
+            index.aggregate_many([products[user_id] for user_id in user_ids], per_product=5),
+        ))
+
+    scores_by_user = {
+        user_id: ProductBitset.from_ids(products[user_id]).filter_scores(scores)
+        for user_id, scores in scores_by_user.items()
+    }
+    counts = replace_recommendations(algorithm, scores_by_user, versions)
+    counts["users"] = len(user_ids)
+    return counts
+
+
+def _init_worker(algorithm):
+    """Pool initializer: set up Django and load the algorithm's data once"""
+    django.setup()
+    if algorithm != "collaborative_user":
+        get_neighbor_index(algorithm)
+
+
+def _generate_chunk_task(task):
+    algorithm, user_ids, limit = task
+    return user_ids[-1], generate_chunk(algorithm, user_ids, limit)
+
+
+class Command(BaseCommand):
+    help = "Generate stored recommendations for all users and algorithms"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--algorithm", action="append", choices=ALGORITHMS,
+            help="Algorithm to generate (repeatable, default: all)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=500, help="Users per chunk")
+        parser.add_argument(
+            "--workers", type=int, default=getattr(settings, "SIMILARITY_WORKERS", 1),
+            help="Worker processes (1 = generate in this process)",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=50,
+            help="Products per user for collaborative_user",
+        )
+        parser.add_argument(
+            "--resume", action="store_true",
+            help="Continue after the users recorded in the checkpoint",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(
+                getattr(settings, "RECOMMENDATION_MODEL_DIR", os.path.join(settings.BASE_DIR, "recommendation_models")),
+                "generate_recommendations_checkpoint.json",
+            ),
+            help="Checkpoint file (last finished user id per algorithm)",
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive")
+
+        self.checkpoint_path = options["checkpoint"]
+        checkpoint = self.read_checkpoint() if options["resume"] else {}
+
+        for algorithm in options["algorithm"] or ALGORITHMS:
+            if algorithm == "collaborative_user" and load_npz_model(
+                CustomUserBasedFilter().model_path
+            ) is None:
+                self.stdout.write(self.style.WARNING(
+                    "Skipping collaborative_user: no user-neighbor store (run the user neighbors build first)"
+                ))
+                continue
+
+            user_ids = list(
+                get_user_model().objects.filter(
+                    id__gt=checkpoint.get(algorithm, 0)
+                ).order_by("id").values_list("id", flat=True)
+            )
+            chunks = [
+                user_ids[start:start + options["chunk_size"]]
+                for start in range(0, len(user_ids), options["chunk_size"])
+            ]
+            self.stdout.write(f"{algorithm}: {len(user_ids)} users in {len(chunks)} chunks")
+
+            totals = Counter()
+            for last_user_id, counts in self.run_chunks(
+                algorithm, chunks, options["limit"], options["workers"]
+            ):
+                totals.update(counts)
+                checkpoint[algorithm] = last_user_id
+                self.write_checkpoint(checkpoint)
+
+            self.stdout.write(self.style.SUCCESS(
+                f"{algorithm}: {totals['users']} users, {totals['written']} recommendations written, "
+                f"{totals['deleted']} stale removed"
+            ))
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def run_chunks(self, algorithm, chunks, limit, workers):
+        """Yield (last user id, counts) per chunk, in user id order"""
+        tasks = [(algorithm, chunk, limit) for chunk in chunks]
+        if workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _generate_chunk_task(task)
+            return
+
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(tasks)),
+            initializer=_init_worker,
+            initargs=(algorithm,),
+        ) as executor:
+            yield from executor.map(_generate_chunk_task, tasks)
+
+    def read_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as checkpoint_file:
+            return json.load(checkpoint_file)
+
+    def write_checkpoint(self, checkpoint):
+        """Write atomically so an interrupted run never leaves a partial file"""
+        directory = os.path.dirname(self.checkpoint_path) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        temporary_path = os.path.join(directory, f".generate_recommendations_{os.getpid()}.json")
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
@@ -0,0 +1,28 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFeatureVector',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('categorical_features', models.JSONField(default=dict)),
+                ('keywords', models.JSONField(default=list)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feature_vector', to='home.product')),
+            ],
+            options={
+                'verbose_name': 'Product Feature Vector',
+                'verbose_name_plural': 'Product Feature Vectors',
+                'db_table': 'method_product_feature_vector',
+            },
+        ),
+    ]
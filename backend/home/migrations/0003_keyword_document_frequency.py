@@ -0,0 +1,33 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0002_productfeaturevector'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeywordDocumentFrequency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100, unique=True)),
+                ('document_frequency', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Keyword Document Frequency',
+                'verbose_name_plural': 'Keyword Document Frequencies',
+                'db_table': 'method_keyword_document_frequency',
+            },
+        ),
+        migrations.RemoveField(
+            model_name='productfeaturevector',
+            name='keywords',
+        ),
+        migrations.AddField(
+            model_name='productfeaturevector',
+            name='term_counts',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,56 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0003_keyword_document_frequency'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductInteractionNorm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('squared_norm', models.FloatField(default=0.0)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='interaction_norm', to='home.product')),
+            ],
+            options={
+                'verbose_name': 'Product Interaction Norm',
+                'verbose_name_plural': 'Product Interaction Norms',
+                'db_table': 'method_product_interaction_norm',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductCooccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dot_product', models.FloatField(default=0.0)),
+                ('product1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurrence_from', to='home.product')),
+                ('product2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurrence_to', to='home.product')),
+            ],
+            options={
+                'verbose_name': 'Product Co-occurrence',
+                'verbose_name_plural': 'Product Co-occurrences',
+                'db_table': 'method_product_cooccurrence',
+                'unique_together': {('product1', 'product2')},
+            },
+        ),
+        migrations.CreateModel(
+            name='UserCooccurrenceState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantities', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='cooccurrence_state', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'User Co-occurrence State',
+                'verbose_name_plural': 'User Co-occurrence States',
+                'db_table': 'method_user_cooccurrence_state',
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0005_recommendationsettings_collaborative_als'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recommendationsettings',
+            name='active_algorithm',
+            field=models.CharField(choices=[('collaborative', 'Collaborative Filtering'), ('collaborative_als', 'Collaborative Filtering (Implicit ALS)'), ('collaborative_user', 'Collaborative Filtering (User Neighbors)'), ('content_based', 'Content Based'), ('fuzzy_logic', 'Fuzzy Logic')], default='collaborative', max_length=30),
+        ),
+    ]
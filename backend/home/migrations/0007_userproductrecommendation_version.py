@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0006_recommendationsettings_collaborative_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userproductrecommendation',
+            name='version',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0008_recommendationsettings_hybrid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CooccurrenceRebuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Co-occurrence Rebuild',
+                'verbose_name_plural': 'Co-occurrence Rebuilds',
+                'db_table': 'method_cooccurrence_rebuild',
+            },
+        ),
+    ]
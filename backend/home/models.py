@@ -331,11 +331,156 @@ class ProductSimilarity(models.Model):
         unique_together = ('product1', 'product2', 'similarity_type')
 
 
+class ProductFeatureVector(models.Model):
+    """
+    Persisted content-based feature store (one row per product).
+    
+    Holds the output of CustomContentBasedFilter feature extraction so that
+    similarity rebuilds and debug/explain endpoints do not re-tokenize
+    descriptions or walk categories/tags on every run.
+    
+    Fields:
+        product (1:1): Product the vector belongs to
+        categorical_features (JSON): {"category_*"/"tag_*"/"price_*": weight}
+        term_counts (JSON): {"term": count} of description terms; keyword
+            weights are derived from these with the corpus IDF at build time
+        content_hash (str): SHA-256 of the extraction inputs (description,
+            price, category and tag names); the vector is rebuilt only when
+            the hash of the current product differs
+        updated_at (datetime): Last extraction timestamp
+    """
+    
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='feature_vector')
+    categorical_features = models.JSONField(default=dict)
+    term_counts = models.JSONField(default=dict)
+    content_hash = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'method_product_feature_vector'
+        verbose_name = "Product Feature Vector"
+        verbose_name_plural = "Product Feature Vectors"
+
+
+class KeywordDocumentFrequency(models.Model):
+    """
+    Corpus document frequency of description terms (TF-IDF keyword model).
+    
+    Built in one streaming pass over all product descriptions and kept
+    current incrementally as products are added, edited or deleted.
+    
+    Fields:
+        term (str): Normalized description term
+        document_frequency (int): Number of products whose description contains the term
+    """
+    
+    term = models.CharField(max_length=100, unique=True)
+    document_frequency = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        db_table = 'method_keyword_document_frequency'
+        verbose_name = "Keyword Document Frequency"
+        verbose_name_plural = "Keyword Document Frequencies"
+
+
+class ProductInteractionNorm(models.Model):
+    """
+    Squared norm of a product's mean-centered purchase column (collaborative filtering).
+    
+    Accumulator of CustomCollaborativeFilter: Σ_u (R_u,i - R̄_u)², kept
+    current incrementally as orders are committed.
+    
+    Fields:
+        product (1:1): Product the norm belongs to
+        squared_norm (float): Σ_u (R_u,i - R̄_u)²
+    """
+    
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, related_name='interaction_norm')
+    squared_norm = models.FloatField(default=0.0)
+    
+    class Meta:
+        db_table = 'method_product_interaction_norm'
+        verbose_name = "Product Interaction Norm"
+        verbose_name_plural = "Product Interaction Norms"
+
+
+class ProductCooccurrence(models.Model):
+    """
+    Dot product of two products' mean-centered purchase columns.
+    
+    Accumulator of CustomCollaborativeFilter: Σ_u (R_u,i - R̄_u)(R_u,j - R̄_u)
+    over users who bought both products. Stored once per pair
+    (product1_id < product2_id); the adjusted cosine similarity is
+    dot_product / √(squared_norm_i × squared_norm_j).
+    
+    Fields:
+        product1 (FK): Product with the lower id
+        product2 (FK): Product with the higher id
+        dot_product (float): Accumulated co-purchase dot product
+    """
+    
+    product1 = models.ForeignKey(Product, related_name='cooccurrence_from', on_delete=models.CASCADE)
+    product2 = models.ForeignKey(Product, related_name='cooccurrence_to', on_delete=models.CASCADE)
+    dot_product = models.FloatField(default=0.0)
+    
+    class Meta:
+        db_table = 'method_product_cooccurrence'
+        unique_together = ('product1', 'product2')
+        verbose_name = "Product Co-occurrence"
+        verbose_name_plural = "Product Co-occurrences"
+
+
+class UserCooccurrenceState(models.Model):
+    """
+    Purchase totals of a user last folded into the co-occurrence accumulators.
+    
+    The next update diffs the user's current totals against this snapshot,
+    so applying the same orders twice is a no-op.
+    
+    Fields:
+        user (1:1): Buyer
+        quantities (JSON): {"product_id": total quantity purchased}
+        updated_at (datetime): Last fold timestamp
+    """
+    
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cooccurrence_state')
+    quantities = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'method_user_cooccurrence_state'
+        verbose_name = "User Co-occurrence State"
+        verbose_name_plural = "User Co-occurrence States"
+
+
+class CooccurrenceRebuild(models.Model):
+    """
+    Marker of a running co-occurrence rebuild.
+    
+    Written (and committed) before CustomCollaborativeFilter.rebuild_cooccurrence
+    deletes the buyer snapshots, and deleted in the transaction that writes
+    them back; incremental folds skip while it exists. Kept in the database,
+    not the cache, so it cannot be evicted in the middle of a rebuild.
+    
+    Fields:
+        started_at (datetime): Start of the rebuild
+    """
+    
+    started_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'method_cooccurrence_rebuild'
+        verbose_name = "Co-occurrence Rebuild"
+        verbose_name_plural = "Co-occurrence Rebuilds"
+
+
 class UserProductRecommendation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     recommendation_type = models.CharField(max_length=20, choices=ProductSimilarity.SIMILARITY_TYPES)
     score = models.DecimalField(max_digits=5, decimal_places=3)
+    # Digest of the user's inputs + time the set was computed (recommendation_version)
+    version = models.CharField(max_length=32, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -347,8 +492,11 @@ class UserProductRecommendation(models.Model):
 class RecommendationSettings(models.Model):
     ALGORITHM_CHOICES = [
         ('collaborative', 'Collaborative Filtering'),
+        ('collaborative_als', 'Collaborative Filtering (Implicit ALS)'),
+        ('collaborative_user', 'Collaborative Filtering (User Neighbors)'),
         ('content_based', 'Content Based'),
         ('fuzzy_logic', 'Fuzzy Logic'),
+        ('hybrid', 'Hybrid (Blended)'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
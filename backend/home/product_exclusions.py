@@ -0,0 +1,177 @@
+"""
+Per-User Exclusion Bitsets for Recommendation Filtering.
+
+Recommendations must not contain products the user already bought or has
+in the cart. Instead of querying orders and carts (or building Python sets)
+in every builder and serving path, the owned products of a user are kept
+as one bitset over product ids:
+
+    bit p of byte p // 8 (most significant bit first) = product p is owned
+
+The bitset only grows to the highest owned product id (trailing empty bytes
+are trimmed), so a user costs max_owned_id / 8 bytes. It lives in the
+shared cache, built with two queries on first use. The OrderProduct /
+CartItem signals never modify a cached bitset in place (two concurrent
+orders of one user would lose an update in a read-modify-write); they
+invalidate it and the next read rebuilds it from the tables.
+
+The cache key carries a per-user generation token that every invalidation
+replaces. A reader that queried the tables before a concurrent order
+committed stores its bitset under the old generation, where no later read
+looks, so a stale rebuild can never overwrite a newer one.
+
+Filtering a candidate array is one vectorized bit test (ProductBitset.mask).
+"""
+
+import uuid
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _generation_cache_key(user_id):
+    return f"user_excluded_products_generation_{user_id}"
+
+
+def _cache_key(user_id, generation):
+    return f"user_excluded_products_{user_id}_{generation}"
+
+
+def _generation(user_id):
+    """Current generation token of a user's bitset (created on first use)"""
+    key = _generation_cache_key(user_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+class ProductBitset:
+    """
+    Set of product ids as a packed bit array.
+
+    Attributes:
+        bits (np.ndarray): uint8 bytes, bit p set = product p in the set
+    """
+
+    def __init__(self, bits=None):
+        self.bits = np.zeros(0, dtype=np.uint8) if bits is None else np.array(bits, dtype=np.uint8)
+
+    @classmethod
+    def from_ids(cls, product_ids):
+        bitset = cls()
+        bitset.add(product_ids)
+        return bitset
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(np.frombuffer(data, dtype=np.uint8))
+
+    def to_bytes(self):
+        return self.bits.tobytes()
+
+    def add(self, product_ids):
+        """Set the bits of product ids (the array grows as needed)"""
+        product_ids = np.asarray(list(product_ids), dtype=np.int64)
+        product_ids = product_ids[product_ids >= 0]
+        if not len(product_ids):
+            return self
+
+        size = int(product_ids.max()) // 8 + 1
+        if size > len(self.bits):
+            self.bits = np.concatenate([self.bits, np.zeros(size - len(self.bits), dtype=np.uint8)])
+        np.bitwise_or.at(
+            self.bits, product_ids >> 3, (np.uint8(0x80) >> (product_ids & 7)).astype(np.uint8)
+        )
+        return self
+
+    def union(self, other):
+        """New bitset with the products of both"""
+        size = max(len(self.bits), len(other.bits))
+        bits = np.zeros(size, dtype=np.uint8)
+        bits[:len(self.bits)] |= self.bits
+        bits[:len(other.bits)] |= other.bits
+        return ProductBitset(bits)
+
+    def contains(self, product_ids):
+        """
+        Membership of every candidate, in one array operation.
+
+        Args:
+            product_ids (array-like): Candidate product ids
+
+        Returns:
+            np.ndarray: bool per candidate, True = in the set
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        inside = (product_ids >= 0) & (product_ids < len(self.bits) * 8)
+        clipped = np.where(inside, product_ids, 0)
+        if not len(self.bits):
+            return np.zeros(product_ids.shape, dtype=bool)
+        return inside & ((self.bits[clipped >> 3] >> (7 - (clipped & 7))) & 1).astype(bool)
+
+    def mask(self, product_ids):
+        """Keep-mask of the candidates: True = not in the set"""
+        return ~self.contains(product_ids)
+
+    def filter_scores(self, scores):
+        """{product_id: score} without the products of the set"""
+        if not scores or not len(self.bits):
+            return scores
+        product_ids = np.fromiter(scores.keys(), dtype=np.int64, count=len(scores))
+        return {
+            product_id: scores[product_id]
+            for product_id in product_ids[self.mask(product_ids)].tolist()
+        }
+
+    def filter_ranked(self, ranked):
+        """[(product_id, score), ...] without the products of the set, order kept"""
+        if not ranked or not len(self.bits):
+            return ranked
+        keep = self.mask([product_id for product_id, _ in ranked])
+        return [item for item, kept in zip(ranked, keep) if kept]
+
+    def __len__(self):
+        return int(np.unpackbits(self.bits).sum())
+
+    def __contains__(self, product_id):
+        return bool(self.contains([product_id])[0])
+
+
+def _owned_product_ids(user_id):
+    from home.models import CartItem, OrderProduct
+
+    return list(
+        OrderProduct.objects.filter(order__user_id=user_id).values_list("product_id", flat=True).distinct()
+    ) + list(CartItem.objects.filter(user_id=user_id).values_list("product_id", flat=True))
+
+
+def _store(user_id, generation, bitset):
+    cache.set(
+        _cache_key(user_id, generation),
+        np.trim_zeros(bitset.bits, "b").tobytes(),
+        timeout=getattr(settings, "CACHE_TIMEOUT_LONG", 7200),
+    )
+
+
+def get_user_exclusions(user_id):
+    """
+    Products a user bought or has in the cart, as a ProductBitset.
+
+    Two cache reads; built from the order lines and the cart on a miss.
+    """
+    generation = _generation(user_id)
+    data = cache.get(_cache_key(user_id, generation))
+    if data is not None:
+        return ProductBitset.from_bytes(data)
+
+    bitset = ProductBitset.from_ids(_owned_product_ids(user_id))
+    _store(user_id, generation, bitset)
+    return bitset
+
+
+def invalidate_user_exclusions(user_id):
+    """Start a new generation of a user's bitset; rebuilt from the tables on next use"""
+    cache.set(_generation_cache_key(user_id), uuid.uuid4().hex, timeout=None)
@@ -0,0 +1,231 @@
+"""
+Two-Stage Recommendation Serving Pipeline.
+
+Scoring every product of the catalog with the fuzzy inference engine makes
+a request cost proportional to the catalog. The pipeline bounds it:
+
+Stage 1 - Candidate generation (cheap, in-memory indexes):
+    - collaborative / content_based neighbors of the user's products
+      (ProductNeighborIndex)
+    - association rules of the user's products (AssociationRuleIndex)
+    - most ordered products (process-local popularity list)
+    At most RECOMMENDATION_CANDIDATES products; personalized candidates
+    first (by the sum of their max-normalized source scores), the rest
+    filled with popular products (guests and new users: popularity only).
+    Products the user bought or has in the cart are masked out of both
+    (per-user exclusion bitset).
+
+Stage 2 - Ranking (heavier models, candidates only):
+    - fuzzy: SimpleFuzzyInference score of the product for the user profile
+    - purchase_probability: Naive Bayes probability stored in PurchaseProbability
+    - sentiment: ProductSentimentSummary average score mapped to [0, 1]
+    score = Σ_m w_m × s_m / Σ_m w_m   (RECOMMENDATION_RANKING_WEIGHTS;
+    models without data for a product count as neutral 0.5)
+
+Latency depends on RECOMMENDATION_CANDIDATES, not on the catalog size.
+"""
+
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Avg, Count
+
+from home.models import Product, ProductSentimentSummary, PurchaseProbability
+from home.product_exclusions import ProductBitset, get_user_exclusions
+from home.recommendation_serving import get_neighbor_index, user_source_products
+
+
+DEFAULT_RANKING_WEIGHTS = {
+    "fuzzy": 0.6,
+    "purchase_probability": 0.25,
+    "sentiment": 0.15,
+}
+
+RANKING_FIELDS = {
+    "fuzzy": "fuzzy_score",
+    "purchase_probability": "purchase_probability",
+    "sentiment": "sentiment",
+}
+
+
+def get_popular_products(limit):
+    """
+    Most ordered products (ties by id), cached in the process.
+
+    The aggregate over OrderProduct runs at most once per CACHE_TIMEOUT_SHORT
+    seconds per process.
+    """
+    cached = _popular_products.get("products")
+    max_age = getattr(settings, "CACHE_TIMEOUT_SHORT", 300)
+    if cached is None or cached[1] < limit or time.monotonic() - cached[0] > max_age:
+        product_ids = list(
+            Product.objects.annotate(order_count=Count("orderproduct"))
+            .order_by("-order_count", "id")
+            .values_list("id", flat=True)[:limit]
+        )
+        cached = (time.monotonic(), limit, product_ids)
+        _popular_products["products"] = cached
+    return cached[2][:limit]
+
+
+class CandidateRankingPipeline:
+    """
+    Bounded candidate generation followed by model ranking.
+
+    Attributes:
+        candidate_limit (int): Candidates scored per request (RECOMMENDATION_CANDIDATES)
+        popular_share (float): Share of the candidates reserved for popular products
+        ranking_weights (dict): Weight per ranking model (RECOMMENDATION_RANKING_WEIGHTS)
+        candidate_count (int): Candidates of the last call
+    """
+
+    def __init__(self):
+        self.candidate_limit = getattr(settings, "RECOMMENDATION_CANDIDATES", 300)
+        self.popular_share = 0.2
+        self.ranking_weights = getattr(settings, "RECOMMENDATION_RANKING_WEIGHTS", DEFAULT_RANKING_WEIGHTS)
+        self.candidate_count = 0
+
+    def generate_candidates(self, user=None):
+        """
+        Stage 1: bounded candidate product ids, best retrieval score first.
+
+        Args:
+            user (User|None): Authenticated user (None = guest, popularity only)
+
+        Returns:
+            list: Product ids (at most candidate_limit)
+        """
+        candidates = []
+        exclusions = ProductBitset()
+        if user is not None and user.is_authenticated:
+            exclusions = get_user_exclusions(user.id)
+            products, _ = user_source_products(
+                user.id, getattr(settings, "RECOMMENDATION_ON_READ_MAX_SOURCES", 200)
+            )
+            retrieval = {}
+            for source, per_product in (("collaborative", 5), ("content_based", 5), ("association", 20)):
+                scores = get_neighbor_index(source).aggregate(products, per_product=per_product)
+                peak = max(scores.values(), default=0.0)
+                if peak <= 0:
+                    continue
+                for product_id, score in scores.items():
+                    retrieval[product_id] = retrieval.get(product_id, 0.0) + score / peak
+
+            personalized_limit = self.candidate_limit - int(self.candidate_limit * self.popular_share)
+            retrieval = exclusions.filter_scores(retrieval)
+            ranked = sorted(retrieval.items(), key=lambda item: (-item[1], item[0]))
+            candidates = [product_id for product_id, _ in ranked[:personalized_limit]]
+
+        seen = set(candidates)
+        popular = np.asarray(get_popular_products(self.candidate_limit + len(exclusions)), dtype=np.int64)
+        for product_id in popular[exclusions.mask(popular)].tolist():
+            if len(candidates) >= self.candidate_limit:
+                break
+            if product_id not in seen:
+                candidates.append(product_id)
+                seen.add(product_id)
+
+        self.candidate_count = len(candidates)
+        return candidates
+
+    def _purchase_probabilities(self, user, product_ids):
+        if user is None or not user.is_authenticated:
+            return {}
+        return {
+            product_id: float(probability)
+            for product_id, probability in PurchaseProbability.objects.filter(
+                user=user, product_id__in=product_ids
+            ).values_list("product_id", "probability")
+        }
+
+    def _sentiments(self, product_ids):
+        """Average sentiment in [-1, 1] mapped to [0, 1]"""
+        return {
+            product_id: min(1.0, max(0.0, (float(score) + 1.0) / 2.0))
+            for product_id, score in ProductSentimentSummary.objects.filter(
+                product_id__in=product_ids
+            ).values_list("product_id", "average_sentiment_score")
+        }
+
+    def rank(self, product_ids, user_profile, user=None, debug=False):
+        """
+        Stage 2: score the candidates with the ranking models.
+
+        Args:
+            product_ids (list): Candidates from generate_candidates()
+            user_profile (FuzzyUserProfile): Profile of the user or guest
+            user (User|None): User for the purchase probabilities
+            debug (bool): Keep the fuzzy rule activations
+
+        Returns:
+            list: [{"product", "score", "fuzzy_score", "category_match",
+                    "purchase_probability", "sentiment", "rule_activations"}, ...] best first
+        """
+        from home.fuzzy_logic_engine import FuzzyMembershipFunctions, SimpleFuzzyInference
+
+        products = list(
+            Product.objects.filter(id__in=product_ids)
+            .annotate(
+                review_count=Count("opinion"),
+                avg_rating=Avg("opinion__rating"),
+                order_count=Count("orderproduct", distinct=True),
+            )
+            .prefetch_related("categories")
+            .order_by("id")
+        )
+        if not products:
+            return []
+
+        fuzzy_engine = SimpleFuzzyInference(FuzzyMembershipFunctions(), user_profile)
+        ids = [product.id for product in products]
+        purchase_probabilities = self._purchase_probabilities(user, ids)
+        sentiments = self._sentiments(ids)
+
+        items = []
+        for product in products:
+            category_match = max(
+                [user_profile.fuzzy_category_match(category.name) for category in product.categories.all()]
+                or [0.0]
+            )
+            product_data = {
+                "price": float(product.price),
+                "rating": float(product.avg_rating) if product.avg_rating else 3.0,
+                "view_count": product.order_count,
+            }
+            fuzzy_result = fuzzy_engine.evaluate_product(product_data, category_match)
+            items.append(
+                {
+                    "product": product,
+                    "fuzzy_score": fuzzy_result["fuzzy_score"],
+                    "category_match": fuzzy_result["category_match"],
+                    "purchase_probability": purchase_probabilities.get(product.id),
+                    "sentiment": sentiments.get(product.id),
+                    "rule_activations": fuzzy_result["rule_activations"] if debug else None,
+                }
+            )
+
+        models = [model for model, weight in self.ranking_weights.items() if weight > 0]
+        if user is None or not user.is_authenticated:
+            models = [model for model in models if model != "purchase_probability"]
+        model_scores = np.array(
+            [
+                [0.5 if item[RANKING_FIELDS[model]] is None else item[RANKING_FIELDS[model]] for item in items]
+                for model in models
+            ],
+            dtype=np.float64,
+        ).reshape(len(models), len(items))
+        weights = np.array([self.ranking_weights[model] for model in models], dtype=np.float64)
+        scores = weights.dot(model_scores) / weights.sum() if len(models) else np.zeros(len(items))
+
+        for item, score in zip(items, scores):
+            item["score"] = round(float(score), 3)
+        items.sort(key=lambda item: (-item["score"], item["product"].id))
+        return items
+
+    def recommend(self, user_profile, user=None, n=10, debug=False):
+        """Both stages; the top-n ranked items"""
+        return self.rank(self.generate_candidates(user), user_profile, user, debug)[:n]
+
+
+_popular_products = {}
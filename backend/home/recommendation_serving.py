@@ -0,0 +1,796 @@
+"""
+Process-Local Product Neighbor Index for Recommendation Generation.
+
+Turning a user's products into recommendations needs the top neighbors of
+every product the user interacted with. Reading them from ProductSimilarity
+costs one query per product; this module keeps the whole similarity graph
+of each similarity type in compact arrays instead:
+
+    product_ids      int32[n]       sorted source products
+    neighbor_indptr  int64[n + 1]   CSR row pointers
+    neighbor_ids     int32[nnz]     neighbors, best first
+    neighbor_scores  float32[nnz]   similarity scores (3 decimals, as stored)
+
+An index is built with one streaming query and reused by every request of
+the process. Each similarity type has a version token in the shared cache;
+writers bump it once per finished rebuild or incremental update, and
+readers reload their index when the token differs from the one it was
+built at - at most once per NEIGHBOR_INDEX_MIN_RELOAD_SECONDS, so a burst
+of orders or product edits does not make every process reload the graph
+after each one.
+
+Key Operations:
+    1. get_neighbor_index(type): Version check + lazy (re)load
+    2. ProductNeighborIndex.aggregate(): Σ of the top-N neighbor scores of a
+       set of products, vectorized (no per-product queries)
+    3. ProductNeighborIndex.aggregate_many(): The same for a batch of users
+       as one sparse product (users × products) · (products × neighbors)
+    4. bump_neighbor_index_version(type): Invalidate indexes in all processes
+    5. Association rules are served the same way (AssociationRuleIndex,
+       similarity type 'association', scored by confidence)
+    6. read_through_recommendations(): Stored recommendations of a user if
+       their inputs are unchanged, otherwise recomputed on the request from
+       the in-memory index and written back on a bounded worker pool
+    7. diversify_recommendations(): Maximal marginal relevance re-ranking on
+       the content feature vectors of the candidates (ProductVectorIndex)
+    8. Computed recommendations never contain products the user bought or
+       has in the cart (per-user exclusion bitset, home.product_exclusions)
+    9. record_index_changes() / read_index_changes(): Shared log of the
+       products whose indexed data changed, so process-local indexes (the
+       fuzzy search trigram index) patch those products instead of rebuilding
+
+Stored UserProductRecommendation rows carry a version made of a digest of
+the user's inputs (source products and the version of the similarity
+index / neighbor store they were scored on) and the time it was computed.
+An order, a cart change or a similarity update makes sets stale without
+deleting anything, and only users who come back pay for the recompute.
+When that recompute would first have to load the graph into the process,
+the stored set is served and the load and recompute run in the background.
+"""
+
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from scipy import sparse
+
+from home.models import ProductAssociation, ProductSimilarity
+from home.product_exclusions import get_user_exclusions
+
+
+def _version_cache_key(similarity_type):
+    return f"product_neighbor_index_version_{similarity_type}"
+
+
+def bump_neighbor_index_version(similarity_type):
+    """Mark the neighbor index of a similarity type stale in every process"""
+    cache.set(_version_cache_key(similarity_type), uuid.uuid4().hex, timeout=None)
+
+
+def current_neighbor_index_version(similarity_type):
+    """Version token of a similarity type (created on first use)"""
+    key = _version_cache_key(similarity_type)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _change_log_head_key(index_name):
+    return f"index_change_log_head_{index_name}"
+
+
+def _change_log_entry_key(index_name, epoch, position):
+    return f"index_change_log_{index_name}_{epoch}_{position}"
+
+
+def index_change_log_head(index_name):
+    """(epoch, position) of the newest entry of an index's change log (created on first use)"""
+    key = _change_log_head_key(index_name)
+    head = cache.get(key)
+    if head is None:
+        cache.add(key, (uuid.uuid4().hex, 0), timeout=None)
+        head = cache.get(key)
+    return head
+
+
+def record_index_changes(index_name, product_ids):
+    """
+    Append the products whose indexed data changed to an index's shared change log.
+
+    Entries are numbered; every writer claims the next free number with
+    cache.add, so concurrent writers never overwrite each other.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+
+    epoch, position = index_change_log_head(index_name)
+    position += 1
+    while not cache.add(
+        _change_log_entry_key(index_name, epoch, position),
+        product_ids,
+        timeout=getattr(settings, "CACHE_TIMEOUT_LONG", 7200),
+    ):
+        position += 1
+    cache.set(_change_log_head_key(index_name), (epoch, position), timeout=None)
+
+
+def read_index_changes(index_name, epoch, position, batch_size=100):
+    """
+    Products changed since a process-local index was built or last patched.
+
+    Args:
+        index_name (str): Change log name
+        epoch (str), position (int): Log head the index is current at
+
+    Returns:
+        tuple|None: (new position, set of product ids); None when the log
+            cannot be replayed from there (entries expired or evicted, log
+            recreated) and the index must be rebuilt
+    """
+    changed = set()
+    while True:
+        keys = [
+            _change_log_entry_key(index_name, epoch, entry)
+            for entry in range(position + 1, position + 1 + batch_size)
+        ]
+        found = cache.get_many([_change_log_head_key(index_name)] + keys)
+        head = found.get(_change_log_head_key(index_name))
+        if head is None or head[0] != epoch:
+            return None
+
+        for key in keys:
+            if key not in found:
+                # The head is past a missing entry: changes were lost
+                return (position, changed) if head[1] <= position else None
+            changed.update(found[key])
+            position += 1
+
+
+class ProductNeighborIndex:
+    """
+    Top-K neighbors of every product of one similarity type, as CSR arrays.
+
+    Attributes:
+        similarity_type (str): 'collaborative' or 'content_based'
+        version (str): Version token the index was loaded at
+        loaded_at (float): time.monotonic() of the load
+    """
+
+    def __init__(self, similarity_type, version=None):
+        self.similarity_type = similarity_type
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.product_ids = np.empty(0, dtype=np.int32)
+        self.neighbor_indptr = np.zeros(1, dtype=np.int64)
+        self.neighbor_ids = np.empty(0, dtype=np.int32)
+        self.neighbor_scores = np.empty(0, dtype=np.float32)
+        self._neighbor_matrices = {}
+
+    def _edges(self):
+        """(source, neighbor, score) rows ordered by source, best neighbor first"""
+        return ProductSimilarity.objects.filter(
+            similarity_type=self.similarity_type
+        ).order_by("product1_id", "-similarity_score", "product2_id").values_list(
+            "product1_id", "product2_id", "similarity_score"
+        )
+
+    def load(self, chunk_size=10000):
+        """
+        Read the similarity graph with one streaming query.
+
+        Returns:
+            ProductNeighborIndex: self
+        """
+        sources, neighbors, scores = [], [], []
+        for product1_id, product2_id, score in self._edges().iterator(chunk_size=chunk_size):
+            sources.append(product1_id)
+            neighbors.append(product2_id)
+            scores.append(float(score))
+
+        sources = np.asarray(sources, dtype=np.int32)
+        self.product_ids, row_lengths = np.unique(sources, return_counts=True)
+        self.product_ids = self.product_ids.astype(np.int32)
+        self.neighbor_indptr = np.r_[0, np.cumsum(row_lengths)].astype(np.int64)
+        self.neighbor_ids = np.asarray(neighbors, dtype=np.int32)
+        self.neighbor_scores = np.asarray(scores, dtype=np.float32)
+        return self
+
+    def __len__(self):
+        return len(self.neighbor_ids)
+
+    def _rows(self, product_ids):
+        """Row positions of the given products that have neighbors"""
+        product_ids = np.unique(np.asarray(list(product_ids), dtype=np.int64))
+        positions = np.searchsorted(self.product_ids, product_ids)
+        found = positions < len(self.product_ids)
+        found[found] = self.product_ids[positions[found]] == product_ids[found]
+        return positions[found]
+
+    def neighbors(self, product_id, limit=None):
+        """
+        Neighbors of one product, best first.
+
+        Returns:
+            list: [(neighbor_id, score), ...]
+        """
+        rows = self._rows([product_id])
+        if not len(rows):
+            return []
+
+        start, stop = self.neighbor_indptr[rows[0]], self.neighbor_indptr[rows[0] + 1]
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return [
+            (int(neighbor_id), round(float(score), 3))
+            for neighbor_id, score in zip(self.neighbor_ids[start:stop], self.neighbor_scores[start:stop])
+        ]
+
+    def aggregate(self, product_ids, per_product=5):
+        """
+        Sum the top neighbor scores of a set of products.
+
+        Formula: score(p) = Σ_q∈products sim(q, p) over the per_product best neighbors of q
+
+        Args:
+            product_ids (iterable): Products the user interacted with (duplicates ignored)
+            per_product (int): Neighbors taken from each product
+
+        Returns:
+            dict: {neighbor_id: accumulated score}
+        """
+        rows = self._rows(product_ids)
+        if not len(rows):
+            return {}
+
+        starts = self.neighbor_indptr[rows]
+        lengths = np.minimum(self.neighbor_indptr[rows + 1] - starts, per_product)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        positions = np.repeat(starts, lengths) + offsets
+
+        neighbor_ids, inverse = np.unique(self.neighbor_ids[positions], return_inverse=True)
+        totals = np.bincount(
+            inverse, weights=np.round(self.neighbor_scores[positions].astype(np.float64), 3)
+        )
+        return dict(zip(neighbor_ids.tolist(), totals.tolist()))
+
+    def _neighbor_matrix(self, per_product):
+        """
+        Products × neighbors matrix of the per_product best neighbors of every row.
+
+        Returns:
+            tuple: (csr_matrix, neighbor ids of the columns)
+        """
+        if per_product not in self._neighbor_matrices:
+            starts = self.neighbor_indptr[:-1]
+            lengths = np.minimum(np.diff(self.neighbor_indptr), per_product)
+            offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            positions = np.repeat(starts, lengths) + offsets
+
+            column_ids, columns = np.unique(self.neighbor_ids[positions], return_inverse=True)
+            matrix = sparse.csr_matrix(
+                (
+                    np.round(self.neighbor_scores[positions].astype(np.float64), 3),
+                    columns,
+                    np.r_[0, np.cumsum(lengths)],
+                ),
+                shape=(len(self.product_ids), len(column_ids)),
+            )
+            self._neighbor_matrices[per_product] = (matrix, column_ids)
+        return self._neighbor_matrices[per_product]
+
+    def aggregate_many(self, product_id_sets, per_product=5):
+        """
+        aggregate() for a batch of users in one sparse matrix product.
+
+        Args:
+            product_id_sets (list): One iterable of interacted products per user
+            per_product (int): Neighbors taken from each product
+
+        Returns:
+            list: {neighbor_id: accumulated score} per input, in input order
+        """
+        matrix, column_ids = self._neighbor_matrix(per_product)
+
+        user_rows, product_rows = [], []
+        for position, product_ids in enumerate(product_id_sets):
+            rows = self._rows(product_ids)
+            user_rows.append(np.full(len(rows), position, dtype=np.int64))
+            product_rows.append(rows)
+
+        interactions = sparse.csr_matrix(
+            (
+                np.ones(sum(len(rows) for rows in product_rows)),
+                (
+                    np.concatenate(user_rows) if user_rows else np.empty(0, dtype=np.int64),
+                    np.concatenate(product_rows) if product_rows else np.empty(0, dtype=np.int64),
+                ),
+            ),
+            shape=(len(user_rows), len(self.product_ids)),
+        )
+        scores = interactions.dot(matrix).tocsr()
+        scores.sort_indices()
+
+        return [
+            dict(zip(
+                column_ids[scores.indices[scores.indptr[row]:scores.indptr[row + 1]]].tolist(),
+                scores.data[scores.indptr[row]:scores.indptr[row + 1]].tolist(),
+            ))
+            for row in range(len(user_rows))
+        ]
+
+
+class AssociationRuleIndex(ProductNeighborIndex):
+    """
+    Association rules product_1 → product_2 as neighbor lists scored by confidence.
+
+    Served as similarity type 'association'; the rule writers bump its
+    version after replacing ProductAssociation.
+    """
+
+    def _edges(self):
+        return ProductAssociation.objects.order_by(
+            "product_1_id", "-confidence", "product_2_id"
+        ).values_list("product_1_id", "product_2_id", "confidence")
+
+
+def _needs_reload(index, version):
+    """Missing, or stale and loaded more than NEIGHBOR_INDEX_MIN_RELOAD_SECONDS ago"""
+    if index is None:
+        return True
+    if index.version == version:
+        return False
+    return time.monotonic() - index.loaded_at >= getattr(settings, "NEIGHBOR_INDEX_MIN_RELOAD_SECONDS", 30)
+
+
+def get_neighbor_index(similarity_type):
+    """
+    Process-local neighbor index of a similarity type, reloaded when stale.
+
+    Costs one cache read when the index is current. A stale index is kept
+    until it is NEIGHBOR_INDEX_MIN_RELOAD_SECONDS old.
+    """
+    version = current_neighbor_index_version(similarity_type)
+    index = _neighbor_indexes.get(similarity_type)
+    if _needs_reload(index, version):
+        index_class = AssociationRuleIndex if similarity_type == "association" else ProductNeighborIndex
+        index = index_class(similarity_type, version).load()
+        _neighbor_indexes[similarity_type] = index
+    return index
+
+
+def recommendation_data_loaded(algorithm):
+    """
+    True if computing recommendations of algorithm needs no load in this process.
+
+    The similarity index is loaded when get_neighbor_index() would not
+    reload it; the collaborative_user neighbor store when its file is
+    cached (or missing).
+    """
+    from home.custom_recommendation_engine import CustomUserBasedFilter, npz_model_loaded
+
+    if algorithm == "collaborative_user":
+        return npz_model_loaded(CustomUserBasedFilter().model_path)
+    return not _needs_reload(_neighbor_indexes.get(algorithm), current_neighbor_index_version(algorithm))
+
+
+def _inputs_digest(user_id, algorithm, index_version=None):
+    """24 hex digits over the user's source products and the neighbor index / store version"""
+    products, _ = user_source_products(user_id, getattr(settings, "RECOMMENDATION_ON_READ_MAX_SOURCES", 200))
+    digest = hashlib.md5(algorithm.encode())
+    digest.update((index_version or current_neighbor_index_version(algorithm)).encode())
+    digest.update(np.asarray(products, dtype=np.int64).tobytes())
+    return digest.hexdigest()[:24]
+
+
+def recommendation_version(user_id, algorithm, index_version=None):
+    """
+    Version token of a user's recommendations of an algorithm, computed now.
+
+    A digest of the user's inputs - the source products (cart, then the
+    newest RECOMMENDATION_ON_READ_MAX_SOURCES order lines) and the version
+    of the similarity index (collaborative, content_based) or neighbor
+    store (collaborative_user) - followed by the time it was taken (8 hex
+    digits).
+
+    Args:
+        user_id (int): User
+        algorithm (str): Recommendation type
+        index_version (str|None): Version of the index the scores come from
+            (None = the current one); an index a process has not reloaded
+            yet gives a token that is already stale
+    """
+    return f"{_inputs_digest(user_id, algorithm, index_version)}{int(time.time()):08x}"
+
+
+def recommendation_is_fresh(version, user_id, algorithm):
+    """
+    True if stored recommendations stamped with version are still valid.
+
+    A set goes stale when the user's orders or cart change, when the
+    similarity index or neighbor store of its algorithm is rebuilt or
+    updated (bump_neighbor_index_version), or when it is older than
+    RECOMMENDATION_MAX_AGE seconds.
+    """
+    if len(version) != 32:
+        return False
+    try:
+        age = time.time() - int(version[24:], 16)
+    except ValueError:
+        return False
+    if age > getattr(settings, "RECOMMENDATION_MAX_AGE", 7200):
+        return False
+    return version[:24] == _inputs_digest(user_id, algorithm)
+
+
+def user_source_products(user_id, limit=None):
+    """
+    Products a user's recommendations are computed from: cart, then orders newest first.
+
+    Args:
+        user_id (int): User
+        limit (int|None): Maximum order lines read (None = all)
+
+    Returns:
+        tuple: (product ids, complete) - complete is False when limit cut the orders
+    """
+    from home.models import CartItem, OrderProduct
+
+    products = list(CartItem.objects.filter(user_id=user_id).values_list("product_id", flat=True))
+    ordered = OrderProduct.objects.filter(order__user_id=user_id).order_by(
+        "-order__date_order", "-id"
+    ).values_list("product_id", flat=True)
+    if limit is None:
+        return products + list(ordered), True
+
+    ordered = list(ordered[:limit + 1])
+    return products + ordered[:limit], len(ordered) <= limit
+
+
+def compute_user_recommendations(user_id, algorithm, max_source_products=None):
+    """
+    Compute a user's recommendations from the in-memory index / neighbor store.
+
+    Args:
+        user_id (int): User
+        algorithm (str): 'collaborative', 'content_based' or 'collaborative_user'
+        max_source_products (int|None): Bound on the order lines aggregated
+
+    Returns:
+        tuple: ({product_id: score}, version, complete) - owned products excluded;
+            version is recommendation_version() of the index used, read
+            before the sources
+    """
+    from home.custom_recommendation_engine import CustomUserBasedFilter
+
+    if algorithm == "collaborative_user":
+        version = recommendation_version(user_id, algorithm)
+        exclusions = get_user_exclusions(user_id)
+        # Bounded by USER_NEIGHBORS_TOP_K neighbors, whatever the history
+        scores = dict(CustomUserBasedFilter().recommend(user_id, n=50))
+        return exclusions.filter_scores(scores), version, True
+
+    index = get_neighbor_index(algorithm)
+    version = recommendation_version(user_id, algorithm, index.version)
+    exclusions = get_user_exclusions(user_id)
+    products, complete = user_source_products(user_id, max_source_products)
+    return exclusions.filter_scores(index.aggregate(products, per_product=5)), version, complete
+
+
+def _run_background_task(function, args):
+    try:
+        function(*args)
+    except Exception as e:
+        print(f"Error in background recommendation task {getattr(function, '__name__', function)}: {e}")
+    finally:
+        # Worker threads keep their own connection otherwise, one per thread forever
+        connections.close_all()
+
+
+def submit_background_task(key, function, *args):
+    """
+    Run function(*args) on the process-wide recommendation worker pool.
+
+    The pool has RECOMMENDATION_BACKGROUND_WORKERS threads and accepts at
+    most RECOMMENDATION_BACKGROUND_MAX_PENDING unfinished tasks; a task
+    whose key is still queued or running is not submitted again. Each task
+    closes its database connections when it ends.
+
+    Args:
+        key (str): Deduplication key of the task
+        function (callable): Work to run
+
+    Returns:
+        bool: True if the task was submitted
+    """
+    global _background_executor
+
+    with _background_lock:
+        for finished_key in [k for k, future in _background_tasks.items() if future.done()]:
+            del _background_tasks[finished_key]
+
+        if key in _background_tasks:
+            return False
+        if len(_background_tasks) >= getattr(settings, "RECOMMENDATION_BACKGROUND_MAX_PENDING", 100):
+            return False
+
+        if _background_executor is None:
+            _background_executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "RECOMMENDATION_BACKGROUND_WORKERS", 2),
+                thread_name_prefix="recommendation-background",
+            )
+        _background_tasks[key] = _background_executor.submit(_run_background_task, function, args)
+    return True
+
+
+def _write_back(user_id, algorithm, scores, version):
+    from home.custom_recommendation_engine import replace_user_recommendations
+
+    if scores is None:
+        scores, version, _ = compute_user_recommendations(user_id, algorithm)
+    replace_user_recommendations(user_id, algorithm, scores, version)
+
+
+def schedule_recommendation_write_back(user_id, algorithm, scores=None, version=""):
+    """
+    Store a user's recommendations on the background worker pool.
+
+    At most one write-back per user and algorithm is queued or running in
+    the process, and the pool bounds them all (submit_background_task).
+
+    Args:
+        user_id (int): User
+        algorithm (str): Recommendation type
+        scores (dict|None): Scores to store (None = recompute from all sources)
+        version (str): Version token of scores
+
+    Returns:
+        bool: True if a write-back was queued
+    """
+    return submit_background_task(
+        f"user_recommendations_write_back_{user_id}_{algorithm}",
+        _write_back, user_id, algorithm, scores, version,
+    )
+
+
+def read_through_recommendations(user_id, algorithm, n=12):
+    """
+    Top-n recommended products of a user, recomputed on read when stale.
+
+    Fresh stored rows (recommendation_is_fresh) cost three queries. Stale (or missing) ones are replaced
+    by a bounded compute on the in-memory index - at most
+    RECOMMENDATION_ON_READ_MAX_SOURCES order lines are aggregated - whose
+    result is written back asynchronously; when the bound cut the history,
+    the write-back recomputes from all of it instead.
+
+    Loading the graph after a version bump takes one full read of the
+    similarity table, so it never runs on the request while stale rows can
+    be served: they are returned as they are and the background write-back
+    loads the index and recomputes. Only a user with no stored set waits
+    for the load.
+
+    Returns:
+        list: [(product_id, score), ...] best first
+    """
+    from home.models import UserProductRecommendation
+
+    stored = list(
+        UserProductRecommendation.objects.filter(
+            user_id=user_id, recommendation_type=algorithm
+        ).order_by("-score", "product_id").values_list("product_id", "score", "version")[:n]
+    )
+    # A set is written in one transaction, so all its rows share one version
+    if stored and recommendation_is_fresh(stored[0][2], user_id, algorithm):
+        return [(product_id, float(score)) for product_id, score, _ in stored]
+
+    if stored and not recommendation_data_loaded(algorithm):
+        schedule_recommendation_write_back(user_id, algorithm)
+        return [(product_id, float(score)) for product_id, score, _ in stored]
+
+    try:
+        scores, version, complete = compute_user_recommendations(
+            user_id, algorithm, getattr(settings, "RECOMMENDATION_ON_READ_MAX_SOURCES", 200)
+        )
+    except Exception as e:
+        print(f"Error computing recommendations on read: {e}")
+        return [(product_id, float(score)) for product_id, score, _ in stored]
+
+    if scores or stored:
+        if complete:
+            schedule_recommendation_write_back(user_id, algorithm, scores, version)
+        else:
+            schedule_recommendation_write_back(user_id, algorithm)
+
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:n]
+
+
+class ProductVectorIndex:
+    """
+    L2-normalized content feature vectors of the whole catalog (CSR).
+
+    The vectors are the ones CustomContentBasedFilter stores in
+    ProductFeatureVector, so the cosine of two rows is their content-based
+    similarity. Every write to the feature store is recorded in the
+    'content_features' change log; a process re-reads and re-encodes only
+    the rows of the logged products (patched) and loads the whole store
+    only when the log cannot be replayed, when most of the catalog
+    changed, or once the index is older than CACHE_TIMEOUT_LONG (so all
+    rows pick up the current keyword IDF).
+
+    Attributes:
+        product_ids (np.ndarray): Products of the rows (sorted)
+        vectors (csr_matrix): Normalized rows
+        feature_index (dict): {"feature_name": column}
+    """
+
+    def __init__(self, log_epoch=None, log_position=0):
+        self.log_epoch = log_epoch
+        self.log_position = log_position
+        self.loaded_at = time.monotonic()
+        self.product_ids = np.empty(0, dtype=np.int64)
+        self.vectors = sparse.csr_matrix((0, 0))
+        self.feature_index = {}
+
+    def load(self):
+        """Read the feature store (one query) and encode it"""
+        from home.custom_recommendation_engine import CustomContentBasedFilter
+
+        content_filter = CustomContentBasedFilter()
+        matrix, self.product_ids, self.feature_index = content_filter._build_feature_matrix(
+            content_filter._read_feature_store()
+        )
+        self.vectors = content_filter._normalize_rows(matrix)
+        return self
+
+    def patched(self, product_ids, log_position):
+        """
+        Copy of the index with the rows of some products re-read from the store.
+
+        Rows of products without a stored vector (deleted) are dropped, new
+        products are inserted in id order; the other rows are kept as they
+        are.
+
+        Returns:
+            ProductVectorIndex: New index (self is left untouched for concurrent readers)
+        """
+        from home.custom_recommendation_engine import CustomContentBasedFilter
+
+        content_filter = CustomContentBasedFilter()
+        changed = content_filter._read_feature_store(product_ids)
+
+        index = ProductVectorIndex(self.log_epoch, log_position)
+        index.loaded_at = self.loaded_at
+        index.feature_index = dict(self.feature_index)
+
+        indptr, indices, data = [0], [], []
+        for product_id in sorted(changed):
+            for feature_name, weight in changed[product_id].items():
+                indices.append(index.feature_index.setdefault(feature_name, len(index.feature_index)))
+                data.append(weight)
+            indptr.append(len(indices))
+        changed_rows = content_filter._normalize_rows(sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int64)),
+            shape=(len(changed), len(index.feature_index)),
+        ))
+
+        kept = ~np.isin(self.product_ids, np.asarray(list(product_ids), dtype=np.int64))
+        kept_rows = self.vectors[np.flatnonzero(kept)]
+        kept_rows.resize((kept_rows.shape[0], len(index.feature_index)))
+
+        product_order = np.r_[self.product_ids[kept], np.asarray(sorted(changed), dtype=np.int64)]
+        order = np.argsort(product_order, kind="stable")
+        index.product_ids = product_order[order]
+        index.vectors = sparse.vstack([kept_rows, changed_rows], format="csr")[order]
+        return index
+
+    def candidate_vectors(self, product_ids):
+        """
+        Dense vectors of a candidate set, restricted to the features they use.
+
+        Products without a stored vector get a zero row (similar to nothing).
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        positions = np.searchsorted(self.product_ids, product_ids)
+        found = positions < len(self.product_ids)
+        found[found] = self.product_ids[positions[found]] == product_ids[found]
+
+        rows = self.vectors[positions[found]]
+        columns = np.unique(rows.indices)
+        dense = np.zeros((len(product_ids), len(columns)))
+        dense[found] = rows[:, columns].toarray()
+        return dense
+
+
+def get_product_vector_index():
+    """
+    Process-local content vector index, patched from the 'content_features' change log.
+
+    Costs one cache read when the feature store did not change.
+    """
+    index = _product_vector_indexes.get("content_based")
+    changes = None
+    if index is not None and time.monotonic() - index.loaded_at < getattr(settings, "CACHE_TIMEOUT_LONG", 7200):
+        changes = read_index_changes("content_features", index.log_epoch, index.log_position)
+
+    if changes is None or 4 * len(changes[1]) > len(index.product_ids):
+        epoch, position = index_change_log_head("content_features")
+        index = ProductVectorIndex(epoch, position).load()
+        _product_vector_indexes["content_based"] = index
+    elif changes[1]:
+        index = index.patched(changes[1], changes[0])
+        _product_vector_indexes["content_based"] = index
+    return index
+
+
+def diversity_pool_size(n):
+    """Candidates to score for a diversified list of n products"""
+    if getattr(settings, "RECOMMENDATION_DIVERSITY", 0.3) <= 0:
+        return n
+    return n * getattr(settings, "RECOMMENDATION_DIVERSITY_POOL", 4)
+
+
+def diversify_recommendations(ranked, n, diversity=None):
+    """
+    Re-rank recommendations with maximal marginal relevance (Carbonell & Goldstein, 1998).
+
+    Formula: next = argmax_i∈C\S [(1 - λ) × rel(i) - λ × max_j∈S sim(i, j)]
+
+    Where:
+        - rel(i): Score of candidate i scaled to [0, 1] by the best score
+        - sim(i, j): Cosine of the content feature vectors
+        - λ: diversity (settings.RECOMMENDATION_DIVERSITY, 0 = plain top-n)
+
+    max_j∈S sim(i, j) is kept as an array over all candidates and updated
+    with one vectorized product per selected item, so selecting n of k
+    candidates costs O(n × k) instead of comparing every pair in Python.
+
+    Args:
+        ranked (list): [(product_id, score), ...] candidates
+        n (int): Products returned
+        diversity (float|None): λ in [0, 1]
+
+    Returns:
+        list: [(product_id, score), ...] in MMR order
+    """
+    if diversity is None:
+        diversity = getattr(settings, "RECOMMENDATION_DIVERSITY", 0.3)
+    if diversity <= 0 or len(ranked) <= 1:
+        return list(ranked[:n])
+
+    product_ids = [product_id for product_id, _ in ranked]
+    relevance = np.array([float(score) for _, score in ranked])
+    peak = relevance.max()
+    if peak > 0:
+        relevance = relevance / peak
+
+    vectors = get_product_vector_index().candidate_vectors(product_ids)
+    max_similarity = np.zeros(len(ranked))
+    available = np.ones(len(ranked), dtype=bool)
+    selected = []
+
+    for _ in range(min(n, len(ranked))):
+        marginal = np.where(
+            available, (1 - diversity) * relevance - diversity * max_similarity, -np.inf
+        )
+        choice = int(np.argmax(marginal))
+        selected.append(choice)
+        available[choice] = False
+        np.maximum(max_similarity, vectors.dot(vectors[choice]), out=max_similarity)
+
+    return [ranked[choice] for choice in selected]
+
+
+_neighbor_indexes = {}
+_product_vector_indexes = {}
+_background_lock = threading.Lock()
+_background_executor = None
+_background_tasks = {}
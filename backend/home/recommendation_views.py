@@ -8,20 +8,28 @@ from django.conf import settings
 from .models import (
     Product,
     User,
-    Order,
     OrderProduct,
     RecommendationSettings,
     ProductSimilarity,
     UserProductRecommendation,
-    CartItem,
     UserInteraction,
 )
 from .serializers import ProductSerializer
+from .product_exclusions import get_user_exclusions
+from .recommendation_serving import (
+    compute_user_recommendations,
+    diversify_recommendations,
+    diversity_pool_size,
+)
 from collections import defaultdict
 from rest_framework.permissions import IsAdminUser
-from .custom_recommendation_engine import CustomContentBasedFilter
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from .custom_recommendation_engine import (
+    CustomContentBasedFilter,
+    CustomCollaborativeFilter,
+    CustomImplicitALS,
+    CustomUserBasedFilter,
+    replace_user_recommendations,
+)
 
 
 class RecommendationSettingsView(APIView):
@@ -120,6 +128,8 @@ class ProcessRecommendationsView(APIView):
     Methods:
         post: Triggers recommendation computation for selected algorithm
         process_collaborative_filtering: Implements CF using Adjusted Cosine
+        process_implicit_als: Trains implicit-feedback matrix factorization
+        process_user_neighbors: Precomputes top-K user neighbors (user-based CF)
         process_content_based_filtering: Implements CBF using TF-IDF
     """
     
@@ -131,7 +141,8 @@ class ProcessRecommendationsView(APIView):
         
         Args:
             request: HTTP request with algorithm selection
-                Expected data: {"algorithm": "collaborative"|"content_based"}
+                Expected data: {"algorithm": "collaborative"|"collaborative_als"|"collaborative_user"|"content_based",
+                                "rebuild_cooccurrence": bool (collaborative only, optional)}
         
         Returns:
             Response: Success/error message with algorithm details
@@ -140,10 +151,17 @@ class ProcessRecommendationsView(APIView):
             HTTP_500_INTERNAL_SERVER_ERROR: If computation fails
         """
         algorithm = request.data.get("algorithm", "collaborative")
+        self.write_stats = None
 
         try:
             if algorithm == "collaborative":
-                self.process_collaborative_filtering()
+                self.process_collaborative_filtering(
+                    rebuild_cooccurrence=str(request.data.get("rebuild_cooccurrence", "")).lower() in ("1", "true")
+                )
+            elif algorithm == "collaborative_als":
+                self.process_implicit_als()
+            elif algorithm == "collaborative_user":
+                self.process_user_neighbors()
             else:
                 self.process_content_based_filtering()
 
@@ -156,6 +174,7 @@ class ProcessRecommendationsView(APIView):
                         if algorithm == "content_based"
                         else "Collaborative Filtering"
                     ),
+                    "write_stats": self.write_stats,
                 }
             )
         except Exception as e:
@@ -164,7 +183,7 @@ class ProcessRecommendationsView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-    def process_collaborative_filtering(self):
+    def process_collaborative_filtering(self, rebuild_cooccurrence=False):
         """
         Compute product similarities using Collaborative Filtering.
         
@@ -173,8 +192,10 @@ class ProcessRecommendationsView(APIView):
             2. Applies Adjusted Cosine Similarity algorithm (Sarwar et al., 2001)
             3. Mean-centers user ratings to account for rating bias
             4. Computes pairwise item similarities
-            5. Filters similarities above threshold (0.3)
+            5. Keeps top-K neighbors per product (SIMILARITY_TOP_K), optionally
+               above COLLABORATIVE_SIMILARITY_MIN_SCORE
             6. Caches results for 2 hours
+            Delegates to CustomCollaborativeFilter (sparse CSR pipeline)
         
         Formula:
             sim(i,j) = Σ_u∈U(R_u,i - R̄_u)(R_u,j - R̄_u) / 
@@ -185,121 +206,59 @@ class ProcessRecommendationsView(APIView):
             - R̄_u: Mean rating of user u across all items
             - U: Set of users who rated both items i and j
         
+        Args:
+            rebuild_cooccurrence (bool): Also rewrite the co-occurrence accumulators
+                of the incremental path (they are built only when empty otherwise)
+        
         Returns:
-            Cached similarity matrix
+            int: Number of similarities stored
             
         Note:
             Results are stored in ProductSimilarity model with type="collaborative"
         """
-        cache_key = "collaborative_similarity_matrix"
-        cached_result = cache.get(cache_key)
-
-        if cached_result:
-            print("Using cached collaborative filtering results")
-            return cached_result
-        users = User.objects.all()
-        products = Product.objects.all()
-
-        print(
-            f"Processing collaborative filtering for {users.count()} users and {products.count()} products"
+        collaborative_filter = CustomCollaborativeFilter()
+        similarity_count = collaborative_filter.generate_similarities_for_all_products(
+            rebuild_cooccurrence=rebuild_cooccurrence
         )
+        self.write_stats = collaborative_filter.last_write_stats
+        return similarity_count
 
-        # Build user-product interaction matrix from purchase history
-        user_product_matrix = defaultdict(dict)
-        for order in OrderProduct.objects.select_related("order", "product").all():
-            user_product_matrix[order.order.user_id][order.product_id] = order.quantity
-
-        user_ids = list(user_product_matrix.keys())
-        product_ids = list(products.values_list("id", flat=True))
-
-        # Validate sufficient data for computation
-        if len(user_ids) < 2 or len(product_ids) < 2:
-            print("Insufficient data for collaborative filtering")
-            return 0
-
-        # Create dense matrix representation
-        matrix = []
-        for user_id in user_ids:
-            row = []
-            for product_id in product_ids:
-                row.append(user_product_matrix[user_id].get(product_id, 0))
-            matrix.append(row)
-
-        matrix = np.array(matrix, dtype=np.float32)
-
-        # Apply mean-centering for Adjusted Cosine Similarity (Sarwar et al., 2001)
-        print(
-            "Applying mean-centering (Adjusted Cosine Similarity - Sarwar et al. 2001)"
-        )
-        normalized_matrix = np.zeros_like(matrix, dtype=np.float32)
-
-        # Mean-center each user's ratings to account for rating bias
-        for i, user_row in enumerate(matrix):
-            purchased_items = user_row[user_row > 0]
-
-            if len(purchased_items) > 0:
-                user_mean = np.mean(purchased_items)
-                # Subtract user mean from all rated items
-                for j, val in enumerate(user_row):
-                    if val > 0:
-                        normalized_matrix[i][j] = val - user_mean
-                    else:
-                        normalized_matrix[i][j] = 0
-            else:
-                normalized_matrix[i] = user_row
-
-        # Compute item-item similarities using cosine similarity on transposed matrix
-        if normalized_matrix.shape[0] > 1 and normalized_matrix.shape[1] > 1:
-            product_similarity = cosine_similarity(normalized_matrix.T)
-
-            # Clear old collaborative similarities
-            ProductSimilarity.objects.filter(similarity_type="collaborative").delete()
-
-            similarities_to_create = []
-            similarity_count = 0
-
-            # Threshold for storing similarities (reduces storage for sparse data)
-            similarity_threshold = 0.5
-
-            # Store only significant similarities above threshold
-            for i, product1_id in enumerate(product_ids):
-                for j, product2_id in enumerate(product_ids):
-                    if i != j and product_similarity[i][j] > similarity_threshold:
-                        similarities_to_create.append(
-                            ProductSimilarity(
-                                product1_id=product1_id,
-                                product2_id=product2_id,
-                                similarity_type="collaborative",
-                                similarity_score=float(product_similarity[i][j]),
-                            )
-                        )
-                        similarity_count += 1
-
-                        # Batch insert for performance
-                        if len(similarities_to_create) >= 1000:
-                            ProductSimilarity.objects.bulk_create(
-                                similarities_to_create
-                            )
-                            similarities_to_create = []
-
-            # Insert remaining similarities
-            if similarities_to_create:
-                ProductSimilarity.objects.bulk_create(similarities_to_create)
-
-            print(
-                f"Created {similarity_count} collaborative similarities using Adjusted Cosine Similarity (Sarwar et al. 2001) with threshold {similarity_threshold}"
-            )
-
-            # Cache results for 2 hours
-            cache.set(
-                cache_key,
-                similarity_count,
-                timeout=getattr(settings, "CACHE_TIMEOUT_LONG", 7200),
-            )
-
-            return similarity_count
+    def process_implicit_als(self):
+        """
+        Train implicit-feedback matrix factorization (Hu, Koren & Volinsky 2008).
+        
+        Implementation Details:
+            1. Builds user × product feedback from purchases and interaction events
+            2. Confidence c_ui = 1 + α × r_ui, preference p_ui = 1 if r_ui > 0
+            3. Alternating least squares on user and item factors
+            4. Persists the factors; recommendations are scored on read
+            Delegates to CustomImplicitALS
+        
+        Returns:
+            int: Number of users with trained factors
+        """
+        als_model = CustomImplicitALS()
+        self.write_stats = als_model.train()
+        return self.write_stats["users"]
 
-        return 0
+    def process_user_neighbors(self):
+        """
+        Precompute every user's top-K most similar users (user-based CF).
+        
+        Implementation Details:
+            1. Builds the sparse user × product purchase matrix
+            2. Cosine similarity between users, block-wise, top-K per user
+               (USER_NEIGHBORS_TOP_K)
+            3. Persists the neighbor lists; recommendations aggregate
+               neighbor purchases on demand
+            Delegates to CustomUserBasedFilter
+        
+        Returns:
+            int: Number of stored user neighbor pairs
+        """
+        user_filter = CustomUserBasedFilter()
+        self.write_stats = user_filter.build_neighbors()
+        return self.write_stats["neighbor_pairs"]
 
     def process_content_based_filtering(self):
         """
@@ -327,6 +286,7 @@ class ProcessRecommendationsView(APIView):
         """
         content_filter = CustomContentBasedFilter()
         similarity_count = content_filter.generate_similarities_for_all_products()
+        self.write_stats = content_filter.last_write_stats
         print(
             f"Enhanced content-based filtering generated {similarity_count} similarities"
         )
@@ -365,7 +325,7 @@ class RecommendationPreviewView(APIView):
         Args:
             request: HTTP request with query parameters
                 - algorithm: str (default "collaborative")
-                  Options: "fuzzy_logic", "collaborative", "content_based"
+                  Options: "fuzzy_logic", "collaborative", "collaborative_als", "content_based", "hybrid"
                 - limit: int (default varies by algorithm)
         
         Returns:
@@ -383,58 +343,30 @@ class RecommendationPreviewView(APIView):
         algorithm = request.GET.get("algorithm", "collaborative")
 
         if algorithm == "fuzzy_logic":
-            from home.fuzzy_logic_engine import (
-                FuzzyMembershipFunctions,
-                FuzzyUserProfile,
-                SimpleFuzzyInference,
-            )
+            from home.fuzzy_logic_engine import FuzzyUserProfile
             from home.models import Product
-            from django.db.models import Count, Avg
+            from home.recommendation_pipeline import CandidateRankingPipeline
 
             try:
-                # Initialize fuzzy logic components
-                membership_functions = FuzzyMembershipFunctions()
+                # Bounded candidates from the in-memory indexes, ranked by the
+                # fuzzy inference, purchase probability and sentiment models
                 user_profile = FuzzyUserProfile(user=request.user)
-                fuzzy_engine = SimpleFuzzyInference(membership_functions, user_profile)
-
-                # Fetch products with aggregated statistics
-                products_query = Product.objects.all().annotate(
-                    review_count=Count("opinion"),
-                    avg_rating=Avg("opinion__rating"),
-                    order_count=Count("orderproduct", distinct=True),
-                )[:100]
-
-                scored_products = []
-                for product in products_query:
-                    # Calculate category match using fuzzy logic
-                    product_categories = [cat.name for cat in product.categories.all()]
-                    category_match = max(
-                        [
-                            user_profile.fuzzy_category_match(cat)
-                            for cat in product_categories
-                        ]
-                        or [0.0]
-                    )
-
-                    product_data = {
-                        "price": float(product.price),
-                        "rating": (
-                            float(product.avg_rating) if product.avg_rating else 3.0
-                        ),
-                        "view_count": (
-                            product.order_count
-                            if hasattr(product, "order_count")
-                            else 0
-                        ),
-                    }
+                pipeline = CandidateRankingPipeline()
+                ranked_items = pipeline.rank(
+                    pipeline.generate_candidates(request.user), user_profile, request.user
+                )
 
-                    fuzzy_result = fuzzy_engine.evaluate_product(
-                        product_data, category_match
+                products_by_id = {item["product"].id: item["product"] for item in ranked_items}
+                products = [
+                    products_by_id[product_id]
+                    for product_id, _ in diversify_recommendations(
+                        [
+                            (item["product"].id, item["score"])
+                            for item in ranked_items[:diversity_pool_size(6)]
+                        ],
+                        6,
                     )
-                    scored_products.append((product, fuzzy_result["fuzzy_score"]))
-
-                scored_products.sort(key=lambda x: x[1], reverse=True)
-                products = [p[0] for p in scored_products[:6]]
+                ]
 
                 serializer = ProductSerializer(products, many=True)
                 return Response(serializer.data)
@@ -448,22 +380,65 @@ class RecommendationPreviewView(APIView):
                 serializer = ProductSerializer(products, many=True)
                 return Response(serializer.data)
 
-        recommendations = (
+        if algorithm == "collaborative_als":
+            from home.models import Product
+
+            product_ids = [
+                product_id
+                for product_id, _ in diversify_recommendations(
+                    get_user_exclusions(request.user.id).filter_ranked(
+                        CustomImplicitALS().recommend(request.user.id, n=diversity_pool_size(6))
+                    ),
+                    6,
+                )
+            ]
+            products_by_id = Product.objects.in_bulk(product_ids)
+            products = [products_by_id[product_id] for product_id in product_ids if product_id in products_by_id]
+
+            serializer = ProductSerializer(products, many=True)
+            return Response(serializer.data)
+
+        if algorithm == "hybrid":
+            from home.models import Product
+            from home.hybrid_recommender import CustomHybridRecommender
+
+            product_ids = [
+                product_id
+                for product_id, _ in diversify_recommendations(
+                    CustomHybridRecommender().recommend(request.user, n=diversity_pool_size(6)), 6
+                )
+            ]
+            products_by_id = Product.objects.in_bulk(product_ids)
+            products = [products_by_id[product_id] for product_id in product_ids if product_id in products_by_id]
+
+            serializer = ProductSerializer(products, many=True)
+            return Response(serializer.data)
+
+        recommendations = list(
             UserProductRecommendation.objects.filter(
                 user=request.user, recommendation_type=algorithm
             )
             .select_related("product")
-            .order_by("-score")[:6]
+            .order_by("-score", "product_id")[:diversity_pool_size(6)]
         )
 
-        if not recommendations.exists():
+        if not recommendations:
             similarities = ProductSimilarity.objects.filter(
                 similarity_type=algorithm
             ).order_by("-similarity_score")[:10]
 
             products = [s.product2 for s in similarities]
         else:
-            products = [r.product for r in recommendations]
+            products_by_id = {r.product_id: r.product for r in recommendations}
+            products = [
+                products_by_id[product_id]
+                for product_id, _ in diversify_recommendations(
+                    get_user_exclusions(request.user.id).filter_ranked(
+                        [(r.product_id, r.score) for r in recommendations]
+                    ),
+                    6,
+                )
+            ]
 
         serializer = ProductSerializer(products, many=True)
         return Response(serializer.data)
@@ -475,6 +450,36 @@ class GenerateUserRecommendationsView(APIView):
     def post(self, request):
         algorithm = request.data.get("algorithm", "collaborative")
 
+        if algorithm == "collaborative_als":
+            # Nothing to aggregate: ALS recommendations are scored on read from the factors
+            recommendations = CustomImplicitALS().recommend(request.user.id, n=12)
+            return Response(
+                {
+                    "success": True,
+                    "message": f"User recommendations generated for {algorithm} algorithm",
+                    "recommendations_count": len(recommendations),
+                    "implementation": "Implicit ALS",
+                    "cached": False,
+                }
+            )
+
+        if algorithm == "hybrid":
+            # Nothing stored: the hybrid blend is computed on read
+            from home.hybrid_recommender import CustomHybridRecommender
+
+            hybrid = CustomHybridRecommender()
+            recommendations = hybrid.recommend(request.user, n=12)
+            return Response(
+                {
+                    "success": True,
+                    "message": f"User recommendations generated for {algorithm} algorithm",
+                    "recommendations_count": len(recommendations),
+                    "implementation": "Hybrid Score Blending",
+                    "sources": hybrid.last_report,
+                    "cached": False,
+                }
+            )
+
         cache_key = f"user_recommendations_{request.user.id}_{algorithm}"
         cached_result = cache.get(cache_key)
 
@@ -493,44 +498,12 @@ class GenerateUserRecommendationsView(APIView):
                 }
             )
 
-        user_products = []
-
-        orders = Order.objects.filter(user=request.user)
-        for order in orders:
-            products = order.orderproduct_set.all()
-            user_products.extend([op.product_id for op in products])
-
-        cart_items = CartItem.objects.filter(user=request.user)
-        user_products.extend([item.product_id for item in cart_items])
-
-        recommendations = defaultdict(float)
-
-        for product_id in set(user_products):
-            similarities = ProductSimilarity.objects.filter(
-                product1_id=product_id, similarity_type=algorithm
-            ).order_by("-similarity_score")[:5]
-
-            for similarity in similarities:
-                recommendations[similarity.product2_id] += float(
-                    similarity.similarity_score
-                )
-
-        recommendations_to_update = []
-        for product_id, score in recommendations.items():
-            recommendation, created = UserProductRecommendation.objects.get_or_create(
-                user=request.user,
-                product_id=product_id,
-                recommendation_type=algorithm,
-                defaults={"score": score},
-            )
-            if not created and recommendation.score != score:
-                recommendation.score = score
-                recommendations_to_update.append(recommendation)
-
-        if recommendations_to_update:
-            UserProductRecommendation.objects.bulk_update(
-                recommendations_to_update, ["score"]
-            )
+        # Cart and ordered products in two queries, owned products excluded;
+        # the version is taken before the inputs are read
+        recommendations, version, _ = compute_user_recommendations(request.user.id, algorithm)
+        replace_user_recommendations(
+            request.user.id, algorithm, recommendations, version
+        )
 
         cache.set(
             cache_key,
@@ -638,6 +611,8 @@ class UpdateProductSimilarityView(APIView):
                     "status": "success"|"error",
                     "message": str,
                     "similarity_records_created": int,
+                    "write_stats": {"created", "updated", "deleted", "unchanged"} counts
+                                   (None when served from cache),
                     "implementation": str
                 }
         
@@ -655,6 +630,7 @@ class UpdateProductSimilarityView(APIView):
                     "status": "success",
                     "message": f"Custom content-based similarity updated for {product_count} products",
                     "similarity_records_created": similarity_count,
+                    "write_stats": content_filter.last_write_stats,
                     "implementation": "Custom Manual Content-Based Filter",
                 }
             )
@@ -900,8 +876,9 @@ class CollaborativeFilteringDebugView(APIView):
                         "total_possible_pairs": total_possible_pairs,
                         "saved_similarities": cf_count,
                         "percentage_saved": round(percentage_saved, 2),
-                        "threshold": 0.3,
-                        "description": "Only similarities > 0.3 are saved to database",
+                        "threshold": getattr(settings, "COLLABORATIVE_SIMILARITY_MIN_SCORE", 0.0),
+                        "top_k": getattr(settings, "SIMILARITY_TOP_K", 20),
+                        "description": "Only the top-K most similar products per product are saved to database",
                     },
                     "cache_info": {
                         "cache_key": cache_key,
@@ -1137,8 +1114,9 @@ class ContentBasedDebugView(APIView):
                     "saved_similarities": cb_count,
                     "total_possible_pairs": total_possible_pairs,
                     "percentage_saved": round(percentage_saved, 2),
-                    "threshold": 0.2,
-                    "description": "Only similarities > 20% are saved to database",
+                    "threshold": getattr(settings, "CONTENT_SIMILARITY_MIN_SCORE", 0.0),
+                    "top_k": getattr(settings, "SIMILARITY_TOP_K", 20),
+                    "description": "Only the top-K most similar products per product are saved to database",
                 },
                 "cache_info": {
                     "cache_key": cache_key,
@@ -1166,11 +1144,28 @@ class ContentBasedDebugView(APIView):
                     )
 
                 cb_filter = CustomContentBasedFilter()
-                features = cb_filter._extract_weighted_features(product)
+
+                similar_products = list(
+                    ProductSimilarity.objects.filter(
+                        product1_id=product_id, similarity_type="content_based"
+                    )
+                    .select_related("product2")
+                    .prefetch_related("product2__categories", "product2__tags")
+                    .order_by("-similarity_score")[:10]
+                )
+
+                feature_vectors = cb_filter.get_feature_vectors(
+                    [product] + [sim.product2 for sim in similar_products]
+                )
+                features = feature_vectors[product.id]
 
                 price_category = cb_filter._get_price_category(product.price)
 
-                keywords = cb_filter._extract_keywords(product.description or "")[:5]
+                keywords = [
+                    feature[len("keyword_"):]
+                    for feature in features
+                    if feature.startswith("keyword_")
+                ]
 
                 response_data["selected_product"] = {
                     "id": product.id,
@@ -1193,18 +1188,10 @@ class ContentBasedDebugView(APIView):
                     },
                 }
 
-                similar_products = (
-                    ProductSimilarity.objects.filter(
-                        product1_id=product_id, similarity_type="content_based"
-                    )
-                    .select_related("product2")
-                    .order_by("-similarity_score")[:10]
-                )
-
                 similarities_details = []
                 for sim in similar_products:
                     product2 = sim.product2
-                    features2 = cb_filter._extract_weighted_features(product2)
+                    features2 = feature_vectors[product2.id]
 
                     all_features = set(features.keys()) | set(features2.keys())
                     dot_product = sum(
@@ -1325,3 +1312,85 @@ class ContentBasedDebugView(APIView):
                 },
                 status=500,
             )
+
+
+class SimilarProductsLSHView(APIView):
+    """
+    API endpoint for "similar to product X" lookups at request time.
+    
+    Uses the MinHash LSH index over the content feature store instead of
+    the precomputed ProductSimilarity table, so it works for products added
+    since the last similarity rebuild and costs the same on any catalog size.
+    
+    Attributes:
+        permission_classes: Public endpoint (no authentication required)
+        
+    Methods:
+        get: Return approximate top-K content-similar products
+    """
+
+    permission_classes = []
+    max_limit = 50
+
+    def get(self, request):
+        """
+        Return products most similar to the given product.
+        
+        Anonymous requests only read the process's LSH index; a missing or
+        stale index is (re)built on the background worker pool from the
+        stored feature vectors, never on the request.
+        
+        Args:
+            request: HTTP request with query parameters
+                - product_id: int (required)
+                - limit: int (default 6, clamped to 1..50)
+        
+        Returns:
+            Response: JSON with similar products
+                {
+                    "product_id": int,
+                    "count": int,
+                    "products": [serialized product objects],
+                    "scores": {product_id: cosine_score}
+                }
+        
+        Raises:
+            HTTP_400: If product_id is missing or product_id / limit are not integers
+            HTTP_404: If product not found in the index
+            HTTP_503: If the index of this process is still being built
+        """
+        try:
+            product_id = int(request.GET.get("product_id"))
+            limit = int(request.GET.get("limit", 6))
+        except (TypeError, ValueError):
+            return Response(
+                {"error": "product_id and limit must be integers"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        limit = min(max(limit, 1), self.max_limit)
+
+        similar = CustomContentBasedFilter().get_similar_products(product_id, top_k=limit, build=False)
+        if similar is None:
+            return Response(
+                {"error": "Similarity index is being built, retry shortly"},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": "5"},
+            )
+        if not similar and not Product.objects.filter(id=product_id).exists():
+            return Response(
+                {"error": f"Product {product_id} not found"},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        products_by_id = Product.objects.in_bulk([pid for pid, _ in similar])
+        products = [products_by_id[pid] for pid, _ in similar if pid in products_by_id]
+
+        serializer = ProductSerializer(products, many=True)
+        return Response(
+            {
+                "product_id": product_id,
+                "count": len(products),
+                "products": serializer.data,
+                "scores": {pid: round(score, 4) for pid, score in similar},
+            }
+        )
@@ -15,6 +15,7 @@ Key Features:
     - Cached sentiment summaries for performance
 """
 
+import numpy as np
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
@@ -25,6 +26,7 @@ from django.conf import settings
 from .models import Product, ProductSentimentSummary, SentimentAnalysis
 from .serializers import ProductSerializer
 from .custom_recommendation_engine import CustomFuzzySearch
+from .recommendation_pipeline import CandidateRankingPipeline
 
 
 class SentimentSearchAPIView(APIView):
@@ -413,7 +415,16 @@ class FuzzySearchAPIView(APIView):
                 "categories", "photoproduct_set", "specification_set", "tags"
             )
 
-            products = list(products_query[:1000])
+            # Only the products sharing the most trigrams with the query are
+            # scored; the price range is applied before the candidate limit
+            fuzzy_search = CustomFuzzySearch()
+            price_filter = None
+            if price_range in ("cheap", "medium", "expensive"):
+                price_filter = lambda prices: self.price_range_mask(prices, price_range)
+            candidate_ids = fuzzy_search.candidate_product_ids(
+                query, max(fuzzy_search.candidate_limit, max_results), price_filter
+            )
+            products = list(products_query.filter(id__in=candidate_ids).order_by("id"))
 
             fuzzy_results = self._simple_fuzzy_search(query, products, fuzzy_threshold)
 
@@ -474,11 +485,14 @@ class FuzzySearchAPIView(APIView):
         Enhanced fuzzy search using CustomFuzzySearch with advanced algorithms:
 
         Algorithms implemented in CustomFuzzySearch (custom_recommendation_engine.py):
-        1. Levenshtein Distance - O(n*m) space-optimized character-level similarity
+        1. Levenshtein Distance - bit-parallel / banded character-level similarity
         2. Trigram Similarity - N-gram matching for spelling error tolerance
         3. Word-level Similarity - Exact + partial word matching with context
         4. Chunked Processing - Sliding window for long texts (150 chars + 30 overlap)
 
+        The products are the trigram index candidates of the query
+        (CustomFuzzySearch.candidate_product_ids), not the whole catalog.
+
         Field Weights (from CustomFuzzySearch):
         - Name: 45%
         - Description: 25%
@@ -498,6 +512,16 @@ class FuzzySearchAPIView(APIView):
 
         return results
 
+    def price_range_mask(self, prices, price_range):
+        """Vectorized match_price_range over a price array"""
+        if price_range == "cheap":
+            return prices < 100
+        elif price_range == "medium":
+            return (prices >= 100) & (prices <= 500)
+        elif price_range == "expensive":
+            return prices > 500
+        return np.ones(len(prices), dtype=bool)
+
     def match_price_range(self, price, price_range):
         try:
             if price_range == "cheap":
@@ -627,6 +651,10 @@ class FuzzyLogicRecommendationsAPIView(APIView):
     - 2: Fuzzy User Profiling (category interests, price sensitivity)
     - 3: Simplified Fuzzy Inference Engine (Mamdani-style)
 
+    Only the bounded candidate set of CandidateRankingPipeline is scored
+    (neighbors, association rules, popularity), ranked by fuzzy inference
+    together with purchase probability and sentiment.
+
     Based on:
     - Zadeh, L. A. (1965). "Fuzzy sets". Information and Control.
     - Mamdani, E. H. (1975). "Application of fuzzy algorithms for control of simple dynamic plant"
@@ -667,15 +695,12 @@ class FuzzyLogicRecommendationsAPIView(APIView):
 
             fuzzy_engine = SimpleFuzzyInference(membership_functions, user_profile)
 
-            products_query = Product.objects.all().annotate(
-                review_count=Count("opinion"),
-                avg_rating=Avg("opinion__rating"),
-                order_count=Count("orderproduct", distinct=True)
-            )
-
-            products = list(products_query[:500])
+            # Stage 1: bounded candidates (neighbors, rules, popularity);
+            # Stage 2: fuzzy inference + purchase probability + sentiment
+            pipeline = CandidateRankingPipeline()
+            candidates = pipeline.generate_candidates(request.user)
 
-            if not products:
+            if not candidates:
                 return Response(
                     {
                         "recommendations": [],
@@ -684,40 +709,9 @@ class FuzzyLogicRecommendationsAPIView(APIView):
                     }
                 )
 
-            scored_products = []
-
-            for product in products:
-                product_categories = [cat.name for cat in product.categories.all()]
-
-                category_match = 0.0
-                for cat in product_categories:
-                    match = user_profile.fuzzy_category_match(cat)
-                    category_match = max(category_match, match)
-
-                product_data = {
-                    "price": float(product.price),
-                    "rating": float(product.avg_rating) if product.avg_rating else 3.0,
-                    "view_count": product.order_count if hasattr(product, "order_count") else 0,
-                }
-
-                fuzzy_result = fuzzy_engine.evaluate_product(
-                    product_data, category_match
-                )
-
-                scored_products.append(
-                    {
-                        "product": product,
-                        "fuzzy_score": fuzzy_result["fuzzy_score"],
-                        "rule_activations": (
-                            fuzzy_result["rule_activations"] if debug_mode else None
-                        ),
-                        "category_match": fuzzy_result["category_match"],
-                    }
-                )
-
-            scored_products.sort(key=lambda x: x["fuzzy_score"], reverse=True)
-
-            top_products = scored_products[:limit]
+            top_products = pipeline.rank(
+                candidates, user_profile, request.user, debug=debug_mode
+            )[:limit]
 
             recommendations = []
             for item in top_products:
@@ -725,8 +719,11 @@ class FuzzyLogicRecommendationsAPIView(APIView):
 
                 rec = {
                     "product": product_data,
+                    "score": item["score"],
                     "fuzzy_score": item["fuzzy_score"],
                     "category_match": item["category_match"],
+                    "purchase_probability": item["purchase_probability"],
+                    "sentiment": item["sentiment"],
                 }
 
                 if debug_mode:
@@ -736,7 +733,7 @@ class FuzzyLogicRecommendationsAPIView(APIView):
 
             result = {
                 "recommendations": recommendations,
-                "total_evaluated": len(products),
+                "total_evaluated": len(candidates),
                 "user_profile": user_profile.get_profile_summary(),
                 "fuzzy_system": {
                     "implementation": "VARIANT B+: Membership Functions + User Profile + Mamdani Inference",
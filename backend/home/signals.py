@@ -10,10 +10,21 @@ This module implements event-driven triggers that automatically:
 
 Signal Triggers:
     1. Order Created → Generate analytics + association rules + recommendations
+       + incremental collaborative similarity update
     2. OrderProduct Created → Log interaction + invalidate caches
+       + invalidate the user's exclusion bitset
     3. CartItem Created → Log interaction + update content-based recommendations
-    4. Product Modified → Invalidate content-based cache
-    5. Opinion Created → Analyze sentiment + update product summary
+       + invalidate the user's exclusion bitset
+       OrderProduct / CartItem Deleted → Invalidate the user's exclusion bitset
+    4. Product Description/Price Changed → Incrementally refresh the product's
+       content-based similarities (one refresh per transaction for all products)
+    5. Product Tags/Categories Changed → Same incremental refresh
+    6. Product Feature Vector Deleted → Decrement keyword document frequencies
+       + record the product in the 'content_features' change log
+       Product Deleted → Invalidate the product neighbor indexes
+       Product / Specification / Category / Tag Changed → Record the affected
+       products in the 'search' change log (trigram index patched per process)
+    7. Opinion Created → Analyze sentiment + update product summary
 
 Architecture Pattern:
     Observer Pattern - Django signals act as event subscribers that respond
@@ -37,18 +48,24 @@ Date: 2025-11-02
 Version: 2.0
 """
 
+import functools
+import threading
+
 from colorama import Fore
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed, post_init, pre_save, pre_delete
 from django.dispatch import receiver
 from django.db import transaction
 from collections import defaultdict
 from django.db.models import Avg
 from django.core.cache import cache
 from .models import (
+    Category,
     Order,
     OrderProduct,
     ProductAssociation,
     Product,
+    ProductCategory,
+    ProductFeatureVector,
     RecommendationSettings,
     ProductSimilarity,
     UserProductRecommendation,
@@ -57,6 +74,8 @@ from .models import (
     Opinion,
     SentimentAnalysis,
     ProductSentimentSummary,
+    Specification,
+    Tag,
 )
 from .analytics import (
     generate_purchase_probabilities_for_user,
@@ -65,12 +84,27 @@ from .analytics import (
     generate_sales_forecasts_for_products,
     generate_product_demand_forecasts_for_products,
 )
+from .product_exclusions import invalidate_user_exclusions
+from .recommendation_serving import (
+    bump_neighbor_index_version,
+    compute_user_recommendations,
+    record_index_changes,
+    submit_background_task,
+)
 from .custom_recommendation_engine import (
     CustomContentBasedFilter,
+    CustomCollaborativeFilter,
     CustomAssociationRules,
     CustomSentimentAnalysis,
+    replace_user_recommendations,
 )
 
+# Product fields whose changes signal receivers react to (compared with the loaded values)
+PRODUCT_WATCHED_FIELDS = ("name", "description", "price")
+
+# Commit callback of the current transaction's pending content refresh (per thread)
+_pending_content_refresh = threading.local()
+
 
 @receiver(post_save, sender=Order)
 def handle_new_order_and_analytics(sender, instance, created, **kwargs):
@@ -116,8 +150,9 @@ def log_interaction_on_purchase(sender, instance, created, **kwargs):
     
     Actions Performed:
         1. Create UserInteraction record (type='purchase')
-        2. Invalidate ALL recommendation caches (collaborative, content-based, association)
+        2. Invalidate content-based and association caches
         3. Invalidate user-specific recommendation caches
+        4. Invalidate the user's exclusion bitset (after commit)
     
     Args:
         sender (Model): OrderProduct model class
@@ -126,7 +161,6 @@ def log_interaction_on_purchase(sender, instance, created, **kwargs):
         **kwargs: Additional signal arguments
     
     Cache Keys Invalidated:
-        - collaborative_similarity_matrix: Full collaborative filtering matrix
         - content_based_similarity_matrix: Full content-based matrix
         - association_rules_list: Apriori association rules
         - user_recommendations_{user_id}_collaborative: User-specific CF recs
@@ -134,7 +168,9 @@ def log_interaction_on_purchase(sender, instance, created, **kwargs):
     
     Why Invalidate:
         New purchase changes user's preference profile, requiring fresh
-        recommendation calculations with updated data.
+        recommendation calculations with updated data. The collaborative
+        similarity matrix is not invalidated: run_all_analytics_after_order
+        updates it incrementally once the order is complete.
     
     Example:
         User buys "Laptop" → OrderProduct created → Log interaction →
@@ -149,7 +185,6 @@ def log_interaction_on_purchase(sender, instance, created, **kwargs):
         )
         
         # Invalidate global recommendation caches
-        cache.delete("collaborative_similarity_matrix")
         cache.delete("content_based_similarity_matrix")
         cache.delete("association_rules_list")
         
@@ -158,6 +193,9 @@ def log_interaction_on_purchase(sender, instance, created, **kwargs):
         cache.delete(f"user_recommendations_{user_id}_collaborative")
         cache.delete(f"user_recommendations_{user_id}_content_based")
         
+        # Purchased products are filtered out of every recommendation list
+        transaction.on_commit(lambda: invalidate_user_exclusions(user_id))
+        
         print("Cache invalidated due to new purchase")
 
 
@@ -170,7 +208,8 @@ def log_interaction_on_cart_add(sender, instance, created, **kwargs):
     
     Actions Performed:
         1. Create UserInteraction record (type='add_to_cart')
-        2. Update user's content-based recommendations
+        2. Invalidate the user's exclusion bitset (after commit)
+        3. Update user's content-based recommendations
     
     Args:
         sender (Model): CartItem model class
@@ -200,21 +239,40 @@ def log_interaction_on_cart_add(sender, instance, created, **kwargs):
             user=instance.user, product=instance.product, interaction_type="add_to_cart"
         )
         
+        user_id = instance.user_id
+        transaction.on_commit(lambda: invalidate_user_exclusions(user_id))
+        
         # Update content-based recommendations (unless skipped)
         if not getattr(instance, "_skip_similarity_update", False):
             update_user_cb_recommendations(instance.user)
 
 
+@receiver(post_delete, sender=OrderProduct)
+@receiver(post_delete, sender=CartItem)
+def handle_owned_product_removed(sender, instance, **kwargs):
+    """
+    Invalidate the user's exclusion bitset when a cart item or order line is removed.
+
+    The product may still be owned through another order or the cart, so
+    the bitset is rebuilt from the tables on next use instead of clearing
+    the bit.
+    """
+    user_id = instance.user_id if sender is CartItem else instance.order.user_id
+    transaction.on_commit(lambda: invalidate_user_exclusions(user_id))
+
+
 @receiver(post_save, sender=Product)
 def handle_product_changes(sender, instance, created, **kwargs):
     """
-    Invalidate content-based cache when product metadata changes.
+    Incrementally refresh content-based similarities when product metadata changes.
     
     Event: post_save signal for Product model (product created or updated)
     
     Actions Performed:
-        1. Check if relevant fields changed (name, description, price)
-        2. Invalidate content-based similarity matrix cache
+        1. Check if content fields changed value (description, price),
+           compared with the values loaded from the database
+        2. Schedule refresh of this product's row and column of the
+           content-based similarity graph after database commit
     
     Args:
         sender (Model): Product model class
@@ -223,32 +281,230 @@ def handle_product_changes(sender, instance, created, **kwargs):
         **kwargs: Additional signal arguments (includes update_fields)
     
     Watched Fields:
-        - name: Product name (used in TF-IDF vectorization)
-        - description: Product description (main content for similarity)
-        - price: Product price (affects value-based recommendations)
+        - description: Product description (keyword features)
+        - price: Product price (price bucket feature)
+        The name is not a content feature. A full save (update_fields=None)
+        only triggers the refresh when one of them holds a new value
+        (detect_changed_product_fields).
     
-    Why Invalidate:
-        Content-based filtering uses product text (name + description) to
-        calculate TF-IDF vectors and cosine similarity. Changes to these
-        fields require recalculation of similarity matrix.
+    Why Incremental:
+        A single edit only changes similarities involving the edited product,
+        so recomputing its row/column costs O(catalog) instead of rebuilding
+        the whole O(catalog²) matrix.
     
-    Cache Key Invalidated:
-        - content_based_similarity_matrix: Full content-based matrix
+    Skip Conditions:
+        - _skip_similarity_update flag is set (bulk imports)
+        - No watched field changed value
     
     Example:
         Admin updates product description →
         Product.save(update_fields=['description']) → Signal fires →
-        Delete cached similarity matrix → Next recommendation call regenerates
-    
-    Performance:
-        Only invalidates if relevant fields changed (avoids unnecessary work).
+        Wait for commit → Recompute similarities of this product only
     """
-    update_fields = kwargs.get('update_fields', [])
+    if getattr(instance, "_skip_similarity_update", False):
+        return
+
+    if getattr(instance, "_changed_fields", set()) & {"description", "price"}:
+        _schedule_content_refresh([instance.id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(m2m_changed, sender=Product.categories.through)
+def handle_product_features_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Incrementally refresh content-based similarities when tags or categories change.
     
-    # Check if product is new OR relevant fields were updated
-    if created or (update_fields is not None and any(field in update_fields for field in ['name', 'description', 'price'])):
-        cache.delete("content_based_similarity_matrix")
-        print("Content-based cache invalidated due to product changes")
+    Event: m2m_changed for Product.tags and Product.categories
+    
+    Forward changes (product.tags.add(...)) refresh the product itself,
+    reverse changes (tag.product_set.add(...)) refresh every product in pk_set.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if getattr(instance, "_skip_similarity_update", False):
+        return
+
+    if not reverse:
+        _schedule_content_refresh([instance.id])
+    else:
+        _schedule_content_refresh(pk_set or [])
+
+
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def handle_product_category_changes(sender, instance, **kwargs):
+    """
+    Incrementally refresh content-based similarities when a ProductCategory row
+    is created or deleted directly (bypassing product.categories.add()).
+    """
+    if getattr(instance, "_skip_similarity_update", False):
+        return
+
+    _schedule_content_refresh([instance.product_id])
+
+
+def _schedule_content_refresh(product_ids):
+    """
+    Refresh content similarities of products once the transaction commits.
+    
+    Creating a product with categories and tags fires several signals in
+    one transaction; their product ids go into the pending set of one
+    commit callback, which refreshes all of them in one pass. The set
+    belongs to that callback and is only extended at the savepoint level
+    that registered it: when the transaction or a savepoint rolls back,
+    Django drops the callbacks registered inside it together with their
+    ids, and the next signal starts a new set.
+    """
+    connection = transaction.get_connection()
+    flush = getattr(_pending_content_refresh, "flush", None)
+    # atomic(savepoint=False) blocks push None, they do not roll back alone
+    current_savepoints = set(connection.savepoint_ids) - {None}
+    if flush is not None and connection.in_atomic_block and any(
+        registered is flush and savepoint_ids - {None} == current_savepoints
+        for savepoint_ids, registered, _ in connection.run_on_commit
+    ):
+        flush.args[0].update(product_ids)
+        return
+
+    flush = functools.partial(_flush_content_refresh, set(product_ids))
+    _pending_content_refresh.flush = flush
+    transaction.on_commit(flush)
+
+
+def _flush_content_refresh(product_ids):
+    if product_ids:
+        update_content_based_similarity_for_products(sorted(product_ids))
+
+
+@receiver(post_delete, sender=ProductFeatureVector)
+def handle_feature_vector_deleted(sender, instance, **kwargs):
+    """
+    Keep the keyword document frequency table in sync when a product (and
+    with it, its feature vector) is deleted, and drop the product from the
+    process-local vector indexes ('content_features' change log).
+    """
+    product_id = instance.product_id
+    transaction.on_commit(lambda: record_index_changes("content_features", [product_id]))
+    if not instance.term_counts:
+        return
+
+    try:
+        CustomContentBasedFilter().apply_document_frequency_deltas(
+            {term: -1 for term in instance.term_counts}
+        )
+    except Exception as e:
+        print(f"{Fore.RED}Error updating keyword document frequencies: {e}")
+
+
+@receiver(post_delete, sender=Product)
+def handle_product_deleted(sender, instance, **kwargs):
+    """
+    Deleting a product cascades to its ProductSimilarity and ProductAssociation
+    rows; mark the process-local neighbor indexes stale so no process
+    recommends it.
+    """
+    transaction.on_commit(lambda: [
+        bump_neighbor_index_version(similarity_type)
+        for similarity_type in [t for t, _ in ProductSimilarity.SIMILARITY_TYPES] + ["association"]
+    ])
+
+
+@receiver(post_init, sender=Product)
+def remember_loaded_product_fields(sender, instance, **kwargs):
+    """
+    Keep the loaded values of the watched Product fields on the instance,
+    so a save can tell which of them actually changed (deferred fields are
+    not read).
+    """
+    instance._loaded_values = {
+        field: instance.__dict__[field] for field in PRODUCT_WATCHED_FIELDS if field in instance.__dict__
+    }
+
+
+@receiver(pre_save, sender=Product)
+def detect_changed_product_fields(sender, instance, update_fields=None, **kwargs):
+    """
+    Record on the instance which watched fields this save writes with a new
+    value (instance._changed_fields; all of them for a new product), for
+    the post_save receivers.
+    """
+    if instance._state.adding:
+        instance._changed_fields = set(PRODUCT_WATCHED_FIELDS)
+        return
+
+    loaded = getattr(instance, "_loaded_values", {})
+    saved_fields = set(PRODUCT_WATCHED_FIELDS) if update_fields is None else set(update_fields) & set(PRODUCT_WATCHED_FIELDS)
+    instance._changed_fields = {
+        field for field in saved_fields
+        if field in instance.__dict__ and (field not in loaded or instance.__dict__[field] != loaded[field])
+    }
+    loaded.update((field, instance.__dict__[field]) for field in instance._changed_fields)
+    instance._loaded_values = loaded
+
+
+def _record_search_changes(product_ids):
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: record_index_changes("search", product_ids))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Specification)
+@receiver(post_delete, sender=Specification)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+def handle_searchable_fields_changed(sender, instance, **kwargs):
+    """
+    Record a product whose searchable text (name, description, category,
+    specification) or price changed in the 'search' change log; every
+    process patches its fuzzy search trigram index for it on the next search.
+    """
+    if sender is Product:
+        if "created" in kwargs and not {"name", "description", "price"} & getattr(instance, "_changed_fields", set()):
+            return
+        _record_search_changes([instance.pk])
+    else:
+        _record_search_changes([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def handle_search_label_changed(sender, instance, **kwargs):
+    """
+    A renamed or deleted category / tag changes the searchable text of
+    every product carrying it (read before a tag deletion drops the links).
+    """
+    if kwargs.get("created"):
+        return
+    if sender is Category:
+        product_ids = ProductCategory.objects.filter(category_id=instance.pk).values_list("product_id", flat=True)
+    else:
+        product_ids = Product.tags.through.objects.filter(tag_id=instance.pk).values_list("product_id", flat=True)
+    _record_search_changes(product_ids)
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(m2m_changed, sender=Product.categories.through)
+def handle_searchable_labels_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Tags / categories added to or removed from products: forward changes
+    touch the product, reverse ones the products in pk_set (for a reverse
+    clear, the products linked before it).
+    """
+    if not reverse:
+        if action in ("post_add", "post_remove", "post_clear"):
+            _record_search_changes([instance.pk])
+        return
+
+    if action in ("post_add", "post_remove"):
+        _record_search_changes(pk_set or [])
+    elif action == "pre_clear":
+        related_field = "tag_id" if sender is Product.tags.through else "category_id"
+        _record_search_changes(
+            sender.objects.filter(**{related_field: instance.pk}).values_list("product_id", flat=True)
+        )
 
 
 @receiver(post_save, sender=Opinion)
@@ -381,9 +637,9 @@ def run_all_analytics_after_order(order):
         order (Order): The newly created order instance
     
     Pipeline Stages:
-        1. Cache Invalidation:
-           - Delete collaborative_similarity_matrix cache
-           - Ensures fresh CF recommendations
+        1. Collaborative Similarity:
+           - Fold the user's purchases into the co-occurrence accumulators
+           - Refresh only the affected product similarities (no full rebuild)
         
         2. Association Rules:
            - Generate Apriori rules from all transactions
@@ -405,7 +661,7 @@ def run_all_analytics_after_order(order):
     
     Process Flow:
         Order Created → run_all_analytics_after_order() →
-        ├─ cache.delete("collaborative_similarity_matrix")
+        ├─ update_collaborative_similarity_for_user()
         ├─ generate_association_rules_after_order()
         ├─ generate_purchase_probabilities_for_user()
         ├─ generate_user_purchase_patterns_for_user()
@@ -449,7 +705,7 @@ def run_all_analytics_after_order(order):
     
     Console Output:
         - "Running analytics for order {id}"
-        - "Invalidated CF cache after order {id}"
+        - "Refreshed collaborative similarities of ..."
         - Progress messages from each analytics function
     
     Error Handling:
@@ -460,7 +716,7 @@ def run_all_analytics_after_order(order):
     Example:
         User places order for "Laptop" (ID=1) + "Mouse" (ID=2) →
         Pipeline runs:
-        1. Delete CF cache
+        1. Refresh Laptop/Mouse collaborative similarities
         2. Generate association rule: Laptop → Mouse (confidence=0.75)
         3. Update user's purchase probability for "Electronics"
         4. Calculate user's RFM scores (frequency +1)
@@ -470,10 +726,8 @@ def run_all_analytics_after_order(order):
     """
     print(f"Running analytics for order {order.id}")
 
-    # Stage 1: Invalidate collaborative filtering cache
-    cache_key = "collaborative_similarity_matrix"
-    cache.delete(cache_key)
-    print(f"Invalidated CF cache after order {order.id}")
+    # Stage 1: Incrementally update collaborative similarities
+    update_collaborative_similarity_for_user(order.user_id)
 
     # Stage 2: Generate association rules (unless skipped)
     if not getattr(order, "_skip_analytics", False):
@@ -510,6 +764,9 @@ def generate_user_recommendations_after_order(user):
         Reads RecommendationSettings.active_algorithm for user:
         - 'collaborative': Uses user-user collaborative filtering
         - 'content_based': Uses product feature similarity
+        - 'collaborative_als': Nothing stored, scored on read from ALS factors
+        - 'hybrid': Nothing stored, blended on read (CustomHybridRecommender)
+        - 'collaborative_user': Neighbor purchases of the precomputed top-K users
         - Default: 'collaborative' if no settings found
     
     Process Flow:
@@ -556,60 +813,40 @@ def generate_user_recommendations_after_order(user):
         - USB Hub: 0.6
     
     Database Updates:
-        Uses update_or_create() for UserProductRecommendation:
+        Replaces the user's UserProductRecommendation set of the algorithm
+        (replace_user_recommendations):
         - user: ForeignKey to User
         - product_id: ID of recommended product
         - recommendation_type: 'collaborative' | 'content_based'
         - score: Float (aggregated similarity score)
     
     Performance:
-        - Queries ProductSimilarity for top 5 per interacted product
-        - Uses defaultdict for efficient score aggregation
-        - Bulk updates via update_or_create (one query per recommendation)
+        - Top 5 neighbors per interacted product from the process-local
+          ProductNeighborIndex (no ProductSimilarity query per product)
+        - One batched INSERT ... ON CONFLICT DO UPDATE for the whole set;
+          products no longer recommended are deleted in the same transaction
     
     Filtering:
-        Automatically excludes products user already owns/has in cart
-        (they're in the source product list, not in recommendations).
+        Products the user already bought or has in the cart are masked out
+        with the user's exclusion bitset (get_user_exclusions).
     """
     # Get user's preferred recommendation algorithm
     settings = RecommendationSettings.objects.filter(user=user).first()
     algorithm = settings.active_algorithm if settings else "collaborative"
+    if algorithm in ("collaborative_als", "hybrid"):
+        # Scored on read (ALS factors / blend of all sources)
+        return
 
-    # Collect all products user has interacted with
-    user_products = []
-    
-    # Add products from past orders
-    orders = Order.objects.filter(user=user)
-    for order in orders:
-        products = order.orderproduct_set.all()
-        user_products.extend([op.product_id for op in products])
-
-    # Add products from current cart
-    cart_items = CartItem.objects.filter(user=user)
-    user_products.extend([item.product_id for item in cart_items])
-
-    # Accumulate similarity scores from all interacted products
-    recommendations = defaultdict(float)
-    for product_id in set(user_products):  # Remove duplicates
-        # Find top 5 most similar products
-        similarities = ProductSimilarity.objects.filter(
-            product1_id=product_id, similarity_type=algorithm
-        ).order_by("-similarity_score")[:5]
-
-        # Add similarity scores (accumulate if product appears multiple times)
-        for similarity in similarities:
-            recommendations[similarity.product2_id] += float(
-                similarity.similarity_score
-            )
-
-    # Store recommendations in database
-    for product_id, score in recommendations.items():
-        UserProductRecommendation.objects.update_or_create(
-            user=user,
-            product_id=product_id,
-            recommendation_type=algorithm,
-            defaults={"score": score},
-        )
+    # Cart and ordered products in two queries (not one per order), the top
+    # 5 neighbors of each from the in-memory index - or the precomputed
+    # neighbors' purchases for collaborative_user - minus what the user owns.
+    # The version is taken before the inputs are read: a concurrent order
+    # leaves the set stale
+    recommendations, version, _ = compute_user_recommendations(user.id, algorithm)
+
+    # Replace the stored recommendation set (bulk upsert + stale row deletion),
+    # stamped with the version of the user's inputs it was computed from
+    replace_user_recommendations(user.id, algorithm, recommendations, version)
 
 
 def generate_association_rules_after_order(order):
@@ -711,7 +948,6 @@ def generate_association_rules_after_order(order):
         # Stage 1: Invalidate all recommendation caches
         cache.delete_many([
             "association_rules_list",
-            "collaborative_similarity_matrix",
             "content_based_similarity_matrix"
         ])
         
@@ -769,6 +1005,7 @@ def generate_association_rules_after_order(order):
 
         # Bulk insert all rules at once
         ProductAssociation.objects.bulk_create(rules_to_create, batch_size=500)
+        bump_neighbor_index_version("association")
         print(f"✅ Created {len(rules_to_create)} association rules")
 
     except Exception as e:
@@ -777,10 +1014,12 @@ def generate_association_rules_after_order(order):
 
 def update_user_cb_recommendations(user):
     """
-    Update content-based recommendations for user based on interaction history.
+    Update content-based recommendations for user based on cart and order history.
     
-    Analyzes user's product interactions (views, cart adds, purchases) and
-    finds similar products using content-based filtering (TF-IDF + cosine similarity).
+    Takes the products the user ordered or has in the cart - the sources
+    recommendation_version digests, so the stored set and its version
+    describe the same inputs - and finds similar products using
+    content-based filtering (TF-IDF + cosine similarity).
     
     Args:
         user (User): The user instance to update recommendations for
@@ -803,17 +1042,18 @@ def update_user_cb_recommendations(user):
            product1, product2, similarity_score, similarity_type='content_based'
     
     Process Flow:
-        1. Get all user interactions (any type: view, cart, purchase)
-        2. Extract unique product IDs from interactions
+        1. Get the user's cart and ordered products (user_source_products)
+        2. Read the content_based neighbor index they are scored on
         3. For each interacted product:
            - Find top 5 similar products (ProductSimilarity)
            - Filter by similarity_type='content_based'
         4. Accumulate similarity scores for each recommended product
-        5. Store in UserProductRecommendation with type='content_based'
+        5. Drop products the user bought or has in the cart (exclusion bitset)
+        6. Store in UserProductRecommendation with type='content_based'
     
     Example:
         User interactions:
-        - Viewed: "Gaming Laptop" (ID=1)
+        - Ordered earlier: "Gaming Laptop" (ID=1)
         - Added to cart: "Mechanical Keyboard" (ID=2)
         - Purchased: "Gaming Mouse" (ID=3)
         
@@ -851,9 +1091,9 @@ def update_user_cb_recommendations(user):
             - score: Float (aggregated similarity score)
     
     Performance:
-        - Uses defaultdict for efficient score aggregation
-        - Queries top 5 similarities per interacted product
-        - update_or_create: one query per recommendation
+        - Top 5 similarities per interacted product from the process-local
+          ProductNeighborIndex, aggregated in one vectorized pass
+        - replace_user_recommendations: batched upsert + stale row deletion
     
     Error Handling:
         - try/except around entire function
@@ -861,35 +1101,14 @@ def update_user_cb_recommendations(user):
         - Invalid data skipped silently
     """
     try:
-        # Get all user's product interactions (any type)
-        user_interactions = UserInteraction.objects.filter(user=user).values_list(
-            "product_id", flat=True
+        # Top 5 content-based neighbors of every cart and ordered product,
+        # owned products excluded, stamped with the index version used
+        recommendations, version, _ = compute_user_recommendations(user.id, "content_based")
+
+        # Replace the stored content-based recommendation set
+        replace_user_recommendations(
+            user.id, "content_based", recommendations, version
         )
-        
-        # Accumulate similarity scores
-        recommendations = defaultdict(float)
-
-        # For each unique interacted product
-        for product_id in set(user_interactions):
-            # Find top 5 content-based similar products
-            similarities = ProductSimilarity.objects.filter(
-                product1_id=product_id, similarity_type="content_based"
-            ).order_by("-similarity_score")[:5]
-
-            # Add similarity scores (accumulate if product appears multiple times)
-            for similarity in similarities:
-                recommendations[similarity.product2_id] += float(
-                    similarity.similarity_score
-                )
-
-        # Store content-based recommendations in database
-        for product_id, score in recommendations.items():
-            UserProductRecommendation.objects.update_or_create(
-                user=user,
-                product_id=product_id,
-                recommendation_type="content_based",
-                defaults={"score": score},
-            )
 
     except Exception as e:
         print(f"Error updating content-based recommendations: {e}")
@@ -951,10 +1170,9 @@ def update_content_based_similarity():
         3. Return count of similarities created
     
     When to Run:
-        - Product metadata changed (name, description, price)
-        - New products added to catalog
+        - Initial catalog load / bulk imports
         - Manual cache refresh requested
-        - Triggered by handle_product_changes signal
+        - Product edits use update_content_based_similarity_for_products()
     
     Performance Considerations:
         - Complexity: O(n²) where n = number of products
@@ -988,7 +1206,6 @@ def update_content_based_similarity():
     
     Integration:
         Used by:
-        - handle_product_changes signal (automatic)
         - Admin panel "Regenerate Similarities" button (manual)
         - Management command: python manage.py generate_similarities
     """
@@ -1007,3 +1224,65 @@ def update_content_based_similarity():
         # Log error but don't raise (graceful failure)
         print(Fore.RED + f"Error in content-based similarity: {e}")
         return 0
+
+
+def update_content_based_similarity_for_products(product_ids):
+    """
+    Incrementally refresh content-based similarities around changed products.
+    
+    Recomputes only the products' rows and columns of the similarity graph
+    (see CustomContentBasedFilter.update_similarities_for_products) instead
+    of invalidating the full matrix and rebuilding every pair.
+    
+    Args:
+        product_ids (list): IDs of the created/edited products
+    
+    Returns:
+        int: Number of similarity records written (0 on failure)
+    
+    Integration:
+        Used by (once per transaction, see _schedule_content_refresh):
+        - handle_product_changes signal (description/price edits)
+        - handle_product_features_changed signal (tags/categories edits)
+        - handle_product_category_changes signal (direct ProductCategory writes)
+    """
+    try:
+        content_filter = CustomContentBasedFilter()
+        similarity_count = content_filter.update_similarities_for_products(product_ids)
+        return similarity_count
+
+    except Exception as e:
+        print(Fore.RED + f"Error refreshing content-based similarity for products {product_ids}: {e}")
+        return 0
+
+
+def update_collaborative_similarity_for_user(user_id):
+    """
+    Incrementally refresh collaborative similarities after a user's order.
+    
+    Folds the user's purchases into the co-occurrence accumulators and
+    recomputes only the affected rows of the similarity graph (see
+    CustomCollaborativeFilter.update_similarities_for_user) instead of
+    invalidating the matrix and rebuilding it from every order in history.
+    
+    A fold rewrites up to P(P - 1)/2 accumulator rows (P = distinct products
+    of the buyer), so it runs on the background worker pool, not on the
+    order's request. A fold the pool drops (full, or one already queued for
+    the buyer) is not lost: the next fold diffs the buyer's orders against
+    the last snapshot and includes it.
+    
+    Args:
+        user_id (int): ID of the buyer
+    
+    Returns:
+        bool: True if the fold was queued
+    
+    Integration:
+        Used by:
+        - run_all_analytics_after_order (stage 1)
+    """
+    return submit_background_task(
+        f"collaborative_cooccurrence_fold_{user_id}",
+        CustomCollaborativeFilter().update_similarities_for_user,
+        user_id,
+    )
@@ -0,0 +1,422 @@
+"""
+Block-Partitioned Similarity Scoring for Product Similarity Builders.
+
+Shared numeric kernels of the content-based and collaborative similarity
+builds. Products are split into row blocks; each block is scored against
+the catalog through an inverted index, one column block at a time, and
+reduced to its top-K neighbors. Block sizes follow a memory budget
+(including the retained top-K pairs); block results beyond the budget
+spill to memory-mapped files. Blocks can be scored in a process pool,
+with the index shared between workers through memory-mapped .npy files;
+workers write their results to files and return only where they are.
+
+This module deliberately imports nothing from Django, so pool workers
+(fork or spawn) never set up the ORM.
+
+This module provides:
+1. Top-K neighbor selection per row
+2. Memory-budgeted row/column block planning with out-of-core spill
+3. Candidate pair scoring for a set of rows
+4. Parallel block scoring with a memory-mapped inverted index
+"""
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+
+def select_top_k_per_row(rows, columns, scores, top_k):
+    """
+    Keep the top_k highest-scoring pairs of every row.
+
+    Bounded neighbor retention for the similarity graph: each product keeps
+    at most top_k neighbors regardless of how dense its region of the
+    catalog is. Ties are broken by the lower column index.
+
+    Args:
+        rows, columns, scores: Parallel arrays of candidate pairs
+        top_k (int|None): Neighbors kept per row (None = keep all)
+
+    Returns:
+        tuple: (rows, columns, scores) sorted by row, then score descending
+    """
+    if len(rows) == 0:
+        return rows, columns, scores
+
+    order = np.lexsort((columns, -scores, rows))
+    rows, columns, scores = rows[order], columns[order], scores[order]
+    if top_k is None:
+        return rows, columns, scores
+
+    row_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    row_lengths = np.diff(np.r_[row_starts, len(rows)])
+    rank = np.arange(len(rows)) - np.repeat(row_starts, row_lengths)
+
+    keep = rank < top_k
+    return rows[keep], columns[keep], scores[keep]
+
+
+# Peak bytes per scored pair of a block product: COO row/column/data arrays
+# plus the CSR product they are converted from
+BYTES_PER_SCORED_PAIR = 48
+
+# Narrowest column block worth a sparse product pass
+MIN_COLUMN_BLOCK = 1024
+
+
+def plan_blocks(n_rows, n_columns, block_size, memory_budget_mb, top_k=None):
+    """
+    Choose row and column block sizes that fit a memory budget.
+
+    The worst case of one block product is block_rows × column_block
+    scored pairs (every row shares a feature with every column). With
+    top-K, the running top-K of the block (up to 2 × top_k pairs per row
+    while merging) is held next to it and counts against the same budget.
+
+    Args:
+        n_rows, n_columns (int): Shape of the item × item problem
+        block_size (int): Preferred rows per block
+        memory_budget_mb (float|None): Budget per block product (None = unbounded)
+        top_k (int|None): Neighbors kept per row
+
+    Returns:
+        tuple: (rows per block, [(column_start, column_stop)])
+    """
+    if memory_budget_mb is None or n_columns == 0:
+        return block_size, [(0, n_columns)]
+
+    budget_pairs = max(1, int(memory_budget_mb * 1024 * 1024) // BYTES_PER_SCORED_PAIR)
+    retained_per_row = 0 if top_k is None else 2 * min(top_k, n_columns)
+    block_rows = max(1, min(
+        block_size, budget_pairs // (min(n_columns, MIN_COLUMN_BLOCK) + retained_per_row)
+    ))
+    column_width = max(1, min(n_columns, budget_pairs // block_rows - retained_per_row))
+
+    column_blocks = [
+        (start, min(start + column_width, n_columns))
+        for start in range(0, n_columns, column_width)
+    ]
+    return block_rows, column_blocks
+
+
+def split_postings(postings, column_blocks):
+    """Cut the postings matrix into one CSR matrix per column block"""
+    if len(column_blocks) == 1:
+        return [(0, postings)]
+
+    postings_by_column = postings.tocsc()
+    return [
+        (start, postings_by_column[:, start:stop].tocsr())
+        for start, stop in column_blocks
+    ]
+
+
+class PairSpillBuffer:
+    """
+    Accumulate scored pairs, spilling to disk beyond a memory budget.
+
+    Pairs are kept in memory until they exceed memory_budget_bytes; they are
+    then appended to raw files in directory and handed back as read-only
+    np.memmap arrays, so an unbounded (no top-K) block never has to fit in
+    RAM at once.
+    """
+
+    def __init__(self, memory_budget_bytes=None, directory=None):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.directory = directory
+        self.chunks = []
+        self.buffered_bytes = 0
+        self.spilled_count = 0
+        self.dtypes = (np.int64, np.int64, np.float64)
+
+    def append(self, rows, columns, scores):
+        if len(rows) == 0:
+            return
+
+        self.chunks.append(tuple(
+            np.asarray(values, dtype=dtype)
+            for values, dtype in zip((rows, columns, scores), self.dtypes)
+        ))
+        self.buffered_bytes += len(rows) * 24
+
+        if (
+            self.directory is not None
+            and self.memory_budget_bytes is not None
+            and self.buffered_bytes > self.memory_budget_bytes
+        ):
+            self._spill()
+
+    def _path(self, position):
+        return os.path.join(self.directory, f"spill_{position}.bin")
+
+    def _spill(self):
+        for position in range(3):
+            with open(self._path(position), "ab") as handle:
+                for chunk in self.chunks:
+                    handle.write(chunk[position].tobytes())
+
+        self.spilled_count += sum(len(chunk[0]) for chunk in self.chunks)
+        self.chunks = []
+        self.buffered_bytes = 0
+
+    def spill(self):
+        """
+        Write every buffered pair to the files.
+
+        Returns:
+            int: Number of pairs in the files (see open)
+        """
+        if self.chunks:
+            self._spill()
+        return self.spilled_count
+
+    def arrays(self):
+        """All pairs as (rows, columns, scores): in memory, or memory-mapped if spilled"""
+        if self.spilled_count == 0:
+            if not self.chunks:
+                return tuple(np.empty(0, dtype=dtype) for dtype in self.dtypes)
+            return tuple(
+                np.concatenate([chunk[position] for chunk in self.chunks])
+                for position in range(3)
+            )
+
+        return PairSpillBuffer.open(self.directory, self.spill())
+
+    @staticmethod
+    def open(directory, count):
+        """Memory-map the first count pairs spilled to directory (read-only)"""
+        buffer = PairSpillBuffer(directory=directory)
+        if count == 0:
+            return buffer.arrays()
+        return tuple(
+            np.memmap(buffer._path(position), dtype=dtype, mode="r", shape=(count,))
+            for position, dtype in enumerate(buffer.dtypes)
+        )
+
+
+def _score_postings_block(block_rows_matrix, row_indices, postings_block, column_start,
+                          capped_weights, threshold):
+    """Score rows against one column block of the postings"""
+    block = block_rows_matrix.dot(postings_block).tocoo()
+
+    rows = row_indices[block.row]
+    columns = block.col.astype(np.int64) + column_start
+    scores = block.data
+
+    if capped_weights.shape[1]:
+        scores = scores + np.einsum(
+            "ij,ij->i", capped_weights[rows], capped_weights[columns]
+        )
+
+    keep = rows != columns
+    if threshold is not None:
+        keep &= scores > threshold
+    return rows[keep], columns[keep], scores[keep]
+
+
+def score_candidate_pairs(inverted_index, row_indices, threshold, top_k,
+                          postings_blocks=None, memory_budget_mb=None, spill_directory=None,
+                          spill_buffer=None):
+    """
+    Score rows against their candidates and keep the top-K per row.
+
+    With several postings blocks the rows are scored one column block at a
+    time; each partial result is merged into a running top-K (at most
+    2 × top_k pairs per row in memory). The result (all pairs without
+    top-K) accumulates in a PairSpillBuffer that spills to spill_directory
+    beyond the budget.
+
+    Args:
+        inverted_index (tuple): (indexed CSR [n × f], postings CSR [f × n],
+            dense weights of features left out of the index [n × c])
+        row_indices: Rows to score
+        threshold (float|None): Minimum score kept (None = no minimum)
+        top_k (int|None): Neighbors kept per row (None = keep all)
+        postings_blocks (list|None): Output of split_postings (None = one block)
+        memory_budget_mb (float|None): In-memory budget for unbounded results
+        spill_directory (str|None): Where results may spill
+        spill_buffer (PairSpillBuffer|None): Buffer to fill instead (the
+            caller collects the pairs from it; returns None)
+
+    Returns:
+        tuple: (row indices, column indices, scores), self-pairs excluded
+    """
+    indexed_matrix, postings, capped_weights = inverted_index
+    row_indices = np.asarray(row_indices, dtype=np.int64)
+    block_rows_matrix = indexed_matrix[row_indices]
+    if postings_blocks is None:
+        postings_blocks = [(0, postings)]
+
+    if top_k is not None:
+        best = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0))
+        for column_start, postings_block in postings_blocks:
+            partial = _score_postings_block(
+                block_rows_matrix, row_indices, postings_block, column_start,
+                capped_weights, threshold,
+            )
+            if len(postings_blocks) == 1:
+                best = select_top_k_per_row(*partial, top_k)
+            else:
+                best = select_top_k_per_row(
+                    *(np.concatenate(pair) for pair in zip(best, partial)), top_k
+                )
+        if spill_buffer is None and (memory_budget_mb is None or spill_directory is None):
+            return best
+
+    collect = spill_buffer is None
+    if collect:
+        memory_budget_bytes = (
+            int(memory_budget_mb * 1024 * 1024) if memory_budget_mb is not None else None
+        )
+        spill_buffer = PairSpillBuffer(memory_budget_bytes, spill_directory)
+    if top_k is not None:
+        spill_buffer.append(*best)
+        return spill_buffer.arrays() if collect else None
+
+    for column_start, postings_block in postings_blocks:
+        spill_buffer.append(*_score_postings_block(
+            block_rows_matrix, row_indices, postings_block, column_start,
+            capped_weights, threshold,
+        ))
+    return spill_buffer.arrays() if collect else None
+
+
+def _share_inverted_index(inverted_index, directory):
+    """Write the index arrays as .npy files workers can memory-map"""
+    indexed_matrix, postings, capped_weights = inverted_index
+    for name, matrix in (("indexed", indexed_matrix), ("postings", postings)):
+        np.save(os.path.join(directory, f"{name}_data.npy"), matrix.data)
+        np.save(os.path.join(directory, f"{name}_indices.npy"), matrix.indices)
+        np.save(os.path.join(directory, f"{name}_indptr.npy"), matrix.indptr)
+        np.save(os.path.join(directory, f"{name}_shape.npy"), np.asarray(matrix.shape))
+    np.save(os.path.join(directory, "capped_weights.npy"), capped_weights)
+
+
+_shared_index_cache = {}
+
+
+def _open_shared_inverted_index(directory):
+    """Memory-map the index written by _share_inverted_index (once per worker)"""
+    if directory not in _shared_index_cache:
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        matrices = []
+        for name in ("indexed", "postings"):
+            matrices.append(
+                sparse.csr_matrix(
+                    (
+                        load(f"{name}_data.npy"),
+                        load(f"{name}_indices.npy"),
+                        load(f"{name}_indptr.npy"),
+                    ),
+                    shape=tuple(load(f"{name}_shape.npy")),
+                    copy=False,
+                )
+            )
+        _shared_index_cache.clear()
+        _shared_index_cache[directory] = (matrices[0], matrices[1], load("capped_weights.npy"))
+
+    return _shared_index_cache[directory]
+
+
+def _score_shared_block(task):
+    """
+    Pool worker: score rows [start, stop) of the shared index.
+
+    The pairs are written to a fresh spill directory (in chunks of the
+    memory budget) rather than returned, so they are neither held in the
+    worker nor pickled to the parent.
+
+    Returns:
+        tuple: (spill directory, number of pairs) for PairSpillBuffer.open
+    """
+    directory, start, stop, threshold, top_k, column_blocks, memory_budget_mb = task
+    inverted_index = _open_shared_inverted_index(directory)
+
+    cache_key = (directory, tuple(column_blocks))
+    if cache_key not in _shared_postings_blocks:
+        _shared_postings_blocks.clear()
+        _shared_postings_blocks[cache_key] = split_postings(inverted_index[1], column_blocks)
+
+    spill_directory = tempfile.mkdtemp(dir=directory)
+    try:
+        spill_buffer = PairSpillBuffer(
+            int(memory_budget_mb * 1024 * 1024) if memory_budget_mb is not None else None,
+            spill_directory,
+        )
+        score_candidate_pairs(
+            inverted_index, np.arange(start, stop), threshold, top_k,
+            _shared_postings_blocks[cache_key], spill_buffer=spill_buffer,
+        )
+        return spill_directory, spill_buffer.spill()
+    except BaseException:
+        shutil.rmtree(spill_directory, ignore_errors=True)
+        raise
+
+
+_shared_postings_blocks = {}
+
+
+def score_blocks(inverted_index, block_size, threshold, top_k, workers=1, memory_budget_mb=None):
+    """
+    Score every row of the index block by block.
+
+    Row and column block sizes are planned from memory_budget_mb (per
+    process, retained top-K pairs included), so one block product never
+    exceeds the budget; block results beyond the budget spill to
+    memory-mapped files.
+
+    With workers > 1 the blocks are scored in a process pool; the index is
+    written once to a temporary directory and memory-mapped by every worker,
+    so it is shared through the page cache instead of being pickled per task.
+    Workers return the spill file of each block; the parent memory-maps it
+    and deletes it once the consumer has moved on to the next block.
+
+    Args:
+        inverted_index (tuple): See score_candidate_pairs
+        block_size (int): Preferred rows per block
+        threshold (float|None): Minimum score kept
+        top_k (int|None): Neighbors kept per row
+        workers (int): Worker processes (1 = score in this process)
+        memory_budget_mb (float|None): Memory budget per process (None = unbounded)
+
+    Yields:
+        tuple: (start, stop, (rows, columns, scores)) per block, in row order
+    """
+    n_rows = inverted_index[0].shape[0]
+    n_columns = inverted_index[1].shape[1]
+    block_rows, column_blocks = plan_blocks(n_rows, n_columns, block_size, memory_budget_mb, top_k)
+    bounds = [
+        (start, min(start + block_rows, n_rows))
+        for start in range(0, n_rows, block_rows)
+    ]
+
+    with tempfile.TemporaryDirectory(prefix="similarity_blocks_") as directory:
+        if workers <= 1 or len(bounds) <= 1:
+            postings_blocks = split_postings(inverted_index[1], column_blocks)
+            for start, stop in bounds:
+                spill_directory = tempfile.mkdtemp(dir=directory)
+                yield start, stop, score_candidate_pairs(
+                    inverted_index, np.arange(start, stop), threshold, top_k,
+                    postings_blocks, memory_budget_mb, spill_directory,
+                )
+                shutil.rmtree(spill_directory, ignore_errors=True)
+            return
+
+        _share_inverted_index(inverted_index, directory)
+        tasks = [
+            (directory, start, stop, threshold, top_k, column_blocks, memory_budget_mb)
+            for start, stop in bounds
+        ]
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(bounds))) as executor:
+            for (start, stop), (spill_directory, count) in zip(
+                bounds, executor.map(_score_shared_block, tasks)
+            ):
+                yield start, stop, PairSpillBuffer.open(spill_directory, count)
+                shutil.rmtree(spill_directory, ignore_errors=True)
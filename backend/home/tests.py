@@ -10,4 +10,941 @@ recommendation algorithms. Tests ensure correctness of business logic
 and API endpoints.
 """
 
-from django.test import TestCase
+import os
+import random
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from scipy import sparse
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import signals
+from .custom_recommendation_engine import (
+    CustomCollaborativeFilter,
+    CustomContentBasedFilter,
+    CustomFuzzySearch,
+    CustomImplicitALS,
+    CustomInteractionMatrixBuilder,
+    CustomUserBasedFilter,
+    ProductTrigramIndex,
+    load_npz_model,
+    replace_user_recommendations,
+    sync_product_similarities,
+)
+from .edit_distance import levenshtein_distance
+from .models import (
+    Category,
+    CooccurrenceRebuild,
+    Order,
+    OrderProduct,
+    Product,
+    ProductCooccurrence,
+    ProductInteractionNorm,
+    ProductSimilarity,
+    Tag,
+    User,
+    UserCooccurrenceState,
+    UserInteraction,
+    UserProductRecommendation,
+)
+from .product_exclusions import ProductBitset, invalidate_user_exclusions
+from . import hybrid_recommender, recommendation_pipeline, recommendation_serving
+from .recommendation_serving import (
+    bump_neighbor_index_version,
+    diversify_recommendations,
+    get_neighbor_index,
+    read_through_recommendations,
+    recommendation_is_fresh,
+)
+from .similarity_blocks import score_blocks
+
+
+def full_levenshtein(s1, s2):
+    """Reference edit distance: the full O(n·m) dynamic programming table"""
+    table = [[i + j if i * j == 0 else 0 for j in range(len(s2) + 1)] for i in range(len(s1) + 1)]
+    for i in range(1, len(s1) + 1):
+        for j in range(1, len(s2) + 1):
+            table[i][j] = min(
+                table[i - 1][j] + 1,
+                table[i][j - 1] + 1,
+                table[i - 1][j - 1] + (s1[i - 1] != s2[j - 1]),
+            )
+    return table[len(s1)][len(s2)]
+
+
+class SparseCosineTests(SimpleTestCase):
+    """Block-partitioned CSR cosine scoring against dense pairwise cosines"""
+
+    def setUp(self):
+        random_state = np.random.RandomState(7)
+        self.matrix = sparse.random(120, 40, density=0.08, format="csr", random_state=random_state)
+        self.content_filter = CustomContentBasedFilter()
+        self.content_filter.max_feature_postings = None
+
+        dense = self.matrix.toarray()
+        norms = np.linalg.norm(dense, axis=1)
+        normalized = np.divide(dense, norms[:, None], out=np.zeros_like(dense), where=norms[:, None] > 0)
+        self.expected = normalized.dot(normalized.T)
+        np.fill_diagonal(self.expected, 0.0)
+
+    def _inverted_index(self):
+        return self.content_filter._build_inverted_index(self.content_filter._normalize_rows(self.matrix))
+
+    def test_candidate_pairs_match_brute_force(self):
+        rows, columns, scores = self.content_filter._similarity_pairs_for_rows(
+            self._inverted_index(), np.arange(self.matrix.shape[0]), retain_top_k=False
+        )
+
+        scored = np.zeros_like(self.expected)
+        scored[rows, columns] = scores
+        expected = np.where(self.expected > (self.content_filter.similarity_threshold or 0.0), self.expected, 0.0)
+        np.testing.assert_allclose(scored, expected, atol=1e-12)
+
+    def test_capped_features_still_score_candidates(self):
+        # Sharing only a long posting list does not make a candidate, but
+        # the capped weights are part of every candidate's exact cosine
+        self.content_filter.max_feature_postings = 12
+        rows, columns, scores = self.content_filter._similarity_pairs_for_rows(
+            self._inverted_index(), np.arange(self.matrix.shape[0]), retain_top_k=False
+        )
+
+        self.assertGreater(len(rows), 0)
+        self.assertLess(len(rows), np.count_nonzero(self.expected))
+        np.testing.assert_allclose(scores, self.expected[rows, columns], atol=1e-12)
+
+    def test_budgeted_top_k_blocks_match_brute_force(self):
+        top_k = 5
+        for workers, memory_budget_mb in ((1, None), (1, 0.01), (2, 0.01)):
+            neighbors = {}
+            for _, _, (rows, columns, scores) in score_blocks(
+                self._inverted_index(), 32, 0.0, top_k, workers=workers, memory_budget_mb=memory_budget_mb
+            ):
+                for row, column, score in zip(np.array(rows), np.array(columns), np.array(scores)):
+                    neighbors.setdefault(int(row), []).append((int(column), float(score)))
+
+            for row in range(self.matrix.shape[0]):
+                # Compared by score: equal cosines may differ in the last bits
+                expected = np.sort(self.expected[row][self.expected[row] > 0])[::-1][:top_k]
+                got = neighbors.get(row, [])
+                np.testing.assert_allclose([score for _, score in got], expected, atol=1e-12)
+                np.testing.assert_allclose(
+                    [score for _, score in got], self.expected[row, [column for column, _ in got]], atol=1e-12
+                )
+
+
+class ContentRefreshSignalTests(TestCase):
+    """Content similarity refreshes scheduled by product signals"""
+
+    def setUp(self):
+        patcher = mock.patch.object(signals, "update_content_based_similarity_for_products")
+        self.refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_refresh_per_transaction(self):
+        category = Category.objects.create(name="Laptops")
+        tag = Tag.objects.create(name="gaming")
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name="Laptop", description="Fast notebook", price=100)
+            product.categories.add(category)
+            product.tags.add(tag)
+
+        self.refresh.assert_called_once_with([product.id])
+
+    def test_unchanged_fields_do_not_refresh(self):
+        product = Product.objects.create(name="Laptop", description="Fast notebook", price=100)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(id=product.id).save()
+            product.name = "Renamed laptop"
+            product.save()
+
+        self.refresh.assert_not_called()
+
+    def test_rolled_back_ids_are_dropped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            kept = Product.objects.create(name="Kept", description="Stays", price=2)
+            try:
+                with transaction.atomic():
+                    Product.objects.create(name="Discarded", description="Gone", price=1)
+                    raise RuntimeError("rollback")
+            except RuntimeError:
+                pass
+
+        self.refresh.assert_called_once_with([kept.id])
+
+        self.refresh.reset_mock()
+        try:
+            with transaction.atomic():
+                Product.objects.create(name="Discarded again", description="Gone", price=1)
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+        with self.captureOnCommitCallbacks(execute=True):
+            later = Product.objects.create(name="Later", description="Stays", price=3)
+
+        self.refresh.assert_called_once_with([later.id])
+
+
+class SimilarityDeltaSyncTests(TestCase):
+    """sync_product_similarities writes only what changed"""
+
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f"Product {position}", price=10 + position) for position in range(4)
+        ]
+
+    def _edges(self, scores):
+        return [(self.products[a].id, self.products[b].id, score) for (a, b), score in scores.items()]
+
+    def test_write_counts(self):
+        source_ids = [self.products[0].id, self.products[1].id]
+        scores = {(0, 1): 0.9, (0, 2): 0.5, (1, 0): 0.9, (1, 3): 0.2}
+
+        stats = sync_product_similarities("content_based", source_ids, self._edges(scores))
+        self.assertEqual((stats["created"], stats["updated"], stats["deleted"], stats["unchanged"]), (4, 0, 0, 0))
+
+        stats = sync_product_similarities("content_based", source_ids, self._edges(scores))
+        self.assertEqual((stats["created"], stats["updated"], stats["deleted"], stats["unchanged"]), (0, 0, 0, 4))
+
+        # Moved beyond score_epsilon, moved within it, dropped, added
+        scores = {(0, 1): 0.8, (0, 2): 0.5004, (1, 2): 0.3}
+        stats = sync_product_similarities("content_based", source_ids, self._edges(scores))
+        self.assertEqual((stats["created"], stats["updated"], stats["deleted"], stats["unchanged"]), (1, 1, 2, 1))
+
+        stored = set(
+            ProductSimilarity.objects.filter(similarity_type="content_based").values_list(
+                "product1_id", "product2_id"
+            )
+        )
+        self.assertEqual(stored, {(product1_id, product2_id) for product1_id, product2_id, _ in self._edges(scores)})
+
+
+def create_orders(user, baskets):
+    """Orders of user, one per basket of products, without firing signals"""
+    orders = Order.objects.bulk_create([Order(user=user, status="completed") for _ in baskets])
+    OrderProduct.objects.bulk_create([
+        OrderProduct(order=order, product=product, quantity=1)
+        for order, basket in zip(orders, baskets)
+        for product in basket
+    ])
+
+
+class CooccurrenceFoldTests(TestCase):
+    """Incremental co-occurrence folds against a full rebuild"""
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(5)]
+        self.users = [User.objects.create(username=f"buyer{position}", email=f"buyer{position}@example.com") for position in range(3)]
+        p = self.products
+        create_orders(self.users[0], [[p[0], p[1]], [p[2]]])
+        create_orders(self.users[1], [[p[1], p[2], p[3]]])
+        create_orders(self.users[2], [[p[0], p[3], p[4]]])
+        self.collaborative_filter = CustomCollaborativeFilter()
+        self.collaborative_filter.rebuild_cooccurrence()
+
+    def _accumulators(self):
+        dot_products = {
+            (product1_id, product2_id): dot_product
+            for product1_id, product2_id, dot_product in ProductCooccurrence.objects.values_list(
+                "product1_id", "product2_id", "dot_product"
+            )
+        }
+        norms = dict(ProductInteractionNorm.objects.values_list("product_id", "squared_norm"))
+        return dot_products, norms
+
+    def _assert_accumulators_equal(self, first, second):
+        for folded, rebuilt in zip(first, second):
+            self.assertEqual(set(folded), set(rebuilt))
+            for key, value in rebuilt.items():
+                self.assertAlmostEqual(folded[key], value, places=9)
+
+    def test_fold_matches_rebuild(self):
+        p = self.products
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=Order.objects.create(user=self.users[0], status="completed"), product=product, quantity=2)
+            for product in (p[2], p[4])
+        ])
+        user = User.objects.create(username="newcomer", email="newcomer@example.com")
+        create_orders(user, [[p[1], p[4]]])
+
+        changed = self.collaborative_filter.apply_user_purchases(self.users[0].id)
+        self.assertEqual(changed, {p[0].id, p[1].id, p[2].id, p[4].id})
+        self.collaborative_filter.apply_user_purchases(user.id)
+        self.assertEqual(self.collaborative_filter.apply_user_purchases(user.id), set())
+        folded = self._accumulators()
+
+        self.collaborative_filter.rebuild_cooccurrence()
+        self._assert_accumulators_equal(folded, self._accumulators())
+
+    def test_fold_skips_during_rebuild(self):
+        before = self._accumulators()
+        UserCooccurrenceState.objects.all().delete()
+        marker = CooccurrenceRebuild.objects.create()
+        create_orders(self.users[1], [[self.products[4]]])
+
+        self.assertEqual(self.collaborative_filter.apply_user_purchases(self.users[1].id), set())
+        self.assertFalse(UserCooccurrenceState.objects.exists())
+        self._assert_accumulators_equal(self._accumulators(), before)
+
+        # A marker left by a crashed rebuild stops counting after its timeout
+        CooccurrenceRebuild.objects.filter(id=marker.id).update(started_at=marker.started_at - timedelta(hours=3))
+        self.collaborative_filter.apply_user_purchases(self.users[1].id)
+        self.assertTrue(UserCooccurrenceState.objects.filter(user=self.users[1]).exists())
+
+
+class ImplicitALSSolveTests(SimpleTestCase):
+    """Batched ALS half-steps against per-row normal equations"""
+
+    def test_solve_matches_normal_equations(self):
+        random_state = np.random.RandomState(5)
+        feedback = sparse.random(30, 12, density=0.3, format="csr", random_state=random_state) * 4
+        fixed_factors = random_state.normal(size=(12, 4))
+        als = CustomImplicitALS()
+
+        expected = np.zeros((30, 4))
+        for row in range(30):
+            confidence = 1 + als.alpha * feedback[row].toarray().ravel()
+            preference = (feedback[row].toarray().ravel() > 0).astype(float)
+            lhs = fixed_factors.T.dot(confidence[:, None] * fixed_factors) + als.regularization * np.eye(4)
+            expected[row] = np.linalg.solve(lhs, fixed_factors.T.dot(confidence * preference))
+
+        for solve_batch_size, memory_budget_mb in ((512, None), (4, 0.0005)):
+            als.solve_batch_size, als.memory_budget_mb = solve_batch_size, memory_budget_mb
+            np.testing.assert_allclose(als._solve_factors(feedback, fixed_factors), expected, atol=1e-9)
+
+
+class ImplicitALSTests(TestCase):
+    """Training and serving of the implicit ALS factors"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RECOMMENDATION_MODEL_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(4)]
+        p = self.products
+        self.users = [User.objects.create(username=f"als{position}", email=f"als{position}@example.com") for position in range(7)]
+        for user in self.users[:3]:
+            create_orders(user, [[p[0], p[1]]])
+        for user in self.users[3:6]:
+            create_orders(user, [[p[2], p[3]]])
+        create_orders(self.users[6], [[p[0]]])
+
+        self.als = CustomImplicitALS()
+        self.als.factors = 2
+
+    def test_train_and_recommend(self):
+        stats = self.als.train()
+        self.assertEqual((stats["users"], stats["products"], stats["feedback_cells"]), (7, 4, 13))
+
+        recommendations = self.als.recommend(self.users[6].id, n=3)
+        self.assertEqual(recommendations[0][0], self.products[1].id)
+        self.assertNotIn(self.products[0].id, [product_id for product_id, _ in recommendations])
+
+        batch = self.als.recommend_for_users([self.users[6].id, self.users[0].id], n=3)
+        self.assertEqual(
+            [product_id for product_id, _ in batch[self.users[6].id]], [product_id for product_id, _ in recommendations]
+        )
+        np.testing.assert_allclose(
+            [score for _, score in batch[self.users[6].id]], [score for _, score in recommendations], atol=1e-12
+        )
+        self.assertEqual(
+            {product_id for product_id, _ in batch[self.users[0].id]}, {self.products[2].id, self.products[3].id}
+        )
+
+    def test_untrained_users_are_folded_in(self):
+        self.assertEqual(self.als.recommend(self.users[0].id), [])
+        self.als.train()
+
+        newcomer = User.objects.create(username="als_new", email="als_new@example.com")
+        self.assertEqual(self.als.recommend(newcomer.id), [])
+
+        create_orders(newcomer, [[self.products[2]]])
+        recommendations = self.als.recommend(newcomer.id, n=2)
+        self.assertEqual(recommendations[0][0], self.products[3].id)
+        self.assertNotIn(self.products[2].id, [product_id for product_id, _ in recommendations])
+
+
+class InteractionMatrixBuilderTests(TestCase):
+    """Time-decayed interaction matrix and its high-water mark"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RECOMMENDATION_MODEL_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.now = timezone.now()
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(2)]
+        self.user = User.objects.create(username="viewer", email="viewer@example.com")
+        self.builder = CustomInteractionMatrixBuilder({"view": 1.0, "add_to_cart": 2.0}, half_life_days=10)
+
+    def _event(self, product, interaction_type, days_ago):
+        event = UserInteraction.objects.create(user=self.user, product=product, interaction_type=interaction_type)
+        UserInteraction.objects.filter(id=event.id).update(timestamp=self.now - timedelta(days=days_ago))
+        return event
+
+    def _dense(self, now):
+        matrix, user_ids, product_ids = self.builder.build(now=now)
+        self.assertEqual(user_ids.tolist(), [self.user.id])
+        return matrix.toarray()[0]
+
+    def test_values_halve_every_half_life(self):
+        self._event(self.products[0], "view", 0)
+        self._event(self.products[0], "add_to_cart", 10)
+        self._event(self.products[1], "view", 20)
+        self._event(self.products[1], "purchase", 0)
+
+        np.testing.assert_allclose(self._dense(self.now), [1.0 + 2.0 * 0.5, 0.25])
+        np.testing.assert_allclose(self._dense(self.now + timedelta(days=10)), [1.0, 0.125])
+
+    def test_updates_fold_only_new_events(self):
+        self._event(self.products[0], "view", 0)
+        np.testing.assert_allclose(self._dense(self.now), [1.0, 0.0])
+
+        self._event(self.products[1], "add_to_cart", 0)
+        np.testing.assert_allclose(self._dense(self.now), [1.0, 2.0])
+        self.assertEqual(self.builder.last_appended_events, 1)
+
+        np.testing.assert_allclose(self._dense(self.now), [1.0, 2.0])
+        self.assertEqual(self.builder.last_appended_events, 0)
+
+        # An event committed below the high-water mark is folded once, from the overlap window
+        late = self._event(self.products[0], "view", 0)
+        UserInteraction.objects.filter(id=late.id).update(id=late.id + 1000)
+        state = self.builder.load_state()
+        state["high_water_mark"] = np.int64(late.id + 1001)
+        self.builder.save_state(state)
+        np.testing.assert_allclose(self._dense(self.now), [2.0, 2.0])
+        np.testing.assert_allclose(self._dense(self.now), [2.0, 2.0])
+
+        # rebuild() rescans: deleted events disappear
+        UserInteraction.objects.filter(id=late.id + 1000).delete()
+        self.builder.rebuild(self.now)
+        np.testing.assert_allclose(self._dense(self.now), [1.0, 2.0])
+
+
+class UserBasedFilterTests(TestCase):
+    """Precomputed user neighbors and their recommendations"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(RECOMMENDATION_MODEL_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(5)]
+        p = self.products
+        self.users = [User.objects.create(username=f"knn{position}", email=f"knn{position}@example.com") for position in range(4)]
+        for user, basket in zip(self.users, ([p[0], p[1]], [p[0], p[1], p[2]], [p[0], p[3]], [p[4]])):
+            create_orders(user, [basket])
+
+        self.user_filter = CustomUserBasedFilter()
+        self.user_filter.top_k_neighbors = 2
+
+    def test_neighbors_match_brute_force(self):
+        stats = self.user_filter.build_neighbors()
+        store = load_npz_model(self.user_filter.model_path)
+        self.assertEqual(stats["users"], 4)
+
+        purchases = np.zeros((4, 5))
+        for row, user in enumerate(self.users):
+            for product_id in OrderProduct.objects.filter(order__user=user).values_list("product_id", flat=True):
+                purchases[row, [product.id for product in self.products].index(product_id)] = 1
+        normalized = purchases / np.linalg.norm(purchases, axis=1)[:, None]
+        cosines = normalized.dot(normalized.T)
+        np.fill_diagonal(cosines, 0)
+
+        indptr = store["neighbor_indptr"]
+        for row in range(4):
+            scores = store["neighbor_scores"][indptr[row]:indptr[row + 1]]
+            expected = np.sort(cosines[row][cosines[row] > 0])[::-1][:2]
+            np.testing.assert_allclose(np.sort(scores)[::-1], expected, rtol=1e-6)
+            np.testing.assert_allclose(scores, cosines[row, store["neighbor_indices"][indptr[row]:indptr[row + 1]]], rtol=1e-6)
+
+    def test_recommend_weights_neighbor_purchases(self):
+        self.user_filter.build_neighbors()
+        p = self.products
+
+        recommendations = self.user_filter.recommend(self.users[0].id, n=5)
+        similar, other = 2 / np.sqrt(6), 0.5
+        self.assertEqual([product_id for product_id, _ in recommendations], [p[2].id, p[3].id])
+        np.testing.assert_allclose(
+            [score for _, score in recommendations], [similar / (similar + other), other / (similar + other)], rtol=1e-6
+        )
+        self.assertEqual(self.user_filter.recommend(self.users[3].id), [])
+
+        # Not in the store: neighbors scored on the fly from current purchases
+        newcomer = User.objects.create(username="knn_new", email="knn_new@example.com")
+        create_orders(newcomer, [[p[2]]])
+        self.assertEqual(self.user_filter.recommend(newcomer.id), [(p[0].id, 1.0), (p[1].id, 1.0)])
+
+
+@override_settings(NEIGHBOR_INDEX_MIN_RELOAD_SECONDS=0)
+class ProductNeighborIndexTests(TestCase):
+    """In-memory similarity graph: aggregation and version-driven reloads"""
+
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(4)]
+        self._add_edges((0, 1, 0.9), (0, 2, 0.5), (0, 3, 0.2), (1, 2, 0.4))
+
+    def _add_edges(self, *edges):
+        ProductSimilarity.objects.bulk_create([
+            ProductSimilarity(
+                product1=self.products[a], product2=self.products[b],
+                similarity_type="collaborative", similarity_score=score,
+            )
+            for a, b, score in edges
+        ])
+        bump_neighbor_index_version("collaborative")
+
+    def test_aggregate_sums_top_neighbors(self):
+        index = get_neighbor_index("collaborative")
+        p = [product.id for product in self.products]
+
+        expected = {p[1]: 0.9, p[2]: 0.9}
+        self.assertEqual(index.aggregate([p[0], p[1], p[0]], per_product=2), expected)
+        self.assertEqual(index.aggregate([p[3]]), {})
+        self.assertEqual(index.neighbors(p[0], limit=2), [(p[1], 0.9), (p[2], 0.5)])
+
+        many = index.aggregate_many([[p[0], p[1]], [], [p[1]]], per_product=2)
+        self.assertEqual(many[0], expected)
+        self.assertEqual(many[1:], [{}, {p[2]: 0.4}])
+
+    def test_reload_on_version_bump(self):
+        index = get_neighbor_index("collaborative")
+        self.assertIs(get_neighbor_index("collaborative"), index)
+
+        self._add_edges((3, 0, 0.7))
+        reloaded = get_neighbor_index("collaborative")
+        self.assertIsNot(reloaded, index)
+        self.assertEqual(reloaded.neighbors(self.products[3].id), [(self.products[0].id, 0.7)])
+
+        # Within the reload window a bump keeps serving the loaded index
+        with override_settings(NEIGHBOR_INDEX_MIN_RELOAD_SECONDS=3600):
+            self._add_edges((3, 1, 0.6))
+            self.assertIs(get_neighbor_index("collaborative"), reloaded)
+
+
+class ReplaceUserRecommendationsTests(TestCase):
+    """Bulk replacement of a user's stored recommendation set"""
+
+    def setUp(self):
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(4)]
+        self.user = User.objects.create(username="stored", email="stored@example.com")
+        self.other = User.objects.create(username="other", email="other@example.com")
+
+    def _stored(self, user, recommendation_type="collaborative"):
+        return {
+            product_id: (float(score), version)
+            for product_id, score, version in UserProductRecommendation.objects.filter(
+                user=user, recommendation_type=recommendation_type
+            ).values_list("product_id", "score", "version")
+        }
+
+    def test_write_counts(self):
+        p = [product.id for product in self.products]
+        replace_user_recommendations(self.other.id, "collaborative", {p[0]: 0.5}, "other")
+        replace_user_recommendations(self.user.id, "content_based", {p[0]: 0.5}, "content")
+
+        counts = replace_user_recommendations(self.user.id, "collaborative", {p[0]: 0.9, p[1]: 0.5, p[2]: 0.1}, "first")
+        self.assertEqual((counts["written"], counts["deleted"]), (3, 0))
+
+        # Updated, kept, dropped, added
+        counts = replace_user_recommendations(
+            self.user.id, "collaborative", {p[0]: 0.7, p[1]: 0.5, p[3]: 150.0}, "second"
+        )
+        self.assertEqual((counts["written"], counts["deleted"]), (3, 1))
+        self.assertEqual(
+            self._stored(self.user), {p[0]: (0.7, "second"), p[1]: (0.5, "second"), p[3]: (99.999, "second")}
+        )
+
+        counts = replace_user_recommendations(self.user.id, "collaborative", {}, "third")
+        self.assertEqual((counts["written"], counts["deleted"]), (0, 3))
+        self.assertEqual(self._stored(self.other), {p[0]: (0.5, "other")})
+        self.assertEqual(self._stored(self.user, "content_based"), {p[0]: (0.5, "content")})
+
+
+@override_settings(NEIGHBOR_INDEX_MIN_RELOAD_SECONDS=0)
+class GenerateRecommendationsCommandTests(TestCase):
+    """Batch generation of stored recommendation sets"""
+
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(4)]
+        self.users = [User.objects.create(username=f"user{position}", email=f"user{position}@example.com") for position in range(3)]
+        for user, product in zip(self.users, self.products):
+            create_orders(user, [[product]])
+
+        ProductSimilarity.objects.bulk_create([
+            ProductSimilarity(
+                product1=self.products[a], product2=self.products[b],
+                similarity_type="collaborative", similarity_score=score,
+            )
+            for a, b, score in ((0, 1, 0.9), (0, 3, 0.5), (1, 3, 0.4), (2, 0, 0.7))
+        ])
+        bump_neighbor_index_version("collaborative")
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = os.path.join(directory.name, "checkpoint.json")
+
+    def _generate(self, **options):
+        call_command(
+            "generate_recommendations", algorithm=["collaborative"], checkpoint=self.checkpoint,
+            workers=1, stdout=StringIO(), **options
+        )
+
+    def _stored(self, user):
+        return dict(
+            UserProductRecommendation.objects.filter(
+                user=user, recommendation_type="collaborative"
+            ).values_list("product_id", "version")
+        )
+
+    def test_batch_written_sets_are_fresh(self):
+        self._generate()
+
+        self.assertEqual(set(self._stored(self.users[0])), {self.products[1].id, self.products[3].id})
+        for user in self.users:
+            for version in self._stored(user).values():
+                self.assertTrue(recommendation_is_fresh(version, user.id, "collaborative"))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_skips_finished_users(self):
+        with open(self.checkpoint, "w") as checkpoint_file:
+            checkpoint_file.write(f'{{"collaborative": {self.users[0].id}}}')
+
+        self._generate(resume=True, chunk_size=1)
+
+        self.assertEqual(self._stored(self.users[0]), {})
+        self.assertEqual(set(self._stored(self.users[1])), {self.products[3].id})
+        self.assertEqual(set(self._stored(self.users[2])), {self.products[0].id})
+
+
+@override_settings(NEIGHBOR_INDEX_MIN_RELOAD_SECONDS=0)
+class ReadThroughRecommendationTests(TestCase):
+    """Freshness of stored sets in read_through_recommendations"""
+
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name=f"Product {position}", price=10) for position in range(3)]
+        self.user = User.objects.create(username="reader", email="reader@example.com")
+        create_orders(self.user, [[self.products[0]]])
+        ProductSimilarity.objects.bulk_create([
+            ProductSimilarity(
+                product1=self.products[0], product2=self.products[a],
+                similarity_type="collaborative", similarity_score=score,
+            )
+            for a, score in ((1, 0.9), (2, 0.4))
+        ])
+        bump_neighbor_index_version("collaborative")
+        get_neighbor_index("collaborative")
+
+        patcher = mock.patch.object(recommendation_serving, "schedule_recommendation_write_back")
+        self.write_back = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _store(self):
+        scores, version, _ = recommendation_serving.compute_user_recommendations(self.user.id, "collaborative")
+        UserProductRecommendation.objects.bulk_create([
+            UserProductRecommendation(
+                user=self.user, product_id=product_id, recommendation_type="collaborative",
+                score=score, version=version,
+            )
+            for product_id, score in scores.items()
+        ])
+        return version
+
+    def test_fresh_set_is_served(self):
+        version = self._store()
+        UserProductRecommendation.objects.filter(product=self.products[2]).update(score=0.95)
+
+        ranked = read_through_recommendations(self.user.id, "collaborative")
+        self.assertEqual(ranked, [(self.products[2].id, 0.95), (self.products[1].id, 0.9)])
+        self.assertTrue(recommendation_is_fresh(version, self.user.id, "collaborative"))
+        self.write_back.assert_not_called()
+
+    def test_order_makes_set_stale(self):
+        version = self._store()
+        create_orders(self.user, [[self.products[1]]])
+        invalidate_user_exclusions(self.user.id)
+
+        self.assertFalse(recommendation_is_fresh(version, self.user.id, "collaborative"))
+        ranked = read_through_recommendations(self.user.id, "collaborative")
+        self.assertEqual(ranked, [(self.products[2].id, 0.4)])
+        self.write_back.assert_called_once()
+
+    def test_index_update_serves_stored_set_until_loaded(self):
+        version = self._store()
+        UserProductRecommendation.objects.filter(product=self.products[2]).update(score=0.95)
+        ProductSimilarity.objects.filter(product2=self.products[2]).update(similarity_score=0.1)
+        bump_neighbor_index_version("collaborative")
+        self.assertFalse(recommendation_is_fresh(version, self.user.id, "collaborative"))
+
+        with mock.patch.object(recommendation_serving.ProductNeighborIndex, "load") as load:
+            ranked = read_through_recommendations(self.user.id, "collaborative")
+        load.assert_not_called()
+        self.assertEqual(ranked, [(self.products[2].id, 0.95), (self.products[1].id, 0.9)])
+        self.write_back.assert_called_once_with(self.user.id, "collaborative")
+
+        # Once the index is loaded, the stale set is recomputed on read
+        get_neighbor_index("collaborative")
+        ranked = read_through_recommendations(self.user.id, "collaborative")
+        self.assertEqual(ranked, [(self.products[1].id, 0.9), (self.products[2].id, 0.1)])
+
+
+class HybridBlendTests(SimpleTestCase):
+    """Score blending and latency budgets of CustomHybridRecommender"""
+
+    def setUp(self):
+        patcher = mock.patch.object(hybrid_recommender, "user_source_products", return_value=([], True))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.recommender = hybrid_recommender.CustomHybridRecommender()
+        self.recommender.weights = {"collaborative": 0.6, "markov": 0.4}
+        self.recommender.budgets_ms = {"collaborative": 2000, "markov": 50}
+        self.recommender.max_in_flight_per_source = 1
+        self.user = mock.Mock(id=1)
+
+    def test_blend_normalizes_per_source(self):
+        candidates = {"collaborative": {1: 4.0, 2: 2.0}, "markov": {2: 0.5, 3: 0.25}}
+
+        blended = self.recommender.blend(candidates, n=3)
+        self.assertEqual([product_id for product_id, _ in blended], [2, 1, 3])
+        np.testing.assert_allclose([score for _, score in blended], [0.7, 0.6, 0.2])
+
+        excluded = self.recommender.blend(candidates, n=3, exclusions=ProductBitset.from_ids([2]))
+        self.assertEqual([product_id for product_id, _ in excluded], [1, 3])
+        self.assertEqual(self.recommender.blend({}), [])
+
+    def test_slow_source_is_dropped(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        self.recommender._collaborative = lambda user, products: {1: 4.0, 2: 2.0}
+        self.recommender._markov = lambda user, products: release.wait(5) and {3: 1.0}
+
+        recommendations = self.recommender.blend(self.recommender.gather(self.user), n=3)
+        self.assertEqual(self.recommender.last_report, {"collaborative": "ok", "markov": "timeout"})
+        # Weights renormalized over the sources that answered
+        self.assertEqual(recommendations, [(1, 1.0), (2, 0.5)])
+
+        # Still running from the first call: not submitted again
+        self.recommender.gather(self.user)
+        self.assertEqual(self.recommender.last_report["markov"], "busy")
+
+
+class DiversifyRecommendationsTests(SimpleTestCase):
+    """Maximal marginal relevance re-ranking against a pairwise reference"""
+
+    def _patch_vectors(self, vectors_by_product):
+        normalized = {
+            product_id: vector / np.linalg.norm(vector) for product_id, vector in vectors_by_product.items()
+        }
+        index = mock.Mock()
+        index.candidate_vectors = lambda product_ids: np.array([normalized[product_id] for product_id in product_ids])
+        patcher = mock.patch.object(recommendation_serving, "get_product_vector_index", return_value=index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return normalized
+
+    def test_near_duplicates_are_pushed_down(self):
+        self._patch_vectors({1: np.array([1.0, 0.0]), 2: np.array([0.99, 0.1]), 3: np.array([0.0, 1.0])})
+        ranked = [(1, 1.0), (2, 0.95), (3, 0.6)]
+
+        self.assertEqual(diversify_recommendations(ranked, 3, diversity=0.5), [(1, 1.0), (3, 0.6), (2, 0.95)])
+        self.assertEqual(diversify_recommendations(ranked, 2, diversity=0), ranked[:2])
+
+    def test_matches_pairwise_mmr(self):
+        random_state = np.random.RandomState(13)
+        normalized = self._patch_vectors({product_id: random_state.rand(6) for product_id in range(1, 41)})
+        ranked = [(product_id, float(score)) for product_id, score in zip(range(1, 41), random_state.rand(40))]
+
+        for diversity in (0.2, 0.7):
+            peak = max(score for _, score in ranked)
+            expected, remaining = [], list(ranked)
+            while len(expected) < 12:
+                best = max(
+                    remaining,
+                    key=lambda candidate: (1 - diversity) * candidate[1] / peak - diversity * max(
+                        [normalized[candidate[0]].dot(normalized[chosen]) for chosen, _ in expected] or [0.0]
+                    ),
+                )
+                expected.append(best)
+                remaining.remove(best)
+            self.assertEqual(diversify_recommendations(ranked, 12, diversity), expected)
+
+
+class CandidateGenerationTests(SimpleTestCase):
+    """Stage 1 of CandidateRankingPipeline: bounds, ordering and exclusions"""
+
+    def setUp(self):
+        sources = {
+            "collaborative": {10: 2.0, 11: 1.0, 12: 0.5},
+            "content_based": {11: 4.0, 13: 4.0},
+            "association": {14: 1.0, 15: 0.5, 16: 0.1},
+        }
+        patches = (
+            mock.patch.object(
+                recommendation_pipeline, "get_neighbor_index",
+                side_effect=lambda source: mock.Mock(aggregate=lambda products, per_product: sources[source]),
+            ),
+            mock.patch.object(recommendation_pipeline, "user_source_products", return_value=([1, 2], True)),
+            mock.patch.object(
+                recommendation_pipeline, "get_user_exclusions", return_value=ProductBitset.from_ids([12, 20])
+            ),
+            mock.patch.object(
+                recommendation_pipeline, "get_popular_products",
+                side_effect=lambda limit: [20, 10, 30, 31, 32, 33, 34, 35][:limit],
+            ),
+        )
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.pipeline = recommendation_pipeline.CandidateRankingPipeline()
+        self.pipeline.candidate_limit = 5
+        self.pipeline.popular_share = 0.2
+
+    def test_personalized_candidates_then_popular(self):
+        user = mock.Mock(id=1, is_authenticated=True)
+
+        # Σ of max-normalized scores, ties by id; 12 and 20 are owned
+        self.assertEqual(self.pipeline.generate_candidates(user), [11, 10, 13, 14, 30])
+        self.assertEqual(self.pipeline.candidate_count, 5)
+
+        self.pipeline.candidate_limit = 10
+        candidates = self.pipeline.generate_candidates(user)
+        self.assertEqual(candidates, [11, 10, 13, 14, 15, 16, 30, 31, 32, 33])
+        self.assertNotIn(12, candidates)
+
+    def test_guests_get_popular_products(self):
+        self.assertEqual(self.pipeline.generate_candidates(), [20, 10, 30, 31, 32])
+        self.assertEqual(self.pipeline.generate_candidates(mock.Mock(is_authenticated=False)), [20, 10, 30, 31, 32])
+
+
+class ProductBitsetTests(SimpleTestCase):
+    """Exclusion masking against np.isin"""
+
+    def test_mask_matches_isin(self):
+        random_state = np.random.RandomState(3)
+        owned = random_state.choice(5000, size=300, replace=False)
+        candidates = np.r_[random_state.randint(-5, 6000, size=2000), owned[:50]]
+
+        bitset = ProductBitset.from_ids(owned.tolist())
+        np.testing.assert_array_equal(bitset.mask(candidates), ~np.isin(candidates, owned))
+        self.assertEqual(len(bitset), len(owned))
+
+        restored = ProductBitset.from_bytes(bitset.to_bytes())
+        np.testing.assert_array_equal(restored.contains(candidates), np.isin(candidates, owned))
+
+    def test_filters_keep_order(self):
+        bitset = ProductBitset.from_ids([2, 9])
+        ranked = [(9, 0.9), (4, 0.8), (2, 0.7), (1, 0.1)]
+
+        self.assertEqual(bitset.filter_ranked(ranked), [(4, 0.8), (1, 0.1)])
+        self.assertEqual(bitset.filter_scores(dict(ranked)), {4: 0.8, 1: 0.1})
+        self.assertEqual(ProductBitset().filter_ranked(ranked), ranked)
+
+
+class ProductTrigramIndexTests(TestCase):
+    """Trigram candidate generation for fuzzy search"""
+
+    def setUp(self):
+        self.laptop = Product.objects.create(name="Gaming Laptop", description="Fast notebook", price=4000)
+        self.mouse = Product.objects.create(name="Gaming Mouse", description="Wireless", price=150)
+        self.chair = Product.objects.create(name="Office Chair", description="Ergonomic seat", price=900)
+        self.weights = {"name": 1.0, "description": 0.5}
+
+    def test_candidates_rank_shared_trigrams(self):
+        index = ProductTrigramIndex().build()
+
+        self.assertEqual(index.candidates("gaming laptop", 3, self.weights)[0], self.laptop.id)
+        self.assertEqual(set(index.candidates("gaming", 3, self.weights)[:2]), {self.laptop.id, self.mouse.id})
+        self.assertEqual(index.candidates("office", 3, self.weights)[0], self.chair.id)
+
+    def test_price_filter_applies_before_limit(self):
+        index = ProductTrigramIndex().build()
+
+        candidates = index.candidates("gaming", 1, self.weights, price_filter=lambda prices: prices < 1000)
+        self.assertEqual(candidates, [self.mouse.id])
+
+    def test_patched_index_matches_rebuild(self):
+        index = ProductTrigramIndex().build()
+        Product.objects.filter(id=self.chair.id).update(name="Gaming Chair")
+
+        patched = index.patched([self.chair.id], index.log_position)
+        rebuilt = ProductTrigramIndex().build()
+        for query in ("gaming", "chair", "office"):
+            self.assertEqual(
+                patched.candidates(query, 3, self.weights), rebuilt.candidates(query, 3, self.weights)
+            )
+
+    def test_fields_of_unread_products_are_dropped(self):
+        # A product committed between the products query and the category
+        # query: its category must not land on a neighbor's row
+        category = Category.objects.create(name="Office")
+        self.chair.categories.add(category)
+        unread = Product.objects.exclude(id=self.chair.id)
+        with mock.patch.object(Product.objects, "all", return_value=unread):
+            index = ProductTrigramIndex().build()
+
+        self.assertNotIn(self.chair.id, index.field_products.tolist())
+        self.assertEqual(len(index.field_products), 4)
+
+    def test_search_cache_is_keyed_by_candidates(self):
+        cache.clear()
+        fuzzy_search = CustomFuzzySearch()
+
+        cheap = fuzzy_search.search_products("gaming", [self.mouse], 0.1)
+        expensive = fuzzy_search.search_products("gaming", [self.laptop], 0.1)
+        self.assertEqual([result["product"].id for result in cheap], [self.mouse.id])
+        self.assertEqual([result["product"].id for result in expensive], [self.laptop.id])
+
+
+class LevenshteinDistanceTests(SimpleTestCase):
+    """Bit-parallel and banded edit distance against the full DP table"""
+
+    def _random_pairs(self):
+        rng = random.Random(11)
+        for length in (0, 1, 5, 20, 63, 64, 65, 90, 150):
+            for _ in range(6):
+                s1 = "".join(rng.choice("abcde") for _ in range(length))
+                s2 = list(s1)
+                for _ in range(rng.randint(0, 6)):
+                    position = rng.randint(0, len(s2))
+                    operation = rng.choice(("insert", "delete", "substitute"))
+                    if operation == "insert" or not s2:
+                        s2.insert(position, rng.choice("abcdef"))
+                    elif operation == "delete":
+                        del s2[min(position, len(s2) - 1)]
+                    else:
+                        s2[min(position, len(s2) - 1)] = rng.choice("abcdef")
+                yield s1, "".join(s2)
+
+    def test_exact_distance(self):
+        for s1, s2 in self._random_pairs():
+            self.assertEqual(levenshtein_distance(s1, s2), full_levenshtein(s1, s2), (s1, s2))
+
+    def test_bounded_distance(self):
+        for s1, s2 in self._random_pairs():
+            expected = full_levenshtein(s1, s2)
+            for max_distance in (0, 2, 5):
+                distance = levenshtein_distance(s1, s2, max_distance)
+                if expected <= max_distance:
+                    self.assertEqual(distance, expected, (s1, s2, max_distance))
+                else:
+                    self.assertGreater(distance, max_distance, (s1, s2, max_distance))
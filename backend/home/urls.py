@@ -183,6 +183,7 @@ from .recommendation_views import (
     CollaborativeFilteringDebugView,
     AllCollaborativeSimilaritiesView,
     ContentBasedDebugView,
+    SimilarProductsLSHView,
 )
 
 from .sentiment_views import (
@@ -378,6 +379,11 @@ urlpatterns = [
         ContentBasedDebugView.as_view(),
         name="content-based-debug",
     ),
+    path(
+        "api/similar-products/",
+        SimilarProductsLSHView.as_view(),
+        name="similar-products",
+    ),
     path(
         "api/fuzzy-logic-debug/",
         FuzzyLogicDebugView.as_view(),
@@ -937,14 +937,38 @@ class RecommendedProductsAPIView(APIView):
             settings = RecommendationSettings.objects.filter(user=user).first()
             algorithm = settings.active_algorithm if settings else "collaborative"
             
-            user_recommendations = UserProductRecommendation.objects.filter(
-                user=user,
-                recommendation_type=algorithm
-            ).select_related('product').order_by('-score')[:12]
+            from .product_exclusions import get_user_exclusions
+            from .recommendation_serving import diversify_recommendations, diversity_pool_size
             
-            if user_recommendations.exists():
-                recommended_products = [rec.product for rec in user_recommendations]
+            # Score a wider candidate pool, then re-rank it for diversity (MMR)
+            pool_size = diversity_pool_size(12)
+            
+            if algorithm == "collaborative_als":
+                from .custom_recommendation_engine import CustomImplicitALS
+                
+                ranked = CustomImplicitALS().recommend(user.id, n=pool_size)
+            elif algorithm == "hybrid":
+                from .hybrid_recommender import CustomHybridRecommender
+                
+                ranked = CustomHybridRecommender().recommend(user, n=pool_size)
+            elif algorithm in ("collaborative", "content_based", "collaborative_user"):
+                from .recommendation_serving import read_through_recommendations
+                
+                # Stored set while the user's inputs and the index version are unchanged, else recomputed
+                ranked = read_through_recommendations(user.id, algorithm, n=pool_size)
             else:
+                ranked = list(UserProductRecommendation.objects.filter(
+                    user=user,
+                    recommendation_type=algorithm
+                ).order_by('-score', 'product_id').values_list('product_id', 'score')[:pool_size])
+            
+            # Stored sets may predate the user's latest purchases / cart adds
+            ranked = get_user_exclusions(user.id).filter_ranked(ranked)
+            
+            product_ids = [product_id for product_id, _ in diversify_recommendations(ranked, 12)]
+            products_by_id = Product.objects.in_bulk(product_ids)
+            recommended_products = [products_by_id[pid] for pid in product_ids if pid in products_by_id]
+            if not recommended_products:
                 recommended_products = self.get_fallback_recommendations(user)
             
             serializer = ProductSerializer(recommended_products, many=True)